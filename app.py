@@ -24,6 +24,18 @@ def register_cli_commands(app: Flask) -> None:
         from migrations.add_folder_summary import register_migration_command as register_folder_summary_command
         register_folder_summary_command(app)
 
+        from migrations.add_document_pages import register_migration_command as register_document_pages_command
+        register_document_pages_command(app)
+
+        from migrations.prune_document_analyses import register_migration_command as register_prune_analyses_command
+        register_prune_analyses_command(app)
+
+        from migrations.backfill_search_index import register_migration_command as register_search_index_command
+        register_search_index_command(app)
+
+        from job_queue import register_job_commands
+        register_job_commands(app)
+
         from migrations.migrate_uploads import migrate_uploads
 
         @app.cli.command('migrate-uploads')
@@ -161,7 +173,8 @@ def create_app(config_name: Optional[str] = None) -> Flask:
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login'
     login_manager.login_message_category = 'info'
-    socketio.init_app(app)
+    # With several worker processes, emits are relayed through the message queue (e.g. Redis)
+    socketio.init_app(app, message_queue=app.config.get('SOCKETIO_MESSAGE_QUEUE'))
     csrf.init_app(app)
     logger.debug("CSRF protection initialized")
 
@@ -253,6 +266,10 @@ def create_app(config_name: Optional[str] = None) -> Flask:
             db.create_all()
             logger.debug("Successfully created database tables")
 
+            from search_index import ensure_search_index, register_search_index_events
+            ensure_search_index()
+            register_search_index_events()
+
             if User.query.count() == 0:
                 admin_user = User(
                     username="admin",
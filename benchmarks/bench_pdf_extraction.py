@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+PDF extraction benchmark
+
+Compares the single-pass extraction engine in pdf_reader against the previous
+extraction path, which opened the same file four times (PyPDF2 for text,
+PyPDF2 for the page count, PyMuPDF for images and PyPDF2 again to split the
+text by page in Document.process_pdf_images).
+
+Usage:
+    python -m benchmarks.bench_pdf_extraction [--pdf PATH] [--pages N] [--repeat N] [--workers N]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+import fitz  # PyMuPDF
+import PyPDF2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdf_reader import extract_pdf_content  # noqa: E402
+from benchmarks.synthetic import make_pdf  # noqa: E402
+
+
+def legacy_extract_pdf_content(pdf_path: str) -> Dict[str, Any]:
+    """Reproduction of the pre-single-pass extraction path, used as the baseline."""
+    with open(pdf_path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        text = ""
+        for page in reader.pages:
+            text += page.extract_text() + "\n\n"
+    with open(pdf_path, 'rb') as file:
+        page_count = len(PyPDF2.PdfReader(file).pages)
+    images = []
+    doc = fitz.open(pdf_path)
+    for page_num, page in enumerate(doc):
+        for img_info in page.get_images(full=True):
+            base_image = doc.extract_image(img_info[0])
+            images.append({'data': base_image["image"], 'format': base_image["ext"], 'page_num': page_num + 1})
+    doc.close()
+    # Document.process_pdf_images re-opened the file to split text by page
+    with open(pdf_path, 'rb') as file:
+        pages = [page.extract_text() for page in PyPDF2.PdfReader(file).pages]
+    return {'text': text, 'pages': pages, 'images': images, 'page_count': page_count}
+
+
+def time_call(func: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    """Run func repeat times and return timing statistics in seconds."""
+    timings: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark PDF extraction paths")
+    parser.add_argument('--pdf', help="PDF to benchmark (a synthetic one is generated if omitted)")
+    parser.add_argument('--pages', type=int, default=120, help="Pages in the synthetic PDF")
+    parser.add_argument('--images-per-page', type=int, default=1, help="Images per page in the synthetic PDF")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per path")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Process pool size for the parallel path")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = args.pdf or make_pdf(os.path.join(tmp_dir, 'synthetic.pdf'), pages=args.pages,
+                                        images_per_page=args.images_per_page)
+
+        legacy = time_call(lambda: legacy_extract_pdf_content(pdf_path), args.repeat)
+        single_pass = time_call(lambda: extract_pdf_content(pdf_path, extract_images=True), args.repeat)
+        parallel = time_call(lambda: extract_pdf_content(pdf_path, extract_images=True, parallel=True,
+                                                         max_workers=args.workers, min_parallel_pages=1), args.repeat)
+
+    print(f"PDF: {args.pdf or f'synthetic ({args.pages} pages)'}, {args.repeat} runs each")
+    print(f"{'path':<14}{'min (s)':>10}{'median (s)':>12}{'mean (s)':>10}")
+    for name, stats in (('legacy', legacy), ('single-pass', single_pass), ('parallel', parallel)):
+        print(f"{name:<14}{stats['min']:>10.3f}{stats['median']:>12.3f}{stats['mean']:>10.3f}")
+    print(f"Speed-up vs legacy (median): single-pass {legacy['median'] / single_pass['median']:.2f}x, "
+          f"parallel ({args.workers} workers) {legacy['median'] / parallel['median']:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+"""
+Benchmark suite
+
+Times the PDF extraction functions in pdf_reader, upload hashing and saving in
+Document, and FolderSummary.calculate_folder_hash against a seeded temporary
+SQLite database. The llm_paths group runs PDF analysis and folder summaries end
+to end against the fake LLM provider, so it needs no network. All inputs are
+generated with fixed seeds so runs on the same machine are comparable. Results are written as JSON; pass a previous results
+file with --compare to flag regressions (exit status 1 if any are found).
+
+Usage:
+    python -m benchmarks.run_benchmarks [--output results.json] [--compare baseline.json]
+                                        [--threshold 0.15] [--repeat N] [--quick]
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from werkzeug.datastructures import FileStorage  # noqa: E402
+
+from config import TestingConfig  # noqa: E402
+from extensions import db  # noqa: E402
+from pdf_reader import extract_pdf_text, extract_pdf_images, extract_pdf_content  # noqa: E402
+from benchmarks.bench_pdf_extraction import time_call  # noqa: E402
+from benchmarks.synthetic import make_image_bytes, make_pdf  # noqa: E402
+
+# (pages, images per page) for the synthetic PDFs
+PDF_MATRIX = [(10, 0), (50, 1), (200, 1), (50, 4)]
+QUICK_PDF_MATRIX = [(10, 0), (20, 1)]
+
+# (width, height) of synthetic PNG uploads
+IMAGE_SIZES = [(320, 240), (1280, 960), (2560, 1920)]
+QUICK_IMAGE_SIZES = [(320, 240), (1280, 960)]
+
+# Documents per folder in the seeded database
+FOLDER_SIZES = [10, 100, 1000]
+QUICK_FOLDER_SIZES = [10, 100]
+
+# Real PDFs (count, pages each) uploaded for the end-to-end LLM path benchmarks
+LLM_FOLDER = (8, 5)
+QUICK_LLM_FOLDER = (3, 3)
+
+# Fake provider latency for llm_paths (fixed, so the numbers measure our pipeline and concurrency)
+FAKE_LATENCY_MS = 50
+
+
+def create_benchmark_app(root_dir: str) -> Flask:
+    """Minimal app over a temporary SQLite file; uploads land under root_dir/static/uploads."""
+    app = Flask(__name__, root_path=root_dir, instance_path=os.path.join(root_dir, 'instance'))
+    app.config.from_object(TestingConfig)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(root_dir, 'benchmark.db')}"
+    app.config['UPLOAD_FOLDER'] = os.path.join(root_dir, 'static', 'uploads')
+    app.config['PDF_CACHE_ENABLED'] = False
+    app.config['IMAGE_PREP_ENABLED'] = False
+    app.config['LLM_PROVIDER'] = 'fake'
+    app.config['LLM_FAKE_LATENCY_MS'] = FAKE_LATENCY_MS
+    app.config['LLM_FAKE_LATENCY_SIGMA'] = 0.0
+    app.config['LLM_FAKE_CHUNK_DELAY_MS'] = 0
+    app.config['GEMINI_RATE_LIMIT_RPM'] = 1000000
+    app.config['GEMINI_RATE_LIMIT_BURST'] = 1000000
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    db.init_app(app)
+    return app
+
+
+def seed_database(folder_sizes: List[int]) -> Tuple[int, Dict[int, int]]:
+    """
+    Create one user with a folder per requested size, each holding that many document rows.
+
+    Returns:
+        Tuple[int, Dict[int, int]]: The user id and a mapping of folder size to folder id
+    """
+    from models import User, Folder, Document
+
+    db.create_all()
+    user = User(username='benchmark', email='benchmark@example.com')
+    user.set_password('benchmark')
+    db.session.add(user)
+    db.session.flush()
+
+    folder_ids = {}
+    for size in folder_sizes:
+        folder = Folder(name=f'Folder with {size} documents', user_id=user.id)
+        db.session.add(folder)
+        db.session.flush()
+        folder_ids[size] = folder.id
+        db.session.add_all(
+            Document(
+                filename=f'record_{size}_{i}_{uuid.UUID(int=size * 100000 + i).hex}.pdf',
+                original_filename=f'record_{i}.pdf',
+                file_type='pdf',
+                file_size=1024 + i,
+                file_path=f'uploads/{folder.id}/record_{size}_{i}.pdf',
+                folder_id=folder.id,
+                user_id=user.id,
+                content_hash=uuid.UUID(int=size * 100000 + i).hex * 2
+            )
+            for i in range(size)
+        )
+    db.session.commit()
+    return user.id, folder_ids
+
+
+def bench_pdf_reader(tmp_dir: str, matrix: List[Tuple[int, int]], repeat: int) -> Dict[str, Dict[str, Any]]:
+    results = {}
+    for pages, images_per_page in matrix:
+        pdf_path = make_pdf(os.path.join(tmp_dir, f'bench_{pages}p_{images_per_page}i.pdf'), pages=pages,
+                            images_per_page=images_per_page)
+        params = {'pages': pages, 'images_per_page': images_per_page, 'file_size': os.path.getsize(pdf_path)}
+        for name, func in (
+            ('extract_pdf_text', lambda: extract_pdf_text(pdf_path)),
+            ('extract_pdf_images', lambda: extract_pdf_images(pdf_path)),
+            ('extract_pdf_content', lambda: extract_pdf_content(pdf_path, extract_images=True)),
+        ):
+            results[f'pdf_reader.{name}[{pages}p,{images_per_page}i]'] = dict(time_call(func, repeat), params=params)
+    return results
+
+
+def bench_compute_file_hash(image_sizes: List[Tuple[int, int]], repeat: int) -> Dict[str, Dict[str, Any]]:
+    from models import Document
+
+    results = {}
+    for width, height in image_sizes:
+        data = make_image_bytes((width, height), seed=width)
+        stream = io.BytesIO(data)
+        results[f'Document.compute_file_hash[{width}x{height}]'] = dict(
+            time_call(lambda: Document.compute_file_hash(stream), repeat),
+            params={'bytes': len(data)}
+        )
+    return results
+
+
+def bench_save_file(image_sizes: List[Tuple[int, int]], repeat: int, user_id: int) -> Dict[str, Dict[str, Any]]:
+    from models import Document
+
+    results = {}
+    for width, height in image_sizes:
+        # save_file rejects duplicate content, so every timed run gets a distinct image
+        payloads = iter([make_image_bytes((width, height), seed=width * 1000 + i) for i in range(repeat)])
+
+        def save_one() -> None:
+            data = next(payloads)
+            upload = FileStorage(stream=io.BytesIO(data), filename='scan.png', content_type='image/png')
+            document = Document(user_id=user_id, folder_id=None)
+            document.save_file(upload)
+            db.session.add(document)
+            db.session.commit()
+
+        results[f'Document.save_file[{width}x{height}]'] = dict(
+            time_call(save_one, repeat),
+            params={'bytes': len(make_image_bytes((width, height), seed=width * 1000))}
+        )
+    return results
+
+
+def bench_folder_hash(folder_ids: Dict[int, int], repeat: int) -> Dict[str, Dict[str, Any]]:
+    from models import FolderSummary
+
+    results = {}
+    for size, folder_id in folder_ids.items():
+        results[f'FolderSummary.calculate_folder_hash[{size}docs]'] = dict(
+            time_call(lambda: FolderSummary.calculate_folder_hash(folder_id), repeat),
+            params={'documents': size}
+        )
+    return results
+
+
+def bench_llm_paths(tmp_dir: str, folder_spec: Tuple[int, int], repeat: int, user_id: int) -> Dict[str, Dict[str, Any]]:
+    """PDF analysis and folder summaries end to end with the fake provider, cold and warm."""
+    from models import Folder, Document, DocumentAnalysis, FolderSummary, FolderDocumentDigest
+
+    count, pages = folder_spec
+    folder = Folder(name='LLM benchmark folder', user_id=user_id)
+    db.session.add(folder)
+    db.session.commit()
+    document_ids = []
+    for i in range(count):
+        pdf_path = make_pdf(os.path.join(tmp_dir, f'llm_{i}.pdf'), pages=pages, images_per_page=1, seed=500 + i)
+        with open(pdf_path, 'rb') as f:
+            upload = FileStorage(stream=io.BytesIO(f.read()), filename=f'report_{i}.pdf',
+                                 content_type='application/pdf')
+        document = Document(user_id=user_id, folder_id=folder.id)
+        document.save_file(upload)
+        db.session.add(document)
+        db.session.commit()
+        document.ingest_pages()
+        document_ids.append(document.id)
+    params = {'documents': count, 'pages': pages, 'fake_latency_ms': FAKE_LATENCY_MS}
+
+    def clear_llm_state() -> None:
+        DocumentAnalysis.query.delete()
+        FolderDocumentDigest.query.delete()
+        FolderSummary.query.delete()
+        db.session.commit()
+
+    def analyze_cold() -> None:
+        clear_llm_state()
+        Document.query.get(document_ids[0]).process_pdf_images(from_flask_login=False)
+
+    def summarize_cold() -> None:
+        clear_llm_state()
+        FolderSummary.generate_summary(folder.id, force_refresh=True)
+
+    results = {
+        f'Document.process_pdf_images[fake,{pages}p]': dict(time_call(analyze_cold, repeat), params=params),
+        f'FolderSummary.generate_summary[fake,cold,{count}docs]': dict(time_call(summarize_cold, repeat), params=params),
+    }
+    # Warm: digests are stored, so only the compose request is made
+    FolderSummary.generate_summary(folder.id, force_refresh=True)
+    results[f'FolderSummary.generate_summary[fake,warm,{count}docs]'] = dict(
+        time_call(lambda: FolderSummary.generate_summary(folder.id, force_refresh=True), repeat),
+        params=params
+    )
+    return results
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL, cwd=os.path.dirname(__file__)).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(repeat: int, quick: bool, only: Optional[str] = None) -> Dict[str, Any]:
+    """Run every benchmark and return the JSON-serialisable results document."""
+    pdf_matrix = QUICK_PDF_MATRIX if quick else PDF_MATRIX
+    image_sizes = QUICK_IMAGE_SIZES if quick else IMAGE_SIZES
+    folder_sizes = QUICK_FOLDER_SIZES if quick else FOLDER_SIZES
+    llm_folder = QUICK_LLM_FOLDER if quick else LLM_FOLDER
+
+    results: Dict[str, Dict[str, Any]] = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app = create_benchmark_app(tmp_dir)
+        with app.app_context():
+            user_id, folder_ids = seed_database(folder_sizes)
+            groups: Dict[str, Callable[[], Dict[str, Dict[str, Any]]]] = {
+                'pdf_reader': lambda: bench_pdf_reader(tmp_dir, pdf_matrix, repeat),
+                'compute_file_hash': lambda: bench_compute_file_hash(image_sizes, repeat),
+                'save_file': lambda: bench_save_file(image_sizes, repeat, user_id),
+                'folder_hash': lambda: bench_folder_hash(folder_ids, repeat),
+                'llm_paths': lambda: bench_llm_paths(tmp_dir, llm_folder, repeat, user_id),
+            }
+            for group, run in groups.items():
+                if only and group != only:
+                    continue
+                print(f"Running {group} benchmarks...", file=sys.stderr)
+                results.update(run())
+            db.session.remove()
+
+    return {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repeat': repeat,
+            'quick': quick,
+        },
+        'results': results,
+    }
+
+
+def compare_results(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    Compare median timings against a baseline run.
+
+    Returns:
+        List[str]: Names of benchmarks whose median grew by more than threshold (e.g. 0.15 = 15%)
+    """
+    regressions = []
+    print(f"\n{'benchmark':<58}{'baseline (s)':>14}{'current (s)':>13}{'change':>9}")
+    for name, stats in current['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            print(f"{name:<58}{'-':>14}{stats['median']:>13.4f}{'new':>9}")
+            continue
+        change = (stats['median'] - base['median']) / base['median'] if base['median'] else 0.0
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<58}{base['median']:>14.4f}{stats['median']:>13.4f}{change:>+9.1%}{flag}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the benchmark suite")
+    parser.add_argument('--output', default='benchmark_results.json', help="Where to write the JSON results")
+    parser.add_argument('--compare', help="Baseline JSON results to compare against")
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help="Relative median slowdown counted as a regression")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per benchmark")
+    parser.add_argument('--quick', action='store_true', help="Smaller inputs for a fast smoke run")
+    parser.add_argument('--only', choices=['pdf_reader', 'compute_file_hash', 'save_file', 'folder_hash', 'llm_paths'],
+                        help="Run a single benchmark group")
+    args = parser.parse_args()
+
+    current = run_suite(args.repeat, args.quick, args.only)
+    with open(args.output, 'w') as f:
+        json.dump(current, f, indent=2)
+    print(f"Wrote {len(current['results'])} results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare_results(current, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Synthetic fixtures for benchmarks.
+
+Generates PDFs with PyMuPDF and images with Pillow so benchmark runs do not
+depend on real patient records being present in static/uploads.
+"""
+
+import io
+import os
+import random
+from typing import Optional, Tuple
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+LOREM = (
+    "Patient presented with mild hypertension. Blood pressure 142/91 mmHg, "
+    "heart rate 78 bpm. Hemoglobin 13.2 g/dL within normal range. "
+    "Fasting glucose 108 mg/dL, slightly elevated. Follow-up recommended in 3 months. "
+)
+
+
+def make_image_bytes(size: Tuple[int, int] = (640, 480), fmt: str = 'PNG', seed: int = 0) -> bytes:
+    """Create a noisy RGB image of the given size and return its encoded bytes."""
+    rng = random.Random(seed)
+    image = Image.new('RGB', size, (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)))
+    # A few random rectangles so the encoder has real work to do
+    pixels = image.load()
+    for _ in range(64):
+        x0, y0 = rng.randrange(size[0]), rng.randrange(size[1])
+        colour = (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255))
+        for x in range(x0, min(size[0], x0 + 24)):
+            for y in range(y0, min(size[1], y0 + 24)):
+                pixels[x, y] = colour
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def make_pdf(path: str, pages: int = 40, images_per_page: int = 1, image_size: Tuple[int, int] = (320, 240),
+             repeated_logo: bool = False, seed: int = 0) -> str:
+    """
+    Write a synthetic lab-report style PDF.
+    
+    Args:
+        path (str): Output file path
+        pages (int): Number of pages
+        images_per_page (int): Distinct images embedded on each page
+        image_size (Tuple[int, int]): Pixel size of each embedded image
+        repeated_logo (bool): Also place the same letterhead image on every page
+        seed (int): Seed for reproducible content
+        
+    Returns:
+        str: The path that was written
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    doc = fitz.open()
+    logo: Optional[bytes] = make_image_bytes((120, 40), seed=seed + 10_000) if repeated_logo else None
+    for page_idx in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 60, 550, 420), f"Page {page_idx + 1}\n" + LOREM * 6, fontsize=9)
+        if logo:
+            page.insert_image(fitz.Rect(50, 10, 170, 50), stream=logo)
+        for img_idx in range(images_per_page):
+            top = 430 + img_idx * 10
+            image = make_image_bytes(image_size, seed=seed + page_idx * 100 + img_idx)
+            page.insert_image(fitz.Rect(50 + img_idx * 20, top, 290 + img_idx * 20, top + 180), stream=image)
+    doc.save(path)
+    doc.close()
+    return path
@@ -1,27 +1,45 @@
 from flask import Blueprint, render_template, request, jsonify, current_app
 from flask_login import login_required, current_user
-from flask_socketio import emit
-import google.generativeai as genai
+from flask_socketio import emit, join_room
 from datetime import datetime
 import html
 import re
 import asyncio
 import logging
 import os
-import base64
-import io
+import threading
+import time
+import uuid
+from collections import deque
 from werkzeug.utils import secure_filename
-from PIL import Image
-import PyPDF2
-import mimetypes
 from app import socketio
+from pdf_cache import iter_cached_pdf_bytes
+from image_prep import prepare_inline_image
+from gemini_client import GeminiCancelledError, call_gemini
+from llm_providers import get_llm_provider, get_llm_model
+from conversation_store import get_conversation_store
+from context_packer import IMAGE_TOKENS, estimate_tokens
+from rate_limiter import RateLimitExceeded, check_user_rate_limit, rate_limit_response
 from functools import wraps
-from typing import Any, Dict, Optional, Union
+from typing import Any, Dict, Iterator, Optional, Tuple, Union
 
 chat = Blueprint('chat', __name__, template_folder='templates')
 
-# Dictionary to store conversation history for each user
-conversation_history: Dict[str, list] = {}
+CHAT_MODEL = "gemini-2.0-flash"
+CHAT_GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 1024,
+}
+CHAT_SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"}
+]
+
+CHAT_ERROR_MESSAGE = "## Error\n\nI'm sorry, I'm having trouble processing your request right now. Please try again in a moment."
 
 # Medical context instructions for the AI model
 MEDICAL_ASSISTANT_INSTRUCTIONS = """
@@ -51,13 +69,13 @@ Important guidelines:
 """
 
 def init_gemini_api() -> bool:
-    api_key = current_app.config.get('GEMINI_API_KEY')
-    if not api_key:
+    provider = get_llm_provider()
+    if not provider.available():
         logging.error("GEMINI_API_KEY not configured. Chat functionality will not work properly.")
         return False
     
     try:
-        genai.configure(api_key=api_key)
+        provider.configure()
         return True
     except Exception as e:
         logging.error(f"Failed to initialize Gemini API: {str(e)}")
@@ -70,9 +88,8 @@ def sanitize_input(text: str) -> str:
     return text[:1000]
 
 def get_user_conversation(user_id: str) -> list:
-    if user_id not in conversation_history:
-        conversation_history[user_id] = []
-    return conversation_history[user_id]
+    """Recent history for the user, reloaded from the database if it is not in memory."""
+    return get_conversation_store().get_history(user_id)
 
 def allowed_file(filename: str) -> bool:
     ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
@@ -80,14 +97,12 @@ def allowed_file(filename: str) -> bool:
 
 def process_image_file(file: Any) -> Dict[str, str]:
     try:
-        image = Image.open(file)
-        img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format=image.format or 'PNG')
-        img_bytes = img_byte_arr.getvalue()
-        mime_type = mimetypes.guess_type(file.filename)[0] or 'image/jpeg'
+        # Downscaled, re-encoded and stripped of metadata before it is sent to Gemini
+        extension = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else None
+        image_part = prepare_inline_image(file.read(), extension)
         return {
-            'mime_type': mime_type,
-            'data': base64.b64encode(img_bytes).decode('utf-8'),
+            'mime_type': image_part['mime_type'],
+            'data': image_part['data'],
             'type': 'image'
         }
     except Exception as e:
@@ -96,13 +111,9 @@ def process_image_file(file: Any) -> Dict[str, str]:
 
 def process_pdf_file(file: Any) -> Dict[str, str]:
     try:
-        pdf_reader = PyPDF2.PdfReader(file)
-        text_content = ""
-        for page_num in range(len(pdf_reader.pages)):
-            page = pdf_reader.pages[page_num]
-            page_text = page.extract_text()
-            if page_text is not None:
-                text_content += page_text + "\n"
+        # Served from the extraction cache when the same PDF was seen before
+        pages = iter_cached_pdf_bytes(file.read(), extract_images=False)
+        text_content = "".join(page['text'] + "\n" for page in pages)
         return {
             'type': 'text',
             'data': text_content
@@ -123,95 +134,300 @@ def process_file_for_gemini(file: Any) -> Dict[str, str]:
     else:
         raise ValueError(f"Unsupported file type: {file_extension}")
 
-def generate_gemini_response(prompt: str, user_id: str, file_content: Optional[Dict[str, str]] = None) -> str:
-    try:
-        conversation = get_user_conversation(user_id)
-        is_first_message = len(conversation) == 0
-        message_parts = []
-        markdown_instruction = "\n\nPlease format your response using Markdown syntax with appropriate headers, lists, emphasis, and other formatting elements."
-        message_parts.append(prompt + markdown_instruction)
-        
-        if file_content:
-            if file_content['type'] == 'image':
-                message_parts.append({
-                    "inline_data": {
-                        "mime_type": file_content['mime_type'],
-                        "data": file_content['data']
-                    }
-                })
-            else:
-                content_preview = file_content['data'][:2000] + "..." if len(file_content['data']) > 2000 else file_content['data']
-                message_parts.append("File content:\n" + content_preview)
-        
-        conversation.append({"role": "user", "parts": message_parts})
-        
-        model = genai.GenerativeModel(
-            model_name="gemini-2.0-flash",
-            generation_config={
-                "temperature": 0.7,
-                "top_p": 0.95,
-                "top_k": 40,
-                "max_output_tokens": 1024,
-            },
-            safety_settings=[
-                {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"}
-            ]
-        )
-        
-        chat = model.start_chat(history=conversation)
-        
-        if is_first_message:
-            response = chat.send_message(
-                MEDICAL_ASSISTANT_INSTRUCTIONS + "\n\nUser query: " + prompt + markdown_instruction
-            )
+def _start_chat(prompt: str, user_id: str, file_content: Optional[Dict[str, str]] = None) -> Tuple[Any, Any, list, list]:
+    """
+    Build the Gemini chat session for a new user message.
+
+    Returns:
+        Tuple: (chat session, message to send, conversation history, message parts to record)
+    """
+    conversation = get_user_conversation(user_id)
+    is_first_message = len(conversation) == 0
+    message_parts = []
+    markdown_instruction = "\n\nPlease format your response using Markdown syntax with appropriate headers, lists, emphasis, and other formatting elements."
+    message_parts.append(prompt + markdown_instruction)
+    
+    if file_content:
+        if file_content['type'] == 'image':
+            message_parts.append({
+                "inline_data": {
+                    "mime_type": file_content['mime_type'],
+                    "data": file_content['data']
+                }
+            })
         else:
-            if file_content:
-                response = chat.send_message(message_parts)
-            else:
-                response = chat.send_message(prompt + markdown_instruction)
-        
+            content_preview = file_content['data'][:2000] + "..." if len(file_content['data']) > 2000 else file_content['data']
+            message_parts.append("File content:\n" + content_preview)
+    
+    model = get_llm_model(CHAT_MODEL, CHAT_GENERATION_CONFIG, CHAT_SAFETY_SETTINGS)
+    
+    # History holds the previous turns only; the new message is sent below
+    chat = model.start_chat(history=list(conversation))
+    
+    if is_first_message:
+        message = MEDICAL_ASSISTANT_INSTRUCTIONS + "\n\nUser query: " + prompt + markdown_instruction
+    elif file_content:
+        message = message_parts
+    else:
+        message = prompt + markdown_instruction
+    return chat, message, conversation, message_parts
+
+def _native(func: Any) -> Any:
+    """
+    Wrap a blocking Gemini SDK call so it does not stall other Socket.IO events.
+
+    Under eventlet the wrapped call runs on a native thread via eventlet.tpool while the calling
+    green thread yields: the SDK's transport is not monkey-patched, so calling it directly would
+    block the whole hub. Only the SDK call itself goes there; call_gemini's bookkeeping, the
+    conversation store and its flusher use green primitives and stay on the hub. Other async
+    modes already run background tasks on their own threads, so func is returned unchanged.
+    """
+    if socketio.async_mode != 'eventlet':
+        return func
+    from eventlet import tpool
+
+    @wraps(func)
+    def run(*args: Any, **kwargs: Any) -> Any:
+        return tpool.execute(func, *args, **kwargs)
+    return run
+
+def _record_exchange(user_id: str, conversation: list, message_parts: list, response_text: str) -> None:
+    get_conversation_store().append_exchange(user_id, message_parts, response_text)
+
+def generate_gemini_response(prompt: str, user_id: str, file_content: Optional[Dict[str, str]] = None,
+                             cancel: Optional[threading.Event] = None) -> str:
+    try:
+        chat, message, conversation, message_parts = _start_chat(prompt, user_id, file_content)
+        response = call_gemini(_native(chat.send_message), message, cancel=cancel)
         response_text = response.text
-        conversation.append({"role": "model", "parts": [response_text]})
-        
-        if len(conversation) > 20:
-            conversation_history[user_id] = conversation[-20:]
-        
+        _record_exchange(user_id, conversation, message_parts, response_text)
         return response_text
     
+    except GeminiCancelledError:
+        raise
     except Exception as e:
         logging.error(f"Error generating Gemini response: {str(e)}")
-        return "## Error\n\nI'm sorry, I'm having trouble processing your request right now. Please try again in a moment."
+        return CHAT_ERROR_MESSAGE
+
+def stream_gemini_response(prompt: str, user_id: str, file_content: Optional[Dict[str, str]] = None,
+                           cancel: Optional[threading.Event] = None) -> Iterator[str]:
+    """
+    Yield the response text chunk by chunk as Gemini produces it.
+
+    The full text is appended to the conversation history once the stream finishes; an
+    interrupted or cancelled stream leaves the history unchanged.
+    """
+    chat, message, conversation, message_parts = _start_chat(prompt, user_id, file_content)
+    # The deadline covers the wait for the first chunk; later chunks arrive as they are read
+    response = call_gemini(_native(chat.send_message), message, stream=True, cancel=cancel)
+    # Each step of the stream may block on the network, so it goes through _native as well
+    next_chunk = _native(next)
+    response_chunks = iter(response)
+    chunks = []
+    while True:
+        chunk = next_chunk(response_chunks, None)
+        if chunk is None:
+            break
+        if cancel is not None and cancel.is_set():
+            # Stop reading: dropping the response closes the upstream stream
+            raise GeminiCancelledError("Chat stream cancelled")
+        text = chunk.text
+        if text:
+            chunks.append(text)
+            yield text
+    _record_exchange(user_id, conversation, message_parts, "".join(chunks))
+
+class LatencyStats:
+    """Rolling latency samples (milliseconds) for time-to-first-token and total response time."""
+
+    def __init__(self, max_samples: int = 1000) -> None:
+        self._samples: Dict[str, deque] = {
+            'ttft_ms': deque(maxlen=max_samples),
+            'total_ms': deque(maxlen=max_samples)
+        }
+        self._lock = threading.Lock()
+
+    def record(self, ttft_ms: Optional[float], total_ms: float) -> None:
+        with self._lock:
+            if ttft_ms is not None:
+                self._samples['ttft_ms'].append(ttft_ms)
+            self._samples['total_ms'].append(total_ms)
+
+    def summary(self) -> Dict[str, Dict[str, Optional[float]]]:
+        with self._lock:
+            samples = {name: sorted(values) for name, values in self._samples.items()}
+        return {
+            name: {
+                'count': len(values),
+                'p50': values[len(values) // 2] if values else None,
+                'p95': values[min(len(values) - 1, int(len(values) * 0.95))] if values else None,
+                'max': values[-1] if values else None
+            }
+            for name, values in samples.items()
+        }
+
+chat_latency = LatencyStats()
+
+class ChatTaskRegistry:
+    """
+    Chat generations in flight in this process.
+
+    Each task is keyed by message id under its user and remembers the connection (sid) that
+    started it, so a user can be capped at a number of concurrent generations and the tasks
+    of a connection can be cancelled when it disconnects.
+    """
+
+    def __init__(self) -> None:
+        self._tasks: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self._stats = {'started': 0, 'rejected': 0, 'cancelled': 0}
+
+    def start(self, user_key: str, sid: str, limit: int) -> Optional[Tuple[str, threading.Event]]:
+        """Register a new task; returns (message id, cancel event), or None if the user is at the limit."""
+        with self._lock:
+            tasks = self._tasks.setdefault(user_key, {})
+            if len(tasks) >= limit:
+                self._stats['rejected'] += 1
+                return None
+            message_id = uuid.uuid4().hex
+            cancel = threading.Event()
+            tasks[message_id] = {'sid': sid, 'cancel': cancel}
+            self._stats['started'] += 1
+            return message_id, cancel
+
+    def finish(self, user_key: str, message_id: str) -> None:
+        with self._lock:
+            tasks = self._tasks.get(user_key, {})
+            tasks.pop(message_id, None)
+            if not tasks:
+                self._tasks.pop(user_key, None)
+
+    def cancel_connection(self, sid: str) -> int:
+        """Cancel every task started by a connection; returns how many were cancelled."""
+        cancelled = 0
+        with self._lock:
+            for tasks in self._tasks.values():
+                for task in tasks.values():
+                    if task['sid'] == sid and not task['cancel'].is_set():
+                        task['cancel'].set()
+                        cancelled += 1
+            self._stats['cancelled'] += cancelled
+        return cancelled
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats, in_flight=sum(len(tasks) for tasks in self._tasks.values()),
+                        users=len(self._tasks))
+
+chat_tasks = ChatTaskRegistry()
+
+def _user_room(user_id: str, sid: str) -> str:
+    """Room a user's responses are emitted to: all their connections, or just this one if anonymous."""
+    return f"user:{user_id}" if user_id != 'anonymous' else sid
+
+def emit_streamed_response(prompt: str, user_id: str, room: str, message_id: str,
+                           cancel: threading.Event) -> None:
+    """
+    Stream a chat response to the user's room.
+
+    Emits 'response_chunk' ({message_id, seq, data}) for every chunk and a final
+    'response_complete' ({message_id, data, chunks, ttft_ms, total_ms[, error]}) carrying
+    the full text, so clients that missed chunks can still render the whole answer. A
+    cancelled stream ends with 'response_cancelled' ({message_id}) instead.
+    """
+    started = time.perf_counter()
+    ttft_ms = None
+    chunks = []
+    error = False
+    stream = None
+    try:
+        stream = stream_gemini_response(prompt, user_id, cancel=cancel)
+        seq = 0
+        while True:
+            text = next(stream, None)
+            if text is None:
+                break
+            if ttft_ms is None:
+                ttft_ms = (time.perf_counter() - started) * 1000
+            chunks.append(text)
+            socketio.emit('response_chunk', {'message_id': message_id, 'seq': seq, 'data': text}, to=room)
+            seq += 1
+            # Let the server flush the chunk before blocking on the next one
+            socketio.sleep(0)
+    except GeminiCancelledError:
+        logging.info(f"Chat response {message_id} cancelled after {len(chunks)} chunk(s)")
+        socketio.emit('response_cancelled', {'message_id': message_id}, to=room)
+        return
+    except Exception as e:
+        logging.error(f"Error streaming Gemini response: {str(e)}")
+        error = True
+        chunks.append(("\n\n" if chunks else "") + CHAT_ERROR_MESSAGE)
+    finally:
+        if stream is not None:
+            stream.close()
+    
+    total_ms = (time.perf_counter() - started) * 1000
+    chat_latency.record(ttft_ms, total_ms)
+    logging.info(f"Chat response {message_id}: ttft={ttft_ms or 0:.0f}ms total={total_ms:.0f}ms chunks={len(chunks)}")
+    payload = {
+        'message_id': message_id,
+        'data': "".join(chunks),
+        'chunks': len(chunks),
+        'ttft_ms': round(ttft_ms, 1) if ttft_ms is not None else None,
+        'total_ms': round(total_ms, 1)
+    }
+    if error:
+        payload['error'] = True
+    socketio.emit('response_complete', payload, to=room)
+
+def run_chat_task(app: Any, prompt: str, user_id: str, user_key: str, room: str, message_id: str,
+                  cancel: threading.Event) -> None:
+    """Background task generating one chat response; results are emitted to the user's room."""
+    with app.app_context():
+        try:
+            if app.config.get('CHAT_STREAMING', True):
+                emit_streamed_response(prompt, user_id, room, message_id, cancel)
+            else:
+                started = time.perf_counter()
+                response = generate_gemini_response(prompt, user_id, cancel=cancel)
+                chat_latency.record(None, (time.perf_counter() - started) * 1000)
+                socketio.emit('response', {'message_id': message_id, 'data': response}, to=room)
+        except GeminiCancelledError:
+            logging.info(f"Chat response {message_id} cancelled")
+        except Exception as e:
+            logging.error(f"Error in chat message handling: {str(e)}")
+            socketio.emit('response', {'message_id': message_id, 'data': '## Error\n\nI apologize, but I encountered an issue processing your message. Please try again.'}, to=room)
+        finally:
+            chat_tasks.finish(user_key, message_id)
 
 @chat.route('/')
 @login_required
 def index() -> str:
     current_time = datetime.now().strftime("%I:%M %p")
-    if not hasattr(current_app, '_gemini_initialized'):
-        current_app._gemini_initialized = init_gemini_api()
     return render_template('chat/index.html', current_time=current_time)
 
 @socketio.on('connect')
 def handle_connect() -> None:
-    if not hasattr(current_app, '_gemini_initialized'):
-        current_app._gemini_initialized = init_gemini_api()
     if current_user.is_authenticated:
-        user_id = str(current_user.id)
-        if user_id not in conversation_history:
-            get_user_conversation(user_id)
+        # Responses go to the user's room, reaching every tab they have open
+        join_room(_user_room(str(current_user.id), request.sid))
+        # Warm the history of a returning user before their first message
+        get_user_conversation(str(current_user.id))
 
 @socketio.on('disconnect')
 def handle_disconnect() -> None:
-    pass
+    # Nobody is waiting for these answers any more: stop their upstream calls
+    cancelled = chat_tasks.cancel_connection(request.sid)
+    if cancelled:
+        logging.info(f"Cancelled {cancelled} chat response(s) for disconnected client {request.sid}")
 
 @socketio.on('message')
 def handle_message(data: Dict[str, Any]) -> None:
-    if not getattr(current_app, '_gemini_initialized', False):
-        if not init_gemini_api():
-            emit('response', {'data': 'Sorry, the AI service is currently unavailable. Please try again later.'})
-            return
+    # Checked per message rather than cached on the app: configure() is idempotent and each
+    # worker process must set up its own client
+    if not init_gemini_api():
+        emit('response', {'data': 'Sorry, the AI service is currently unavailable. Please try again later.'})
+        return
 
     if not data or not isinstance(data, dict) or 'data' not in data:
         emit('response', {'data': 'Invalid message format. Please try again.'})
@@ -224,13 +440,25 @@ def handle_message(data: Dict[str, Any]) -> None:
 
     sanitized_message = sanitize_input(user_message)
     user_id = str(current_user.id) if current_user.is_authenticated else 'anonymous'
+    # Anonymous connections are capped individually rather than sharing one 'anonymous' slot
+    user_key = user_id if user_id != 'anonymous' else request.sid
     
+    task = chat_tasks.start(user_key, request.sid, current_app.config.get('CHAT_MAX_IN_FLIGHT_PER_USER', 2))
+    if task is None:
+        emit('response', {'data': 'Please wait for your previous message to be answered before sending another.'})
+        return
+    message_id, cancel = task
     try:
-        response = generate_gemini_response(sanitized_message, user_id)
-        emit('response', {'data': response})
-    except Exception as e:
-        logging.error(f"Error in chat message handling: {str(e)}")
-        emit('response', {'data': '## Error\n\nI apologize, but I encountered an issue processing your message. Please try again.'})
+        check_user_rate_limit(user_key, 'chat', estimate_tokens(sanitized_message))
+    except RateLimitExceeded as e:
+        chat_tasks.finish(user_key, message_id)
+        emit('rate_limited', e.to_dict())
+        return
+    
+    # Generate in the background so this handler returns at once and a slow response never
+    # holds up other clients' events
+    socketio.start_background_task(run_chat_task, current_app._get_current_object(), sanitized_message,
+                                   user_id, user_key, _user_room(user_id, request.sid), message_id, cancel)
 
 @chat.route('/upload', methods=['POST'])
 @login_required
@@ -255,10 +483,13 @@ def upload_to_chat() -> Any:
         
         if processed_file['type'] == 'image':
             prompt = f"Please analyze this medical image and provide insights. The image is named '{filename}'. Organize your analysis with clear sections using markdown headers and lists."
-            file_analysis = generate_gemini_response(prompt, user_id, processed_file)
+            file_tokens = IMAGE_TOKENS
         else:
             prompt = f"Please analyze this medical document and provide key insights. The document is named '{filename}'. Organize your analysis with clear sections using markdown headers and lists."
-            file_analysis = generate_gemini_response(prompt, user_id, processed_file)
+            # _start_chat sends at most the first 2000 characters of the document
+            file_tokens = estimate_tokens(processed_file['data'][:2000])
+        check_user_rate_limit(user_id, 'chat', estimate_tokens(prompt) + file_tokens)
+        file_analysis = generate_gemini_response(prompt, user_id, processed_file)
         
         return jsonify({
             'success': True, 
@@ -266,6 +497,8 @@ def upload_to_chat() -> Any:
             'analysis': file_analysis
         })
         
+    except RateLimitExceeded as e:
+        return rate_limit_response(e)
     except ValueError as ve:
         return jsonify({'success': False, 'error': str(ve)}), 400
     except Exception as e:
@@ -275,6 +508,19 @@ def upload_to_chat() -> Any:
             'error': 'An error occurred while processing your file. Please try again.'
         }), 500
 
+@chat.route('/metrics')
+@login_required
+def chat_metrics() -> Any:
+    """Time-to-first-token and total response latency for this process (admin only)."""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+    return jsonify({
+        'success': True,
+        'latency': chat_latency.summary(),
+        'tasks': chat_tasks.stats(),
+        'conversation_store': get_conversation_store().stats()
+    })
+
 @chat.route('/transcribe', methods=['POST'])
 @login_required
 def transcribe_audio() -> Any:
@@ -291,6 +537,5 @@ def transcribe_audio() -> Any:
 def on_blueprint_registered(state: Any) -> None:
     app = state.app
     with app.app_context():
-        app._gemini_initialized = init_gemini_api()
-        if not app._gemini_initialized:
+        if not init_gemini_api():
             app.logger.warning("Gemini API initialization failed. Chat functionality may be limited.")
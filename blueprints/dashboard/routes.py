@@ -4,7 +4,13 @@ from flask import (
 )
 from flask_login import login_required, current_user
 from extensions import db
-from models import Folder, Document, FolderSummary
+from models import Folder, Document, FolderSummary, BackgroundJob
+from job_queue import enqueue_job, latest_job
+from search_index import index_documents, search as search_documents
+from rate_limiter import RateLimitExceeded, check_user_rate_limit, rate_limit_response
+from context_packer import estimate_document_tokens
+from pdf_reader import PDFExtractionError
+import io
 import os
 import uuid
 import logging
@@ -13,7 +19,7 @@ from pathlib import Path
 from werkzeug.utils import secure_filename, safe_join
 from datetime import datetime
 from sqlalchemy.exc import SQLAlchemyError
-from typing import Optional, List, Dict, Tuple, Union
+from typing import Optional, List, Tuple, Union
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -36,8 +42,8 @@ def overview() -> str:
 def records(folder_id: Optional[int] = None) -> str:
     try:
         document_id = request.args.get('view_document')
-        processed_images: Optional[List[Dict]] = None
         viewing_document: Optional[Document] = None
+        pdf_analysis_job: Optional[BackgroundJob] = None
 
         if document_id:
             try:
@@ -47,15 +53,18 @@ def records(folder_id: Optional[int] = None) -> str:
                     flash('Access denied: You do not have permission to view this document', 'error')
                     return redirect(url_for('dashboard.records', folder_id=folder_id))
                 if viewing_document.file_type.lower() == 'pdf':
-                    current_app.logger.info(f"Processing PDF images for document {document_id}")
-                    processing_result = viewing_document.process_pdf_images()
-                    if processing_result['success']:
-                        processed_images = processing_result['results']
-                        if not processed_images:
-                            current_app.logger.info(f"No images found in PDF document {document_id}")
-                    else:
-                        current_app.logger.error(f"Error processing PDF images: {processing_result['message']}")
-                        flash(f"Error processing PDF images: {processing_result['message']}", 'warning')
+                    # Analysis runs in the job workers; reuse the last result unless it failed
+                    payload = {'document_id': document_id, 'extract_text': True}
+                    pdf_analysis_job = latest_job('pdf_analysis', payload, user_id=current_user.id)
+                    if not pdf_analysis_job or pdf_analysis_job.status == BackgroundJob.STATUS_FAILED:
+                        try:
+                            check_user_rate_limit(current_user.id, 'pdf_analysis', estimate_document_tokens(
+                                viewing_document.page_count, viewing_document.image_count))
+                        except RateLimitExceeded as e:
+                            # Show what is stored (if anything) instead of queueing
+                            flash(e.to_dict()['message'], 'warning')
+                        else:
+                            pdf_analysis_job = enqueue_job('pdf_analysis', payload, user_id=current_user.id)
             except Exception as doc_err:
                 current_app.logger.error(f"Error processing document {document_id}: {str(doc_err)}", exc_info=True)
                 flash('Error processing document', 'error')
@@ -64,12 +73,12 @@ def records(folder_id: Optional[int] = None) -> str:
             current_folder = Folder.query.filter_by(id=folder_id, user_id=current_user.id).first_or_404()
             subfolders = Folder.query.filter_by(parent_id=folder_id, user_id=current_user.id).order_by(Folder.name).all()
             documents = Document.query.filter_by(folder_id=folder_id, user_id=current_user.id).order_by(Document.upload_date.desc()).all()
-            folder_summary, summary_last_updated = _get_folder_summary(folder_id, documents)
+            folder_summary, summary_last_updated, summary_job = _get_folder_summary(folder_id, documents)
         else:
             current_folder = None
             subfolders = Folder.query.filter_by(parent_id=None, user_id=current_user.id).order_by(Folder.name).all()
             documents = Document.query.filter_by(folder_id=None, user_id=current_user.id).order_by(Document.upload_date.desc()).all()
-            folder_summary, summary_last_updated = None, None
+            folder_summary, summary_last_updated, summary_job = None, None, None
 
         folder_path = _build_folder_path(current_folder)
         _validate_and_fix_document_paths(documents)
@@ -82,7 +91,8 @@ def records(folder_id: Optional[int] = None) -> str:
             'folder_summary': folder_summary,
             'summary_last_updated': summary_last_updated,
             'viewing_document': viewing_document,
-            'processed_images': processed_images
+            'pdf_analysis_job': pdf_analysis_job,
+            'summary_job': summary_job
         }
         return render_template('dashboard/records.html', **context)
     except Exception as e:
@@ -90,26 +100,51 @@ def records(folder_id: Optional[int] = None) -> str:
         flash('Error loading records. Please try again.', 'error')
         return redirect(url_for('dashboard.index'))
 
-def _get_folder_summary(folder_id: int, documents: List[Document]) -> Tuple[Optional[str], Optional[datetime]]:
+def _get_folder_summary(folder_id: int, documents: List[Document]) -> Tuple[Optional[str], Optional[datetime], Optional[BackgroundJob]]:
+    """
+    Return the stored folder summary without calling Gemini in the request.
+
+    When the summary is missing or out of date a folder_summary job is queued and returned so
+    the page can show the current (possibly stale) summary and poll for the new one.
+    """
     folder_summary: Optional[str] = None
     summary_last_updated: Optional[datetime] = None
+    summary_job: Optional[BackgroundJob] = None
     auto_generate = request.args.get('generate_summary', 'false').lower() == 'true'
     try:
-        if documents or auto_generate:
-            if auto_generate:
-                current_app.logger.info(f"Forcing regeneration of summary for folder {folder_id}")
-                folder_summary = FolderSummary.generate_summary(folder_id)
-            else:
-                folder_summary = FolderSummary.get_or_generate_summary(folder_id)
+        has_subfolders = Folder.query.filter_by(parent_id=folder_id).first() is not None
+        if documents or has_subfolders or auto_generate:
             summary_record = FolderSummary.query.filter_by(folder_id=folder_id).first()
-            if summary_record:
+            if summary_record and summary_record.summary_text:
+                folder_summary = summary_record.summary_text
                 summary_last_updated = summary_record.last_updated
+            if auto_generate or FolderSummary.needs_update(folder_id):
+                payload = {'folder_id': folder_id, 'force_refresh': auto_generate}
+                summary_job = latest_job('folder_summary', payload, user_id=current_user.id)
+                # Reloading while a run is queued or running reuses it and costs nothing
+                if not summary_job or summary_job.status not in BackgroundJob.ACTIVE_STATUSES:
+                    try:
+                        check_user_rate_limit(current_user.id, 'folder_summary', _summary_token_estimate(folder_id))
+                    except RateLimitExceeded as e:
+                        # Keep showing the stored summary instead of queueing
+                        flash(e.to_dict()['message'], 'warning')
+                        summary_job = None
+                    else:
+                        if auto_generate:
+                            current_app.logger.info(f"Forcing regeneration of summary for folder {folder_id}")
+                        summary_job = enqueue_job('folder_summary', payload, user_id=current_user.id)
         else:
             folder_summary = "This folder is empty."
     except Exception as e:
         current_app.logger.error(f"Error getting folder summary: {str(e)}")
         folder_summary = "Error generating summary."
-    return folder_summary, summary_last_updated
+    return folder_summary, summary_last_updated, summary_job
+
+def _summary_token_estimate(folder_id: int) -> int:
+    """Estimated input tokens of summarizing a folder: its documents' sizes, capped at the context budget."""
+    counts = db.session.query(Document.page_count, Document.image_count).filter_by(folder_id=folder_id).all()
+    estimate = sum(estimate_document_tokens(page_count, image_count) for page_count, image_count in counts)
+    return min(estimate, current_app.config.get('FOLDER_SUMMARY_TOKEN_BUDGET', 120000))
 
 def _build_folder_path(current_folder: Optional[Folder]) -> List[Folder]:
     folder_path: List[Folder] = []
@@ -130,6 +165,16 @@ def _validate_and_fix_document_paths(documents: List[Document]) -> None:
         file_exists = doc.get_file_path().exists() if doc.get_file_path() else False
         logger.debug(f"Document {doc.original_filename}: URL={url_path}, exists={file_exists}")
 
+def _ingest_documents(documents: List[Document]) -> None:
+    """Store per-page rows and index newly uploaded documents; failures never fail the upload."""
+    for doc in documents:
+        try:
+            doc.ingest_pages()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error ingesting pages for document {doc.id}: {str(e)}")
+    index_documents(documents)
+
 @dashboard.route('/upload', methods=['GET', 'POST'])
 @login_required
 def upload() -> Union[str, 'Response']:
@@ -258,6 +303,7 @@ def upload() -> Union[str, 'Response']:
                 }), 400
                 
             uploaded_count = 0
+            uploaded_documents = []
             error_messages = []
             description = request.form.get('description', '')
             
@@ -289,6 +335,7 @@ def upload() -> Union[str, 'Response']:
                     try:
                         document.save_file(file)
                         db.session.add(document)
+                        uploaded_documents.append(document)
                         uploaded_count += 1
                     except PermissionError as perm_err:
                         error_messages.append(f"Permission denied saving '{file.filename}': {str(perm_err)}")
@@ -300,6 +347,7 @@ def upload() -> Union[str, 'Response']:
             if uploaded_count > 0:
                 try:
                     db.session.commit()
+                    _ingest_documents(uploaded_documents)
                     message = f"Successfully uploaded {uploaded_count} file(s)"
                     if error_messages:
                         message += f" with {len(error_messages)} error(s)"
@@ -354,6 +402,7 @@ def upload() -> Union[str, 'Response']:
                     document.save_file(file)
                     db.session.add(document)
                     db.session.commit()
+                    _ingest_documents([document])
                     flash(f'File "{document.original_filename}" uploaded successfully', 'success')
                 except PermissionError:
                     db.session.rollback()
@@ -374,4 +423,149 @@ def upload() -> Union[str, 'Response']:
                 return redirect(request.referrer or url_for('dashboard.records'))
     return render_template('dashboard/upload.html')
 
+@dashboard.route('/regenerate_summary/<int:folder_id>', methods=['POST'])
+@login_required
+def regenerate_summary(folder_id: int) -> Union['Response', Tuple['Response', int]]:
+    """Queue a forced folder summary regeneration and return the job to poll."""
+    folder = Folder.query.filter_by(id=folder_id, user_id=current_user.id).first()
+    if not folder:
+        return jsonify({'success': False, 'message': 'Folder not found'}), 404
+    try:
+        check_user_rate_limit(current_user.id, 'folder_summary', _summary_token_estimate(folder_id))
+    except RateLimitExceeded as e:
+        return rate_limit_response(e)
+    job = enqueue_job('folder_summary', {'folder_id': folder_id, 'force_refresh': True}, user_id=current_user.id)
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': url_for('dashboard.job_status', job_id=job.id)
+    }), 202
+
+@dashboard.route('/documents/<int:document_id>/analyze', methods=['POST'])
+@login_required
+def analyze_document(document_id: int) -> Union['Response', Tuple['Response', int]]:
+    """Queue a PDF analysis job (or return the one already queued/running) for polling."""
+    document = Document.query.filter_by(id=document_id, user_id=current_user.id).first()
+    if not document:
+        return jsonify({'success': False, 'message': 'Document not found'}), 404
+    if document.file_type.lower() != 'pdf':
+        return jsonify({'success': False, 'message': 'File is not a PDF'}), 400
+    payload = {'document_id': document_id, 'extract_text': request.args.get('extract_text', 'true').lower() == 'true'}
+    job = latest_job('pdf_analysis', payload, user_id=current_user.id)
+    if not job or job.status == BackgroundJob.STATUS_FAILED or request.args.get('refresh') == 'true':
+        try:
+            check_user_rate_limit(current_user.id, 'pdf_analysis',
+                                  estimate_document_tokens(document.page_count, document.image_count))
+        except RateLimitExceeded as e:
+            return rate_limit_response(e)
+        job = enqueue_job('pdf_analysis', payload, user_id=current_user.id)
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': url_for('dashboard.job_status', job_id=job.id)
+    }), 202
+
+@dashboard.route('/documents/<int:document_id>/pdf_images/<int:page_num>/<int:image_idx>')
+@login_required
+def pdf_image(document_id: int, page_num: int, image_idx: int) -> 'Response':
+    """Serve an image embedded in one of the current user's PDFs, as referenced by analysis results."""
+    document = Document.query.filter_by(id=document_id, user_id=current_user.id).first()
+    if not document or document.file_type.lower() != 'pdf':
+        abort(404)
+    try:
+        image = document.get_pdf_image(page_num, image_idx)
+    except (PDFExtractionError, OSError) as e:
+        logger.error(f"Error reading image {image_idx} on page {page_num} of document {document_id}: {str(e)}")
+        abort(404)
+    if not image:
+        abort(404)
+    response = send_file(io.BytesIO(image['bytes']), mimetype=f"image/{image['format']}", max_age=3600)
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    return response
+
+@dashboard.route('/jobs/<int:job_id>')
+@login_required
+def job_status(job_id: int) -> Union['Response', Tuple['Response', int]]:
+    """Status, attempts and (once finished) result of one of the current user's jobs."""
+    job = BackgroundJob.query.filter_by(id=job_id, user_id=current_user.id).first()
+    if not job:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    return jsonify(dict(job.to_dict(), success=True))
+
+@dashboard.route('/cache/stats')
+@login_required
+def cache_stats() -> 'Response':
+    """Expose per-process cache counters for monitoring (admin only)."""
+    if not current_user.is_admin:
+        abort(403)
+    from pdf_cache import get_pdf_cache
+    from image_prep import get_image_preparer
+    pdf_cache = get_pdf_cache()
+    image_preparer = get_image_preparer()
+    return jsonify({
+        'success': True,
+        'pdf_extraction': pdf_cache.stats() if pdf_cache else None,
+        'image_prep': image_preparer.stats() if image_preparer else None
+    })
+
+@dashboard.route('/gemini/status')
+@login_required
+def gemini_status() -> 'Response':
+    """Gemini circuit breaker state and call counters for this process (admin only)."""
+    if not current_user.is_admin:
+        abort(403)
+    from gemini_client import gemini_status as get_gemini_status
+    return jsonify(dict(get_gemini_status(), success=True))
+
+@dashboard.route('/search')
+@login_required
+def search() -> 'Response':
+    """
+    Ranked full-text search over the current user's documents.
+
+    Query parameters: 'q' (search text), 'limit' (max 100) and 'offset'.
+    """
+    query = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    if not query:
+        return jsonify({'success': False, 'message': 'Missing search query', 'results': []}), 400
+
+    try:
+        result = search_documents(current_user.id, query, limit=limit, offset=offset)
+    except SQLAlchemyError as e:
+        logger.error(f"Search error for user {current_user.id}: {str(e)}")
+        return jsonify({'success': False, 'message': 'Search is unavailable', 'results': []}), 500
+
+    document_ids = {hit['document_id'] for hit in result['hits']}
+    documents = {
+        doc.id: doc for doc in
+        Document.query.filter(Document.id.in_(document_ids), Document.user_id == current_user.id).all()
+    } if document_ids else {}
+
+    results = []
+    for hit in result['hits']:
+        doc = documents.get(hit['document_id'])
+        if not doc:
+            continue
+        results.append({
+            'document_id': doc.id,
+            'filename': doc.original_filename,
+            'folder_id': doc.folder_id,
+            'file_type': doc.file_type,
+            'page_num': hit['page_num'],
+            'snippet': hit['snippet'],
+            'score': hit['score'],
+            'url': url_for('dashboard.records', folder_id=doc.folder_id, view_document=doc.id)
+        })
+
+    return jsonify({
+        'success': True,
+        'query': query,
+        'results': results,
+        'took_ms': result['took_ms']
+    })
+
 # Other routes and utility functions remain unchanged, with type annotations added where applicable.
@@ -21,8 +21,103 @@ class Config:
     SESSION_PERMANENT = True
     SESSION_USE_SIGNER = True
     
+    # PDF Extraction
+    # Opt-in: split pages of large PDFs across a process pool
+    PDF_PARALLEL_EXTRACTION = os.environ.get('PDF_PARALLEL_EXTRACTION', 'false').lower() == 'true'
+    PDF_PARALLEL_WORKERS = int(os.environ.get('PDF_PARALLEL_WORKERS', os.cpu_count() or 1))
+    PDF_PARALLEL_MIN_PAGES = int(os.environ.get('PDF_PARALLEL_MIN_PAGES', 100))
+    # Collapse repeated images (logos, letterheads) and drop tiny decorative ones
+    PDF_DEDUPE_IMAGES = os.environ.get('PDF_DEDUPE_IMAGES', 'true').lower() == 'true'
+    PDF_MIN_IMAGE_SIZE = int(os.environ.get('PDF_MIN_IMAGE_SIZE', 48))  # pixels, shortest side
+    # Extraction cache keyed by Document.content_hash (defaults to <instance>/pdf_cache)
+    PDF_CACHE_ENABLED = os.environ.get('PDF_CACHE_ENABLED', 'true').lower() == 'true'
+    PDF_CACHE_DIR = os.environ.get('PDF_CACHE_DIR')
+    PDF_CACHE_MAX_BYTES = int(os.environ.get('PDF_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+    
     # AI Configuration
     GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
+    # 'gemini', or 'fake' for offline load tests (deterministic responses, simulated latency and errors)
+    LLM_PROVIDER = os.environ.get('LLM_PROVIDER', 'gemini')
+    LLM_FAKE_LATENCY_MS = float(os.environ.get('LLM_FAKE_LATENCY_MS', 800))  # median
+    LLM_FAKE_LATENCY_SIGMA = float(os.environ.get('LLM_FAKE_LATENCY_SIGMA', 0.5))  # log-normal spread
+    LLM_FAKE_ERROR_RATE = float(os.environ.get('LLM_FAKE_ERROR_RATE', 0.0))
+    LLM_FAKE_SEED = int(os.environ.get('LLM_FAKE_SEED', 0))
+    LLM_FAKE_RESPONSE_WORDS = int(os.environ.get('LLM_FAKE_RESPONSE_WORDS', 200))
+    LLM_FAKE_CHUNK_CHARS = int(os.environ.get('LLM_FAKE_CHUNK_CHARS', 40))
+    LLM_FAKE_CHUNK_DELAY_MS = float(os.environ.get('LLM_FAKE_CHUNK_DELAY_MS', 30))
+    GEMINI_MODEL = os.environ.get('GEMINI_MODEL', 'gemini-1.5-flash')
+    # Concurrent Gemini calls per analysis and a shared per-process request rate
+    GEMINI_MAX_CONCURRENCY = int(os.environ.get('GEMINI_MAX_CONCURRENCY', 4))
+    GEMINI_RATE_LIMIT_RPM = int(os.environ.get('GEMINI_RATE_LIMIT_RPM', 60))
+    GEMINI_RATE_LIMIT_BURST = int(os.environ.get('GEMINI_RATE_LIMIT_BURST', 10))
+    # Per-user allowance for AI work (chat, folder summaries, PDF analysis), per process:
+    # requests and estimated input tokens per minute, each with a burst
+    USER_RATE_LIMIT_ENABLED = os.environ.get('USER_RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+    USER_RATE_LIMIT_RPM = int(os.environ.get('USER_RATE_LIMIT_RPM', 20))
+    USER_RATE_LIMIT_BURST = int(os.environ.get('USER_RATE_LIMIT_BURST', 10))
+    USER_TOKEN_LIMIT_TPM = int(os.environ.get('USER_TOKEN_LIMIT_TPM', 100000))
+    USER_TOKEN_LIMIT_BURST = int(os.environ.get('USER_TOKEN_LIMIT_BURST', 250000))
+    USER_RATE_LIMIT_MAX_USERS = int(os.environ.get('USER_RATE_LIMIT_MAX_USERS', 10000))
+    # Seconds between writes of the per-user daily usage counts to the ai_usage table
+    AI_USAGE_FLUSH_INTERVAL = float(os.environ.get('AI_USAGE_FLUSH_INTERVAL', 30))
+    # Per-call deadline (seconds, including retries) and retry policy for retryable errors (429, 5xx)
+    GEMINI_CALL_TIMEOUT = float(os.environ.get('GEMINI_CALL_TIMEOUT', 60))
+    GEMINI_MAX_RETRIES = int(os.environ.get('GEMINI_MAX_RETRIES', 3))
+    GEMINI_RETRY_BASE_DELAY = float(os.environ.get('GEMINI_RETRY_BASE_DELAY', 1))
+    GEMINI_RETRY_MAX_DELAY = float(os.environ.get('GEMINI_RETRY_MAX_DELAY', 20))
+    GEMINI_CALL_THREADS = int(os.environ.get('GEMINI_CALL_THREADS', 16))
+    # Fail fast for GEMINI_BREAKER_OPEN_SECONDS once this share of recent calls failed
+    GEMINI_BREAKER_ERROR_RATE = float(os.environ.get('GEMINI_BREAKER_ERROR_RATE', 0.5))
+    GEMINI_BREAKER_MIN_CALLS = int(os.environ.get('GEMINI_BREAKER_MIN_CALLS', 10))
+    GEMINI_BREAKER_WINDOW = float(os.environ.get('GEMINI_BREAKER_WINDOW', 60))
+    GEMINI_BREAKER_OPEN_SECONDS = float(os.environ.get('GEMINI_BREAKER_OPEN_SECONDS', 30))
+    # Estimated tokens sent in one folder summary request; larger folders are summarized
+    # per document first and the document summaries combined
+    FOLDER_SUMMARY_TOKEN_BUDGET = int(os.environ.get('FOLDER_SUMMARY_TOKEN_BUDGET', 120000))
+    FOLDER_SUMMARY_DOCUMENT_BUDGET = int(os.environ.get('FOLDER_SUMMARY_DOCUMENT_BUDGET', 30000))
+    # Compose folder summaries from stored per-document digests so only new or changed documents are
+    # re-read; set false to send every file in one request when a folder fits FOLDER_SUMMARY_TOKEN_BUDGET
+    FOLDER_SUMMARY_INCREMENTAL = os.environ.get('FOLDER_SUMMARY_INCREMENTAL', 'true').lower() == 'true'
+    # Concurrent identical summary/analysis runs share one result; other processes wait up to
+    # this many seconds on the file lock (under SINGLE_FLIGHT_LOCK_DIR, default <instance>/locks)
+    SINGLE_FLIGHT_TIMEOUT = float(os.environ.get('SINGLE_FLIGHT_TIMEOUT', 600))
+    SINGLE_FLIGHT_LOCK_DIR = os.environ.get('SINGLE_FLIGHT_LOCK_DIR')
+    # Stream chat responses to the browser chunk by chunk
+    CHAT_STREAMING = os.environ.get('CHAT_STREAMING', 'true').lower() == 'true'
+    # Chat responses a user may have generating at once; more are refused until one finishes
+    CHAT_MAX_IN_FLIGHT_PER_USER = int(os.environ.get('CHAT_MAX_IN_FLIGHT_PER_USER', 2))
+    # Chat history: in-memory hot tier limits, turns kept per user, and write-behind to Message rows
+    CHAT_HISTORY_MESSAGES = int(os.environ.get('CHAT_HISTORY_MESSAGES', 20))
+    CHAT_STORE_MAX_USERS = int(os.environ.get('CHAT_STORE_MAX_USERS', 1000))
+    CHAT_STORE_MAX_BYTES = int(os.environ.get('CHAT_STORE_MAX_BYTES', 64 * 1024 * 1024))
+    CHAT_STORE_IDLE_TTL = int(os.environ.get('CHAT_STORE_IDLE_TTL', 1800))  # seconds
+    CHAT_STORE_FLUSH_INTERVAL = float(os.environ.get('CHAT_STORE_FLUSH_INTERVAL', 2.0))  # seconds
+    CHAT_STORE_FLUSH_BATCH = int(os.environ.get('CHAT_STORE_FLUSH_BATCH', 50))
+    # 'memory' (single worker process) or 'shared' (several workers: every write goes to the
+    # database and each worker revalidates its cached history against a version counter)
+    CHAT_STATE_BACKEND = os.environ.get('CHAT_STATE_BACKEND', 'memory')
+    # Socket.IO message queue URL shared by all worker processes, e.g. redis://localhost:6379/0
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+    # Images per multimodal PDF analysis request (1 = one request per image)
+    PDF_ANALYSIS_BATCH_SIZE = int(os.environ.get('PDF_ANALYSIS_BATCH_SIZE', 4))
+    PDF_ANALYSIS_BATCH_ACROSS_PAGES = os.environ.get('PDF_ANALYSIS_BATCH_ACROSS_PAGES', 'false').lower() == 'true'
+    # Images are downscaled and re-encoded before being sent to Gemini
+    IMAGE_PREP_ENABLED = os.environ.get('IMAGE_PREP_ENABLED', 'true').lower() == 'true'
+    IMAGE_PREP_MAX_EDGE = int(os.environ.get('IMAGE_PREP_MAX_EDGE', 1536))  # pixels, longest edge
+    IMAGE_PREP_FORMAT = os.environ.get('IMAGE_PREP_FORMAT', 'JPEG')
+    IMAGE_PREP_QUALITY = int(os.environ.get('IMAGE_PREP_QUALITY', 80))
+    IMAGE_PREP_CACHE_DIR = os.environ.get('IMAGE_PREP_CACHE_DIR')  # defaults to <instance>/image_cache
+    IMAGE_PREP_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_PREP_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+    
+    # Background Jobs (run workers with `flask run-jobs`)
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1.0))  # seconds between polls when idle
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+    JOB_RETRY_BASE_DELAY = float(os.environ.get('JOB_RETRY_BASE_DELAY', 5))  # seconds, doubled per attempt
+    JOB_RETRY_MAX_DELAY = float(os.environ.get('JOB_RETRY_MAX_DELAY', 300))
+    JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 900))  # renewed every third of this; expired leases are requeued
+    JOB_RETENTION_DAYS = float(os.environ.get('JOB_RETENTION_DAYS', 7))  # finished jobs older than this are deleted
+    JOB_SWEEP_INTERVAL = float(os.environ.get('JOB_SWEEP_INTERVAL', 3600))  # seconds between retention sweeps
     
     # Other Config
     DEBUG = os.environ.get('FLASK_DEBUG') or True
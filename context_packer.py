@@ -0,0 +1,96 @@
+import math
+import logging
+from typing import Any, Dict, List, Optional, Union
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Rough Gemini costs: ~4 characters per text token, a fixed cost per inline image
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 258
+
+# Assumed text per PDF page when sizing work before the text is extracted
+PAGE_TEXT_TOKENS = 500
+
+# Text parts are cut to fit the remaining budget only if at least this many tokens are left
+MIN_TRUNCATED_TOKENS = 500
+TRUNCATION_MARKER = "\n\n[... truncated to fit the context budget ...]"
+
+Content = Union[str, Dict[str, str]]
+
+
+def estimate_tokens(content: Content) -> int:
+    """Estimate the token cost of a text or inline image ({'mime_type', 'data'}) content part."""
+    if isinstance(content, dict):
+        return IMAGE_TOKENS
+    return math.ceil(len(content) / CHARS_PER_TOKEN)
+
+
+def estimate_document_tokens(page_count: Optional[int], image_count: Optional[int]) -> int:
+    """Estimate the input tokens of analysing a PDF from its page and image counts (unknown counts as one page)."""
+    return (page_count or 1) * PAGE_TEXT_TOKENS + (image_count or 0) * IMAGE_TOKENS
+
+
+def make_part(content: Content, priority: int = 0, label: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Wrap a content part for packing.
+
+    Args:
+        content (Content): Text or an inline image part
+        priority (int): Lower values are packed first
+        label (Optional[str]): Name used when reporting omitted parts
+
+    Returns:
+        Dict[str, Any]: {'content', 'priority', 'label', 'tokens'}
+    """
+    return {'content': content, 'priority': priority, 'label': label, 'tokens': estimate_tokens(content)}
+
+
+def total_tokens(parts: List[Dict[str, Any]]) -> int:
+    return sum(part['tokens'] for part in parts)
+
+
+def pack_parts(parts: List[Dict[str, Any]], budget: int, truncate_text: bool = True) -> Dict[str, Any]:
+    """
+    Choose the parts that fit a token budget, in priority order.
+
+    Parts are taken by ascending priority (ties keep their original order) until the budget is
+    spent. A text part that does not fit whole is truncated when enough budget is left for it
+    to be useful. The chosen parts are returned in their original order so related parts stay
+    next to each other.
+
+    Args:
+        parts (List[Dict[str, Any]]): Parts built with make_part
+        budget (int): Token budget for the packed parts
+        truncate_text (bool): Allow cutting a text part to fill the remaining budget
+
+    Returns:
+        Dict[str, Any]: 'contents' (list of content parts), 'tokens' (estimated total),
+        'omitted' (labels of parts left out) and 'truncated' (labels of cut parts)
+    """
+    remaining = budget
+    chosen: Dict[int, Content] = {}
+    omitted: List[Optional[str]] = []
+    truncated: List[Optional[str]] = []
+
+    for index in sorted(range(len(parts)), key=lambda i: parts[i]['priority']):
+        part = parts[index]
+        if part['tokens'] <= remaining:
+            chosen[index] = part['content']
+            remaining -= part['tokens']
+        elif truncate_text and isinstance(part['content'], str) and remaining >= MIN_TRUNCATED_TOKENS:
+            keep_chars = (remaining - estimate_tokens(TRUNCATION_MARKER)) * CHARS_PER_TOKEN
+            chosen[index] = part['content'][:keep_chars] + TRUNCATION_MARKER
+            remaining -= estimate_tokens(chosen[index])
+            truncated.append(part['label'])
+        else:
+            omitted.append(part['label'])
+
+    if omitted or truncated:
+        logger.info(f"Context budget {budget}: omitted {len(omitted)} part(s), truncated {len(truncated)}")
+    return {
+        'contents': [chosen[index] for index in sorted(chosen)],
+        'tokens': budget - remaining,
+        'omitted': omitted,
+        'truncated': truncated
+    }
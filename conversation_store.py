@@ -0,0 +1,435 @@
+import atexit
+import threading
+import time
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from flask import Flask, current_app
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+ROLE_TO_SENDER = {'user': 'user', 'model': 'ai'}
+SENDER_TO_ROLE = {'user': 'user', 'ai': 'model'}
+
+
+def _persistent_user_id(user_id: str) -> Optional[int]:
+    """Database user id for a chat user key, or None for users that are not persisted (anonymous)."""
+    return int(user_id) if str(user_id).isdigit() else None
+
+
+def _turn_size(turn: Dict[str, Any]) -> int:
+    """Approximate in-memory size of a history turn: text length plus inline image data."""
+    size = 0
+    for part in turn.get('parts', []):
+        if isinstance(part, dict):
+            size += len(part.get('inline_data', {}).get('data', ''))
+        else:
+            size += len(str(part))
+    return size
+
+
+def _message_fields(turn: Dict[str, Any]) -> Dict[str, Any]:
+    """Message column values for a history turn; inline images are recorded as an attachment only."""
+    texts = [str(part) for part in turn.get('parts', []) if not isinstance(part, dict)]
+    images = [part for part in turn.get('parts', []) if isinstance(part, dict)]
+    return {
+        'sender': ROLE_TO_SENDER[turn['role']],
+        'content': "\n\n".join(texts),
+        'has_attachment': bool(images),
+        'attachment_type': 'image' if images else None
+    }
+
+
+class ConversationStore:
+    """
+    Chat history per user: an in-memory LRU hot tier over Conversation/Message rows.
+
+    The hot tier holds the last `history_messages` turns of recently active users and evicts
+    users idle for `idle_ttl` seconds, the least recently used beyond `max_users`, and more
+    while the tier is over `max_bytes`. New turns are queued and inserted in batches by a
+    background flusher (write-behind) every `flush_interval` seconds, or sooner once
+    `flush_batch` are waiting. A user missing from the hot tier is reloaded from their latest
+    Conversation on next access; inline images are not persisted, so reloaded turns are text.
+    """
+
+    def __init__(self, max_users: int = 1000, max_bytes: int = 64 * 1024 * 1024, idle_ttl: float = 1800,
+                 history_messages: int = 20, flush_interval: float = 2.0, flush_batch: int = 50) -> None:
+        self.max_users = max(1, max_users)
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.history_messages = history_messages
+        self.flush_interval = flush_interval
+        self.flush_batch = max(1, flush_batch)
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._bytes = 0
+        self._pending: List[Dict[str, Any]] = []
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._app: Optional[Flask] = None
+        self._flusher: Optional[threading.Thread] = None
+        self._stats = {'hits': 0, 'loads': 0, 'evictions': 0, 'flushed': 0, 'flush_errors': 0}
+
+    # -- hot tier ----------------------------------------------------------
+
+    def _evict(self, now: float, keep: Optional[str] = None) -> None:
+        """Drop idle users, then least recently used ones while over the user or byte limit."""
+        while self._entries:
+            user_id, entry = next(iter(self._entries.items()))
+            if user_id == keep:
+                break
+            over_limit = len(self._entries) > self.max_users or self._bytes > self.max_bytes
+            if not over_limit and now - entry['last_access'] < self.idle_ttl:
+                break
+            self._entries.popitem(last=False)
+            self._bytes -= entry['bytes']
+            self._stats['evictions'] += 1
+
+    def _trim(self, entry: Dict[str, Any]) -> None:
+        while len(entry['turns']) > self.history_messages:
+            removed = entry['turns'].pop(0)
+            size = _turn_size(removed)
+            entry['bytes'] -= size
+            self._bytes -= size
+
+    def _drop(self, user_id: str) -> None:
+        """Remove a user's hot entry (caller holds the lock)."""
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._bytes -= entry['bytes']
+
+    def _read_turns(self, conversation_id: int) -> List[Dict[str, Any]]:
+        """The last `history_messages` messages of a conversation as history turns, oldest first."""
+        from models import Message
+
+        messages = Message.query.filter_by(conversation_id=conversation_id) \
+            .order_by(Message.created_at.desc(), Message.id.desc()).limit(self.history_messages).all()
+        return [{'role': SENDER_TO_ROLE.get(message.sender, 'user'), 'parts': [message.content]}
+                for message in reversed(messages)]
+
+    def _load(self, user_id: str) -> Dict[str, Any]:
+        """Build a hot entry from the user's latest conversation (flushing their queued turns first)."""
+        turns: List[Dict[str, Any]] = []
+        conversation_id = None
+        db_user_id = _persistent_user_id(user_id)
+        if db_user_id is not None:
+            from models import Conversation
+
+            if any(item['user_id'] == user_id for item in self._pending):
+                self.flush()
+            conversation = Conversation.query.filter_by(user_id=db_user_id) \
+                .order_by(Conversation.updated_at.desc(), Conversation.id.desc()).first()
+            if conversation:
+                conversation_id = conversation.id
+                turns = self._read_turns(conversation.id)
+        return {'turns': turns, 'conversation_id': conversation_id,
+                'bytes': sum(_turn_size(turn) for turn in turns), 'last_access': time.monotonic()}
+
+    def _entry(self, user_id: str) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                self._entries.move_to_end(user_id)
+                entry['last_access'] = now
+                self._stats['hits'] += 1
+                return entry
+
+        # Load outside the lock; if two requests race, the first stored entry wins
+        loaded = self._load(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                entry = loaded
+                self._entries[user_id] = entry
+                self._bytes += entry['bytes']
+                self._stats['loads'] += 1
+            self._entries.move_to_end(user_id)
+            self._evict(now, keep=user_id)
+            return entry
+
+    def get_history(self, user_id: str) -> List[Dict[str, Any]]:
+        """The user's recent turns as Gemini history ({'role', 'parts'} dicts); a copy."""
+        entry = self._entry(user_id)
+        with self._lock:
+            return list(entry['turns'])
+
+    def append_exchange(self, user_id: str, user_parts: List[Any], response_text: str) -> None:
+        """Record a user message and the model's reply, and queue both for the database."""
+        turns = [{'role': 'user', 'parts': user_parts}, {'role': 'model', 'parts': [response_text]}]
+        entry = self._entry(user_id)
+        created_at = datetime.utcnow()
+        with self._lock:
+            current = self._entries.get(user_id)
+            if current is not entry:
+                # Evicted (or reloaded) by another request in the meantime: put it back as most recent
+                if current is not None:
+                    self._bytes -= current['bytes']
+                self._entries[user_id] = entry
+                self._bytes += entry['bytes']
+            self._entries.move_to_end(user_id)
+            for turn in turns:
+                entry['turns'].append(turn)
+                size = _turn_size(turn)
+                entry['bytes'] += size
+                self._bytes += size
+            self._trim(entry)
+            self._evict(time.monotonic(), keep=user_id)
+            if _persistent_user_id(user_id) is not None:
+                self._pending.extend(dict(_message_fields(turn), user_id=user_id, created_at=created_at)
+                                     for turn in turns)
+            pending = len(self._pending)
+        self._start_flusher()
+        if pending >= self.flush_batch:
+            self._wake.set()
+
+    # -- write-behind ------------------------------------------------------
+
+    def flush(self) -> int:
+        """Insert queued messages in one transaction. Requires an app context. Returns rows written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            from models import Message
+
+            try:
+                conversations: Dict[str, Any] = {}
+                for item in batch:
+                    user_id = item['user_id']
+                    if user_id not in conversations:
+                        conversations[user_id] = self._conversation_for(user_id)
+                    conversation = conversations[user_id]
+                    db.session.add(Message(
+                        conversation=conversation,
+                        sender=item['sender'],
+                        content=item['content'],
+                        has_attachment=item['has_attachment'],
+                        attachment_type=item['attachment_type'],
+                        created_at=item['created_at']
+                    ))
+                    conversation.updated_at = item['created_at']
+                db.session.commit()
+                with self._lock:
+                    for user_id, conversation in conversations.items():
+                        entry = self._entries.get(user_id)
+                        if entry is not None:
+                            entry['conversation_id'] = conversation.id
+                    self._stats['flushed'] += len(batch)
+                return len(batch)
+            except Exception as e:
+                db.session.rollback()
+                with self._lock:
+                    # Keep the batch for the next attempt, ahead of newer messages
+                    self._pending = batch + self._pending
+                    self._stats['flush_errors'] += 1
+                logger.error(f"Error flushing {len(batch)} chat messages: {str(e)}")
+                return 0
+
+    def _conversation_for(self, user_id: str) -> Any:
+        from models import Conversation
+
+        with self._lock:
+            entry = self._entries.get(user_id) or {}
+        if entry.get('conversation_id'):
+            conversation = Conversation.query.get(entry['conversation_id'])
+            if conversation:
+                return conversation
+        db_user_id = _persistent_user_id(user_id)
+        conversation = Conversation.query.filter_by(user_id=db_user_id) \
+            .order_by(Conversation.updated_at.desc(), Conversation.id.desc()).first()
+        if conversation:
+            return conversation
+        conversation = Conversation(user_id=db_user_id)
+        db.session.add(conversation)
+        return conversation
+
+    def _start_flusher(self) -> None:
+        if self._flusher is not None:
+            return
+        with self._flush_lock:
+            if self._flusher is not None:
+                return
+            self._app = current_app._get_current_object()
+            self._flusher = threading.Thread(target=self._run_flusher, name='chat-flusher', daemon=True)
+            self._flusher.start()
+            atexit.register(self._flush_on_exit)
+
+    def _run_flusher(self) -> None:
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            with self._app.app_context():
+                try:
+                    self.flush()
+                finally:
+                    db.session.remove()
+
+    def _flush_on_exit(self) -> None:
+        if self._app is not None:
+            with self._app.app_context():
+                self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, users=len(self._entries), bytes=self._bytes, pending=len(self._pending))
+
+
+class SharedConversationStore(ConversationStore):
+    """
+    Conversation store for several worker processes sharing one database.
+
+    Each user's ChatSession row names their active conversation and carries a version that
+    every write bumps in the same transaction as its Message inserts. Writes go straight to the
+    database (no write-behind, so other workers see them at once); each process keeps its hot
+    copy tagged with the version it read and reloads it when another worker has moved the
+    version on, which costs one small query per access.
+    """
+
+    def _session_state(self, db_user_id: int) -> Any:
+        from models import ChatSession
+
+        return db.session.query(ChatSession.version, ChatSession.conversation_id) \
+            .filter_by(user_id=db_user_id).first()
+
+    def _load(self, user_id: str) -> Dict[str, Any]:
+        db_user_id = _persistent_user_id(user_id)
+        if db_user_id is None:
+            return super()._load(user_id)
+        state = self._session_state(db_user_id)
+        turns = self._read_turns(state.conversation_id) if state and state.conversation_id else []
+        return {'turns': turns, 'conversation_id': state.conversation_id if state else None,
+                'version': state.version if state else 0,
+                'bytes': sum(_turn_size(turn) for turn in turns), 'last_access': time.monotonic()}
+
+    def get_history(self, user_id: str) -> List[Dict[str, Any]]:
+        db_user_id = _persistent_user_id(user_id)
+        if db_user_id is not None:
+            state = self._session_state(db_user_id)
+            version = state.version if state else 0
+            with self._lock:
+                entry = self._entries.get(user_id)
+                if entry is not None and entry.get('version') != version:
+                    # Another worker wrote since this copy was read
+                    self._drop(user_id)
+                    self._stats['stale'] = self._stats.get('stale', 0) + 1
+        return super().get_history(user_id)
+
+    def append_exchange(self, user_id: str, user_parts: List[Any], response_text: str) -> None:
+        """Write both turns and bump the session version in one transaction, then update the hot copy."""
+        from models import ChatSession, Conversation, Message
+
+        db_user_id = _persistent_user_id(user_id)
+        if db_user_id is None:
+            return super().append_exchange(user_id, user_parts, response_text)
+
+        turns = [{'role': 'user', 'parts': user_parts}, {'role': 'model', 'parts': [response_text]}]
+        entry = self._entry(user_id)
+        with self._lock:
+            known_version = entry.get('version')
+        created_at = datetime.utcnow()
+        try:
+            chat_session = ChatSession.query.filter_by(user_id=db_user_id).first()
+            if chat_session is None:
+                try:
+                    chat_session = ChatSession(user_id=db_user_id, version=0)
+                    db.session.add(chat_session)
+                    db.session.flush()
+                except IntegrityError:
+                    # Another worker created it first
+                    db.session.rollback()
+                    chat_session = ChatSession.query.filter_by(user_id=db_user_id).first()
+
+            # Bump the version first: this takes the write lock, so the state read next cannot
+            # change under us and concurrent writers queue up behind this transaction
+            db.session.execute(
+                update(ChatSession)
+                .where(ChatSession.id == chat_session.id)
+                .values(version=ChatSession.version + 1, updated_at=created_at)
+                .execution_options(synchronize_session=False)
+            )
+            new_version, conversation_id = db.session.query(ChatSession.version, ChatSession.conversation_id) \
+                .filter_by(id=chat_session.id).one()
+            if not conversation_id:
+                conversation = Conversation.query.filter_by(user_id=db_user_id) \
+                    .order_by(Conversation.updated_at.desc(), Conversation.id.desc()).first()
+                if conversation is None:
+                    conversation = Conversation(user_id=db_user_id)
+                    db.session.add(conversation)
+                    db.session.flush()
+                conversation_id = conversation.id
+                db.session.execute(
+                    update(ChatSession)
+                    .where(ChatSession.id == chat_session.id)
+                    .values(conversation_id=conversation_id)
+                    .execution_options(synchronize_session=False)
+                )
+
+            for turn in turns:
+                db.session.add(Message(conversation_id=conversation_id, created_at=created_at, **_message_fields(turn)))
+            db.session.query(Conversation).filter_by(id=conversation_id).update(
+                {'updated_at': created_at}, synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            with self._lock:
+                self._drop(user_id)
+                self._stats['flush_errors'] += 1
+            logger.error(f"Error saving chat messages for user {user_id}: {str(e)}")
+            return
+
+        with self._lock:
+            self._stats['flushed'] += len(turns)
+            if self._entries.get(user_id) is entry and known_version == new_version - 1:
+                for turn in turns:
+                    entry['turns'].append(turn)
+                    size = _turn_size(turn)
+                    entry['bytes'] += size
+                    self._bytes += size
+                entry['version'] = new_version
+                entry['conversation_id'] = conversation_id
+                self._trim(entry)
+                self._evict(time.monotonic(), keep=user_id)
+            else:
+                # Another worker wrote in between: reload in order on next access
+                self._drop(user_id)
+
+
+_store: Optional[ConversationStore] = None
+_store_lock = threading.Lock()
+
+
+def get_conversation_store() -> ConversationStore:
+    """
+    Return the process-wide conversation store configured from the CHAT_* settings.
+
+    CHAT_STATE_BACKEND 'memory' keeps the hot tier authoritative with write-behind persistence
+    (one worker process); 'shared' uses SharedConversationStore so several worker processes
+    can serve the same users.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            config = current_app.config
+            backend = config.get('CHAT_STATE_BACKEND', 'memory').lower()
+            if backend not in ('memory', 'shared'):
+                raise ValueError(f"Unknown CHAT_STATE_BACKEND: {backend}")
+            store_class = SharedConversationStore if backend == 'shared' else ConversationStore
+            _store = store_class(
+                max_users=config.get('CHAT_STORE_MAX_USERS', 1000),
+                max_bytes=config.get('CHAT_STORE_MAX_BYTES', 64 * 1024 * 1024),
+                idle_ttl=config.get('CHAT_STORE_IDLE_TTL', 1800),
+                history_messages=config.get('CHAT_HISTORY_MESSAGES', 20),
+                flush_interval=config.get('CHAT_STORE_FLUSH_INTERVAL', 2.0),
+                flush_batch=config.get('CHAT_STORE_FLUSH_BATCH', 50)
+            )
+        return _store
@@ -0,0 +1,400 @@
+import json
+import random
+import threading
+import time
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from flask import current_app
+
+from rate_limiter import get_gemini_rate_limiter
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+class GeminiClientError(Exception):
+    """Gemini is not usable in this process (missing API key or configuration failure)."""
+
+
+class GeminiUnavailableError(GeminiClientError):
+    """The circuit breaker is open: recent Gemini calls mostly failed, so calls fail fast."""
+
+
+class GeminiTimeoutError(GeminiClientError):
+    """A Gemini call did not finish before its deadline."""
+
+
+class GeminiCancelledError(GeminiClientError):
+    """The caller no longer wants the result (e.g. the chat client disconnected)."""
+
+
+# Transient failures worth retrying: rate limiting (429), server errors and dropped connections
+RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.DeadlineExceeded,
+    ConnectionError,
+    GeminiTimeoutError
+)
+
+
+def is_retryable(error: Exception) -> bool:
+    return isinstance(error, RETRYABLE_ERRORS)
+
+
+class GeminiClientRegistry:
+    """
+    Process-wide Gemini setup.
+
+    `genai.configure` replaces the library's default clients, dropping their open transport,
+    so it is called once per API key instead of once per request. Model objects are cached
+    per (model name, generation config, safety settings); each keeps its client, and with it
+    the HTTP/gRPC connection, warm between calls. Both the registry and the cached models are
+    safe to share between threads.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._api_key: Optional[str] = None
+        self._models: Dict[Tuple[str, str, str], Any] = {}
+
+    def configure(self, api_key: str) -> None:
+        """Configure the API key, once per key; changing the key drops the cached models."""
+        if not api_key:
+            raise GeminiClientError("GEMINI_API_KEY not configured")
+        with self._lock:
+            if api_key == self._api_key:
+                return
+            genai.configure(api_key=api_key)
+            self._api_key = api_key
+            self._models.clear()
+            logger.info("Configured Gemini API client")
+
+    @property
+    def configured(self) -> bool:
+        return self._api_key is not None
+
+    def get_model(self, model_name: str, generation_config: Optional[Dict[str, Any]] = None,
+                  safety_settings: Optional[List[Dict[str, str]]] = None) -> Any:
+        """
+        Return the shared model object for this name and configuration.
+
+        Args:
+            model_name (str): Gemini model name
+            generation_config (Optional[Dict[str, Any]]): Generation parameters
+            safety_settings (Optional[List[Dict[str, str]]]): Safety settings
+
+        Returns:
+            genai.GenerativeModel: A cached model instance
+        """
+        if not self.configured:
+            raise GeminiClientError("Gemini API client not configured")
+        key = (
+            model_name,
+            json.dumps(generation_config or {}, sort_keys=True),
+            json.dumps(safety_settings or [], sort_keys=True)
+        )
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                model = genai.GenerativeModel(
+                    model_name=model_name,
+                    generation_config=generation_config,
+                    safety_settings=safety_settings
+                )
+                self._models[key] = model
+                logger.debug(f"Created Gemini model instance for {model_name} ({len(self._models)} cached)")
+            return model
+
+    def reset(self) -> None:
+        """Forget the configured key and cached models (the next call reconfigures)."""
+        with self._lock:
+            self._api_key = None
+            self._models.clear()
+
+
+gemini_clients = GeminiClientRegistry()
+
+
+def get_gemini_model(model_name: Optional[str] = None, generation_config: Optional[Dict[str, Any]] = None,
+                     safety_settings: Optional[List[Dict[str, str]]] = None) -> Any:
+    """
+    Return a shared model using the app's GEMINI_API_KEY, configuring the API on first use.
+
+    Args:
+        model_name (Optional[str]): Model name (defaults to GEMINI_MODEL)
+        generation_config (Optional[Dict[str, Any]]): Generation parameters
+        safety_settings (Optional[List[Dict[str, str]]]): Safety settings
+
+    Returns:
+        genai.GenerativeModel: A cached model instance
+
+    Raises:
+        GeminiClientError: If no API key is configured
+    """
+    gemini_clients.configure(current_app.config.get('GEMINI_API_KEY'))
+    return gemini_clients.get_model(
+        model_name or current_app.config.get('GEMINI_MODEL', 'gemini-1.5-flash'),
+        generation_config=generation_config,
+        safety_settings=safety_settings
+    )
+
+
+class CircuitBreaker:
+    """
+    Error-rate circuit breaker over a sliding time window.
+
+    Closed: calls pass and outcomes are recorded. Once at least `min_calls` outcomes in the
+    last `window` seconds have an error rate of `error_rate` or more, the breaker opens and
+    rejects calls for `open_seconds`. It then half-opens: one trial call is let through, and
+    its outcome closes the breaker again or re-opens it.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, error_rate: float = 0.5, min_calls: int = 10, window: float = 60.0,
+                 open_seconds: float = 30.0) -> None:
+        self.error_rate = error_rate
+        self.min_calls = max(1, min_calls)
+        self.window = window
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._outcomes: deque = deque()  # (monotonic time, succeeded)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._counters = {'calls': 0, 'successes': 0, 'failures': 0, 'client_errors': 0,
+                          'retries': 0, 'timeouts': 0, 'cancelled': 0, 'rejected': 0, 'opened': 0}
+
+    def _trim(self, now: float) -> None:
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            self._outcomes.popleft()
+
+    def allow(self) -> bool:
+        """Whether a call may be attempted now (counts a rejection if not)."""
+        with self._lock:
+            now = time.monotonic()
+            if self._state == self.OPEN and now - self._opened_at >= self.open_seconds:
+                self._state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self._counters['rejected'] += 1
+            return False
+
+    def record(self, succeeded: bool, counter: Optional[str] = None) -> None:
+        """Record a call outcome; counter overrides the 'successes'/'failures' counter bumped."""
+        with self._lock:
+            now = time.monotonic()
+            self._counters['calls'] += 1
+            self._counters[counter or ('successes' if succeeded else 'failures')] += 1
+            if self._state == self.HALF_OPEN:
+                self._trial_in_flight = False
+                if succeeded:
+                    self._state = self.CLOSED
+                    self._outcomes.clear()
+                    logger.info("Gemini circuit breaker closed")
+                else:
+                    self._open(now)
+                return
+            self._outcomes.append((now, succeeded))
+            self._trim(now)
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            if (self._state == self.CLOSED and len(self._outcomes) >= self.min_calls
+                    and failures / len(self._outcomes) >= self.error_rate):
+                self._open(now)
+
+    def _open(self, now: float) -> None:
+        self._state = self.OPEN
+        self._opened_at = now
+        self._counters['opened'] += 1
+        logger.warning(f"Gemini circuit breaker opened for {self.open_seconds:.0f}s")
+
+    def release(self) -> None:
+        """Give back a half-open trial that was allowed but never attempted."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def count(self, counter: str) -> None:
+        with self._lock:
+            self._counters[counter] += 1
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                return self.HALF_OPEN
+            return self._state
+
+    def stats(self) -> Dict[str, Any]:
+        state = self.state
+        with self._lock:
+            self._trim(time.monotonic())
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            return dict(
+                self._counters,
+                state=state,
+                window_calls=len(self._outcomes),
+                window_error_rate=round(failures / len(self._outcomes), 3) if self._outcomes else 0.0
+            )
+
+
+_breakers: Dict[Tuple[str, float, int, float, float], CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+_call_executor: Optional[ThreadPoolExecutor] = None
+_call_executor_lock = threading.Lock()
+
+
+def get_circuit_breaker() -> CircuitBreaker:
+    """Shared breaker for all Gemini calls made by this process (GEMINI_BREAKER_* settings)."""
+    config = current_app.config
+    key = (
+        'gemini',
+        float(config.get('GEMINI_BREAKER_ERROR_RATE', 0.5)),
+        int(config.get('GEMINI_BREAKER_MIN_CALLS', 10)),
+        float(config.get('GEMINI_BREAKER_WINDOW', 60)),
+        float(config.get('GEMINI_BREAKER_OPEN_SECONDS', 30))
+    )
+    with _breakers_lock:
+        if key not in _breakers:
+            _breakers[key] = CircuitBreaker(*key[1:])
+        return _breakers[key]
+
+
+def _get_call_executor() -> ThreadPoolExecutor:
+    """Threads that run the blocking SDK calls, so callers can stop waiting at their deadline."""
+    global _call_executor
+    with _call_executor_lock:
+        if _call_executor is None:
+            _call_executor = ThreadPoolExecutor(
+                max_workers=max(1, current_app.config.get('GEMINI_CALL_THREADS', 16)),
+                thread_name_prefix='gemini-call'
+            )
+        return _call_executor
+
+
+# How often a cancellable call checks its cancel event while waiting on the SDK
+CANCEL_POLL_SECONDS = 0.25
+
+
+def _wait_for_result(future: Any, deadline: float, cancel: Optional[threading.Event]) -> Any:
+    """Wait for an SDK call until the deadline, giving up early once cancel is set."""
+    while True:
+        remaining = max(0.0, deadline - time.monotonic())
+        if cancel is None:
+            return future.result(timeout=remaining)
+        try:
+            return future.result(timeout=min(remaining, CANCEL_POLL_SECONDS))
+        except FutureTimeoutError:
+            if cancel.is_set():
+                raise GeminiCancelledError("Gemini call cancelled by the caller")
+            if time.monotonic() >= deadline:
+                raise
+
+
+def call_gemini(func: Callable[..., Any], *args: Any, timeout: Optional[float] = None,
+                max_retries: Optional[int] = None, cancel: Optional[threading.Event] = None,
+                **kwargs: Any) -> Any:
+    """
+    Run one Gemini SDK call with a deadline, retries and the circuit breaker.
+
+    Every attempt waits on the shared rate limiter, is rejected at once while the breaker is
+    open, and is abandoned when the deadline passes (the SDK call cannot be interrupted, so it
+    finishes in the background and its result is dropped). Retryable errors (429, 5xx,
+    connection errors, attempt timeouts) are retried with full-jitter exponential backoff as
+    long as the overall deadline allows; other errors are raised at once and do not count
+    against the breaker.
+
+    Args:
+        func (Callable[..., Any]): SDK method, e.g. model.generate_content or chat.send_message
+        *args (Any): Positional arguments for func
+        timeout (Optional[float]): Overall deadline in seconds (defaults to GEMINI_CALL_TIMEOUT)
+        max_retries (Optional[int]): Retries after the first attempt (defaults to GEMINI_MAX_RETRIES)
+        cancel (Optional[threading.Event]): Once set, stop waiting and retrying
+        **kwargs (Any): Keyword arguments for func
+
+    Returns:
+        Any: func's return value
+
+    Raises:
+        GeminiUnavailableError: If the breaker is open
+        GeminiTimeoutError: If the deadline passed
+        GeminiCancelledError: If cancel was set before the call finished
+    """
+    config = current_app.config
+    timeout = timeout if timeout is not None else config.get('GEMINI_CALL_TIMEOUT', 60)
+    max_retries = max_retries if max_retries is not None else config.get('GEMINI_MAX_RETRIES', 3)
+    base_delay = config.get('GEMINI_RETRY_BASE_DELAY', 1.0)
+    max_delay = config.get('GEMINI_RETRY_MAX_DELAY', 20.0)
+    breaker = get_circuit_breaker()
+    limiter = get_gemini_rate_limiter()
+    executor = _get_call_executor()
+    deadline = time.monotonic() + timeout
+
+    attempt = 0
+    while True:
+        if cancel is not None and cancel.is_set():
+            breaker.count('cancelled')
+            raise GeminiCancelledError("Gemini call cancelled by the caller")
+        if not breaker.allow():
+            raise GeminiUnavailableError("Gemini is temporarily unavailable (circuit breaker open)")
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not limiter.acquire(timeout=remaining):
+            breaker.release()
+            breaker.count('timeouts')
+            raise GeminiTimeoutError(f"Gemini call did not start within {timeout:.0f}s")
+
+        future = executor.submit(func, *args, **kwargs)
+        try:
+            result = _wait_for_result(future, deadline, cancel)
+            breaker.record(True)
+            return result
+        except GeminiCancelledError:
+            # Abandoned, not failed: says nothing about the API's health
+            future.cancel()
+            breaker.release()
+            breaker.count('cancelled')
+            raise
+        except FutureTimeoutError:
+            future.cancel()
+            breaker.count('timeouts')
+            breaker.record(False)
+            raise GeminiTimeoutError(f"Gemini call exceeded its {timeout:.0f}s deadline")
+        except Exception as e:
+            if not is_retryable(e):
+                # Bad requests and blocked prompts say nothing about the API's health
+                breaker.record(True, counter='client_errors')
+                raise
+            breaker.record(False)
+            delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+            if attempt >= max_retries or time.monotonic() + delay >= deadline:
+                raise
+            attempt += 1
+            breaker.count('retries')
+            logger.warning(f"Gemini call failed ({type(e).__name__}), retry {attempt}/{max_retries} in {delay:.1f}s")
+            if cancel is not None:
+                cancel.wait(delay)
+            else:
+                time.sleep(delay)
+
+
+def gemini_status() -> Dict[str, Any]:
+    """Breaker state and call counters for monitoring."""
+    return {
+        'configured': gemini_clients.configured,
+        'breaker': get_circuit_breaker().stats()
+    }
@@ -0,0 +1,236 @@
+import os
+import io
+import base64
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Optional, Dict, Any
+from PIL import Image, ImageOps
+from flask import current_app
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp', 'PNG': 'image/png'}
+
+
+class ImagePreparer:
+    """
+    Shared preparation stage for images sent to Gemini.
+
+    Caps the longest edge, re-encodes to a compact format at a configurable quality and
+    drops metadata (EXIF, ICC text chunks) by never copying it to the output. Prepared
+    images are cached on disk by source content hash plus settings, so the same scan or
+    photo is only re-encoded once; the cache is trimmed least-recently-used.
+
+    Trimming scans the cache directory, so it runs only when the bytes written since the last
+    scan may have pushed the cache over max_cache_bytes, or EVICT_INTERVAL seconds after the
+    last scan (other processes may share the directory). It trims to EVICT_LOW_WATER of the
+    limit so the next writes do not trigger another scan straight away. Temporary files being
+    written are skipped unless they are older than STALE_TMP_SECONDS (left by a crashed writer).
+    """
+
+    EVICT_INTERVAL = 300.0
+    EVICT_LOW_WATER = 0.9
+    STALE_TMP_SECONDS = 3600.0
+
+    def __init__(self, cache_dir: Optional[str], max_edge: int = 1536, image_format: str = 'JPEG',
+                 quality: int = 80, max_cache_bytes: int = 256 * 1024 * 1024) -> None:
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.max_edge = max_edge
+        self.image_format = image_format.upper()
+        self.quality = quality
+        self.max_cache_bytes = max_cache_bytes
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self._cache_bytes: Optional[int] = None  # estimate since the last scan; None until the first
+        self._last_evict = 0.0
+        self._counters = {
+            'images': 0, 'bytes_before': 0, 'bytes_after': 0,
+            'cache_hits': 0, 'cache_misses': 0, 'failures': 0
+        }
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def mime_type(self) -> str:
+        return MIME_TYPES.get(self.image_format, f'image/{self.image_format.lower()}')
+
+    def _cache_path(self, data: bytes) -> Optional[Path]:
+        if not self.cache_dir:
+            return None
+        key = f"{hashlib.sha256(data).hexdigest()}-{self.max_edge}-{self.image_format}-{self.quality}"
+        return self.cache_dir / key[:2] / f"{key}.{self.image_format.lower()}"
+
+    def _record(self, before: int, after: int, **counters: int) -> None:
+        with self._lock:
+            self._counters['images'] += 1
+            self._counters['bytes_before'] += before
+            self._counters['bytes_after'] += after
+            for name, amount in counters.items():
+                self._counters[name] += amount
+
+    def _encode(self, data: bytes) -> bytes:
+        image = Image.open(io.BytesIO(data))
+        image = ImageOps.exif_transpose(image)
+        if max(image.size) > self.max_edge:
+            image.thumbnail((self.max_edge, self.max_edge), Image.LANCZOS)
+
+        if self.image_format == 'JPEG':
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+        elif image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+        output = io.BytesIO()
+        # Only pixel data is written: EXIF/XMP/ICC metadata is not passed through
+        image.save(output, format=self.image_format, quality=self.quality, optimize=True)
+        return output.getvalue()
+
+    def prepare(self, data: bytes, source_format: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Downscale and re-encode one image.
+
+        Args:
+            data (bytes): Encoded source image
+            source_format (Optional[str]): Source format/extension, used if the image cannot be decoded
+
+        Returns:
+            Dict[str, Any]: Dictionary containing:
+                - 'data' (bytes): Prepared image bytes
+                - 'mime_type' (str): MIME type of the prepared image
+                - 'bytes_before' / 'bytes_after' (int): Payload size before and after
+                - 'cached' (bool): Whether the result came from the cache
+        """
+        cache_path = self._cache_path(data)
+        if cache_path is not None and cache_path.exists():
+            try:
+                prepared = cache_path.read_bytes()
+                os.utime(cache_path)
+                self._record(len(data), len(prepared), cache_hits=1)
+                return {'data': prepared, 'mime_type': self.mime_type, 'bytes_before': len(data),
+                        'bytes_after': len(prepared), 'cached': True}
+            except OSError as e:
+                logger.warning(f"Could not read prepared image {cache_path.name}: {str(e)}")
+
+        try:
+            prepared = self._encode(data)
+        except Exception as e:
+            # Undecodable images are passed through unchanged rather than dropped
+            logger.warning(f"Could not prepare image, sending original: {str(e)}")
+            self._record(len(data), len(data), failures=1)
+            fmt = (source_format or 'jpeg').lower().replace('jpg', 'jpeg')
+            return {'data': data, 'mime_type': f'image/{fmt}', 'bytes_before': len(data),
+                    'bytes_after': len(data), 'cached': False}
+
+        self._record(len(data), len(prepared), cache_misses=1)
+        if cache_path is not None:
+            self._store(cache_path, prepared)
+        return {'data': prepared, 'mime_type': self.mime_type, 'bytes_before': len(data),
+                'bytes_after': len(prepared), 'cached': False}
+
+    def _store(self, cache_path: Path, prepared: bytes) -> None:
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_name(f".{uuid.uuid4().hex}.tmp")
+            tmp_path.write_bytes(prepared)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.error(f"Could not cache prepared image {cache_path.name}: {str(e)}")
+            return
+        with self._lock:
+            if self._cache_bytes is not None:
+                self._cache_bytes += len(prepared)
+            due = (self._cache_bytes is None or self._cache_bytes > self.max_cache_bytes
+                   or time.monotonic() - self._last_evict >= self.EVICT_INTERVAL)
+        if due:
+            self._evict()
+
+    def _evict(self) -> None:
+        """Trim the cache least-recently-used; a scan already running in another thread is not repeated."""
+        if not self._evict_lock.acquire(blocking=False):
+            return
+        try:
+            files = []
+            total = 0
+            now = time.time()
+            for path in self.cache_dir.glob('*/*'):
+                try:
+                    stat = path.stat()
+                    if path.name.endswith('.tmp'):
+                        # Another thread or process may still be writing this file
+                        if now - stat.st_mtime > self.STALE_TMP_SECONDS:
+                            path.unlink(missing_ok=True)
+                        continue
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+            if total > self.max_cache_bytes:
+                target = self.max_cache_bytes * self.EVICT_LOW_WATER
+                for _, size, path in sorted(files):
+                    if total <= target:
+                        break
+                    try:
+                        path.unlink(missing_ok=True)
+                    except OSError as e:
+                        logger.warning(f"Could not evict prepared image {path.name}: {str(e)}")
+                        continue
+                    total -= size
+            with self._lock:
+                self._cache_bytes = total
+                self._last_evict = time.monotonic()
+        finally:
+            self._evict_lock.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return image count, payload bytes before/after and cache counters for this process."""
+        with self._lock:
+            stats = dict(self._counters)
+        stats['bytes_saved'] = stats['bytes_before'] - stats['bytes_after']
+        stats['ratio'] = round(stats['bytes_after'] / stats['bytes_before'], 4) if stats['bytes_before'] else 1.0
+        stats.update(max_edge=self.max_edge, format=self.image_format, quality=self.quality)
+        return stats
+
+
+_preparers: Dict[tuple, ImagePreparer] = {}
+_preparers_lock = threading.Lock()
+
+
+def get_image_preparer() -> Optional[ImagePreparer]:
+    """Return the process-wide image preparer for the current app, or None if disabled."""
+    if not current_app.config.get('IMAGE_PREP_ENABLED', True):
+        return None
+    cache_dir = current_app.config.get('IMAGE_PREP_CACHE_DIR') or os.path.join(current_app.instance_path, 'image_cache')
+    settings = (
+        cache_dir,
+        current_app.config.get('IMAGE_PREP_MAX_EDGE', 1536),
+        current_app.config.get('IMAGE_PREP_FORMAT', 'JPEG'),
+        current_app.config.get('IMAGE_PREP_QUALITY', 80),
+        current_app.config.get('IMAGE_PREP_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+    )
+    with _preparers_lock:
+        if settings not in _preparers:
+            _preparers[settings] = ImagePreparer(*settings)
+        return _preparers[settings]
+
+
+def prepare_inline_image(data: bytes, source_format: Optional[str] = None) -> Dict[str, str]:
+    """
+    Prepare an image and return it as a Gemini inline part ({'mime_type', 'data' (base64)}).
+    Falls back to the original bytes when image preparation is disabled.
+    """
+    preparer = get_image_preparer()
+    if preparer is None:
+        fmt = (source_format or 'jpeg').lower().replace('jpg', 'jpeg')
+        return {'mime_type': f'image/{fmt}', 'data': base64.b64encode(data).decode('utf-8')}
+    prepared = preparer.prepare(data, source_format)
+    return {'mime_type': prepared['mime_type'], 'data': base64.b64encode(prepared['data']).decode('utf-8')}
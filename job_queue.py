@@ -0,0 +1,389 @@
+import json
+import os
+import random
+import signal
+import socket
+import threading
+import time
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+import click
+from flask import Flask, current_app
+from sqlalchemy import update, or_, and_
+
+from extensions import db
+from models import BackgroundJob
+from llm_providers import get_llm_provider
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+JOB_HANDLERS: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {}
+
+
+class JobError(Exception):
+    """A job failed in a way that may succeed on retry."""
+
+
+class PermanentJobError(JobError):
+    """A job failed in a way retrying cannot fix (missing record, bad input, no API key)."""
+
+
+def job_handler(job_type: str) -> Callable:
+    """Register a function as the handler for a job type. Handlers take the payload dict and return a JSON-able dict."""
+    def decorator(func: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Callable:
+        JOB_HANDLERS[job_type] = func
+        return func
+    return decorator
+
+
+def enqueue_job(job_type: str, payload: Optional[Dict[str, Any]] = None, user_id: Optional[int] = None,
+                max_attempts: Optional[int] = None, reuse_active: bool = True) -> BackgroundJob:
+    """
+    Queue a job for the worker pool.
+
+    Args:
+        job_type (str): A registered job type
+        payload (Optional[Dict[str, Any]]): JSON-able handler arguments
+        user_id (Optional[int]): Owner of the job, checked by the status endpoint
+        max_attempts (Optional[int]): Attempts before the job is marked failed (defaults to JOB_MAX_ATTEMPTS)
+        reuse_active (bool): Return an already queued/running job with the same type and payload
+            instead of queueing a duplicate
+
+    Returns:
+        BackgroundJob: The queued (or reused) job
+    """
+    if job_type not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job type: {job_type}")
+    payload_json = json.dumps(payload or {}, sort_keys=True)
+    dedupe_key = f"{job_type}:{payload_json}"[:255]
+
+    if reuse_active:
+        existing = BackgroundJob.query.filter(
+            BackgroundJob.dedupe_key == dedupe_key,
+            BackgroundJob.user_id == user_id,
+            BackgroundJob.status.in_(BackgroundJob.ACTIVE_STATUSES)
+        ).order_by(BackgroundJob.id.desc()).first()
+        if existing:
+            return existing
+
+    job = BackgroundJob(
+        job_type=job_type,
+        user_id=user_id,
+        payload=payload_json,
+        dedupe_key=dedupe_key,
+        max_attempts=max_attempts or current_app.config.get('JOB_MAX_ATTEMPTS', 3),
+        run_after=datetime.utcnow()
+    )
+    db.session.add(job)
+    db.session.commit()
+    logger.info(f"Queued job {job.id} ({job_type})")
+    return job
+
+
+def latest_job(job_type: str, payload: Dict[str, Any], user_id: Optional[int] = None) -> Optional[BackgroundJob]:
+    """Return the most recent job of this type and payload, whatever its status."""
+    dedupe_key = f"{job_type}:{json.dumps(payload, sort_keys=True)}"[:255]
+    return BackgroundJob.query.filter_by(dedupe_key=dedupe_key, user_id=user_id) \
+        .order_by(BackgroundJob.id.desc()).first()
+
+
+def claim_next_job(worker_id: str) -> Optional[BackgroundJob]:
+    """
+    Atomically claim the oldest runnable job.
+
+    Claiming is a conditional UPDATE on the job's status, so when several workers (threads or
+    processes) race for the same row exactly one of them sees a rowcount of 1. Running jobs whose
+    lease expired (the worker died) are claimable again.
+    """
+    now = datetime.utcnow()
+    lease_expired = now - timedelta(seconds=current_app.config.get('JOB_LEASE_SECONDS', 900))
+    runnable = or_(
+        and_(BackgroundJob.status == BackgroundJob.STATUS_QUEUED, BackgroundJob.run_after <= now),
+        and_(BackgroundJob.status == BackgroundJob.STATUS_RUNNING, BackgroundJob.locked_at < lease_expired)
+    )
+
+    for _ in range(5):
+        candidate = db.session.query(BackgroundJob.id, BackgroundJob.status) \
+            .filter(runnable).order_by(BackgroundJob.run_after, BackgroundJob.id).first()
+        if candidate is None:
+            db.session.commit()
+            return None
+
+        claimed = db.session.execute(
+            update(BackgroundJob)
+            .where(BackgroundJob.id == candidate.id, BackgroundJob.status == candidate.status, runnable)
+            .values(status=BackgroundJob.STATUS_RUNNING, locked_by=worker_id, locked_at=now,
+                    started_at=now, attempts=BackgroundJob.attempts + 1)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        if claimed.rowcount == 1:
+            if candidate.status == BackgroundJob.STATUS_RUNNING:
+                logger.warning(f"Reclaimed job {candidate.id} after its lease expired")
+            return BackgroundJob.query.get(candidate.id)
+        # Another worker won the race for this row; try the next one
+    return None
+
+
+def _retry_delay(attempts: int) -> float:
+    """Exponential backoff with jitter: base * 2^(attempts-1), capped, +/- 20%."""
+    base = current_app.config.get('JOB_RETRY_BASE_DELAY', 5)
+    cap = current_app.config.get('JOB_RETRY_MAX_DELAY', 300)
+    delay = min(cap, base * (2 ** max(attempts - 1, 0)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _claimed(job_id: int, worker_id: str, attempts: int) -> Any:
+    """Filter matching a job only while the given claim (worker and attempt) still holds it."""
+    return and_(BackgroundJob.id == job_id, BackgroundJob.status == BackgroundJob.STATUS_RUNNING,
+                BackgroundJob.locked_by == worker_id, BackgroundJob.attempts == attempts)
+
+
+def _update_claimed(job_id: int, worker_id: str, attempts: int, **values: Any) -> bool:
+    """Apply values to a job if the claim still holds; returns whether it did."""
+    updated = db.session.execute(
+        update(BackgroundJob)
+        .where(_claimed(job_id, worker_id, attempts))
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return updated.rowcount == 1
+
+
+def _renew_lease(app: Flask, job_id: int, worker_id: str, attempts: int, done: threading.Event) -> None:
+    """Keep a running job's lease fresh until done is set, so long jobs are not reclaimed."""
+    interval = max(1.0, app.config.get('JOB_LEASE_SECONDS', 900) / 3)
+    while not done.wait(interval):
+        with app.app_context():
+            try:
+                if not _update_claimed(job_id, worker_id, attempts, locked_at=datetime.utcnow()):
+                    logger.warning(f"Job {job_id} lease lost by {worker_id}; no longer renewing it")
+                    return
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error renewing lease of job {job_id}: {str(e)}")
+            finally:
+                db.session.remove()
+
+
+def run_job(job: BackgroundJob) -> None:
+    """
+    Run a claimed job and record its result, scheduling a retry on failure.
+
+    The lease is renewed while the handler runs. The outcome is only recorded if this claim
+    still holds the job, so a worker whose lease was lost cannot overwrite the new owner's run.
+    """
+    handler = JOB_HANDLERS.get(job.job_type)
+    job_id, job_type, worker_id = job.id, job.job_type, job.locked_by
+    attempts, max_attempts = job.attempts, job.max_attempts
+    started = time.perf_counter()
+    done = threading.Event()
+    threading.Thread(target=_renew_lease, args=(current_app._get_current_object(), job_id, worker_id, attempts, done),
+                     name=f"job-lease-{job_id}", daemon=True).start()
+    try:
+        if handler is None:
+            raise PermanentJobError(f"No handler registered for job type {job_type}")
+        result = handler(job.payload_data)
+    except Exception as e:
+        done.set()
+        db.session.rollback()
+        values: Dict[str, Any] = {'error': str(e), 'locked_by': None, 'locked_at': None}
+        if isinstance(e, PermanentJobError) or attempts >= max_attempts:
+            values.update(status=BackgroundJob.STATUS_FAILED, finished_at=datetime.utcnow())
+            message = f"Job {job_id} ({job_type}) failed after {attempts} attempt(s): {str(e)}"
+        else:
+            delay = _retry_delay(attempts)
+            values.update(status=BackgroundJob.STATUS_QUEUED, run_after=datetime.utcnow() + timedelta(seconds=delay))
+            message = f"Job {job_id} ({job_type}) attempt {attempts} failed, retrying in {delay:.1f}s: {str(e)}"
+        if not _update_claimed(job_id, worker_id, attempts, **values):
+            logger.warning(f"Job {job_id} ({job_type}) was reclaimed while running; dropping its failure: {str(e)}")
+        elif values['status'] == BackgroundJob.STATUS_FAILED:
+            logger.error(message)
+        else:
+            logger.warning(message)
+        return
+    finally:
+        done.set()
+
+    db.session.rollback()
+    if not _update_claimed(job_id, worker_id, attempts, status=BackgroundJob.STATUS_SUCCEEDED,
+                           result=json.dumps(result), error=None, locked_by=None, locked_at=None,
+                           finished_at=datetime.utcnow()):
+        logger.warning(f"Job {job_id} ({job_type}) was reclaimed while running; dropping its result")
+        return
+    logger.info(f"Job {job_id} ({job_type}) succeeded in {time.perf_counter() - started:.2f}s")
+
+
+def purge_finished_jobs(retention_days: Optional[float] = None) -> int:
+    """
+    Delete succeeded and failed jobs that finished more than retention_days ago.
+
+    Args:
+        retention_days (Optional[float]): Age in days (defaults to JOB_RETENTION_DAYS)
+
+    Returns:
+        int: Number of jobs deleted
+    """
+    if retention_days is None:
+        retention_days = current_app.config.get('JOB_RETENTION_DAYS', 7)
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    deleted = BackgroundJob.query.filter(
+        BackgroundJob.status.in_([BackgroundJob.STATUS_SUCCEEDED, BackgroundJob.STATUS_FAILED]),
+        BackgroundJob.finished_at < cutoff
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    if deleted:
+        logger.info(f"Deleted {deleted} job(s) finished before {cutoff.isoformat()}")
+    return deleted
+
+
+class JobWorkerPool:
+    """
+    Pool of worker threads that claim and run jobs from the background_jobs table.
+
+    Each thread runs in its own app context and database session. Several pools (one per
+    `flask run-jobs` process) can share one database; claims never hand a job to two workers.
+    A further thread deletes finished jobs past their retention every sweep_interval seconds.
+    """
+
+    def __init__(self, app: Flask, workers: int = 2, poll_interval: float = 1.0,
+                 sweep_interval: Optional[float] = None) -> None:
+        self.app = app
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval
+        self.sweep_interval = sweep_interval if sweep_interval is not None \
+            else app.config.get('JOB_SWEEP_INTERVAL', 3600)
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._sweeper: Optional[threading.Thread] = None
+        self._prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+    def start(self) -> None:
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, args=(f"{self._prefix}:{index}",),
+                                      name=f"job-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if self.sweep_interval > 0:
+            self._sweeper = threading.Thread(target=self._sweep, name='job-sweeper', daemon=True)
+            self._sweeper.start()
+        logger.info(f"Started {self.workers} job worker(s)")
+
+    def request_stop(self) -> None:
+        """Ask workers to stop after their current job."""
+        self._stop.set()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop workers and wait for their current jobs to finish."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        if self._sweeper is not None:
+            self._sweeper.join(timeout)
+
+    def wait(self) -> None:
+        while not self._stop.is_set() and any(thread.is_alive() for thread in self._threads):
+            self._stop.wait(0.5)
+
+    def _run(self, worker_id: str) -> None:
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    job = claim_next_job(worker_id)
+                    if job is not None:
+                        run_job(job)
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Job worker {worker_id} error: {str(e)}", exc_info=True)
+                    job = None
+                finally:
+                    db.session.remove()
+            if job is None:
+                self._stop.wait(self.poll_interval)
+
+    def _sweep(self) -> None:
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    purge_finished_jobs()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Job retention sweep error: {str(e)}", exc_info=True)
+                finally:
+                    db.session.remove()
+            self._stop.wait(self.sweep_interval)
+
+
+@job_handler('folder_summary')
+def run_folder_summary_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Generate (or refresh) a folder summary and any stale subfolder summaries. Payload: folder_id, force_refresh."""
+    from models import Folder, Document, FolderSummary
+
+    folder_id = payload['folder_id']
+    if not Folder.query.get(folder_id):
+        raise PermanentJobError(f"Folder {folder_id} not found")
+    if not Document.query.filter_by(folder_id=folder_id).first() and not Folder.query.filter_by(parent_id=folder_id).first():
+        return {'summary': "This folder is empty.", 'last_updated': None}
+    if not get_llm_provider().available():
+        raise PermanentJobError("Gemini API key not configured")
+
+    summary_text = FolderSummary.get_or_generate_summary(folder_id, force_refresh=payload.get('force_refresh', False))
+    summary = FolderSummary.query.filter_by(folder_id=folder_id).first()
+    # generate_summary reports errors as text instead of raising; only a stored summary counts as success
+    if not summary or summary.summary_text != summary_text:
+        raise JobError(summary_text)
+    return {
+        'summary': summary.summary_text,
+        'last_updated': summary.last_updated.isoformat() if summary.last_updated else None
+    }
+
+
+@job_handler('pdf_analysis')
+def run_pdf_analysis_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Analyze a PDF's pages and images. Payload: document_id, extract_text."""
+    from models import Document
+
+    document = Document.query.get(payload['document_id'])
+    if not document:
+        raise PermanentJobError(f"Document {payload['document_id']} not found")
+
+    result = document.process_pdf_images(from_flask_login=False, extract_text=payload.get('extract_text', True))
+    if not result['success']:
+        raise PermanentJobError(result['message'])
+    items = result['results']
+    if items and all(item.get('error') for item in items):
+        # Every Gemini call failed: most likely an outage or rate limit, worth retrying
+        raise JobError(result['message'])
+    # Job results are kept in the database: store the analyses and image references only.
+    # The images themselves are served from the extraction cache by the dashboard.
+    result['results'] = [{k: v for k, v in item.items() if k != 'image_data'} for item in items]
+    return result
+
+
+def register_job_commands(app: Flask) -> None:
+    """Register the background job worker command."""
+    @app.cli.command('run-jobs')
+    @click.option('--workers', type=int, default=None, help='Worker threads (defaults to JOB_WORKERS).')
+    @click.option('--poll-interval', type=float, default=None, help='Seconds between polls when idle.')
+    def run_jobs_command(workers: Optional[int], poll_interval: Optional[float]) -> None:
+        """Run background job workers until interrupted."""
+        pool = JobWorkerPool(
+            app,
+            workers=workers or app.config.get('JOB_WORKERS', 2),
+            poll_interval=poll_interval or app.config.get('JOB_POLL_INTERVAL', 1.0)
+        )
+
+        def shutdown(signum: int, frame: Any) -> None:
+            print("Stopping job workers after their current jobs...")
+            pool.request_stop()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+        pool.start()
+        print(f"Running {pool.workers} job worker(s); press Ctrl+C to stop")
+        pool.wait()
+        pool.stop()
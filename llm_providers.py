@@ -0,0 +1,247 @@
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, List, Optional
+
+from flask import current_app
+from google.api_core import exceptions as google_exceptions
+
+from gemini_client import gemini_clients, get_gemini_model
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+class LLMProvider(ABC):
+    """
+    Source of model objects for every AI call site (chat, folder summaries, PDF analysis).
+
+    Models expose the subset of the google.generativeai GenerativeModel interface the app uses:
+    generate_content(contents, stream=False) and start_chat(history).send_message(message,
+    stream=False), returning responses with .text that iterate as chunks when streamed.
+    """
+
+    name = 'base'
+
+    @abstractmethod
+    def available(self) -> bool:
+        """Whether calls can be made (e.g. an API key is configured)."""
+
+    def configure(self) -> None:
+        """One-time setup; safe to call repeatedly."""
+
+    @abstractmethod
+    def get_model(self, model_name: Optional[str] = None, generation_config: Optional[Dict[str, Any]] = None,
+                  safety_settings: Optional[List[Dict[str, str]]] = None) -> Any:
+        """Return a model object for the given name and settings."""
+
+
+class GeminiProvider(LLMProvider):
+    """The Gemini API via the process-wide client registry."""
+
+    name = 'gemini'
+
+    def available(self) -> bool:
+        return bool(current_app.config.get('GEMINI_API_KEY'))
+
+    def configure(self) -> None:
+        gemini_clients.configure(current_app.config.get('GEMINI_API_KEY'))
+
+    def get_model(self, model_name: Optional[str] = None, generation_config: Optional[Dict[str, Any]] = None,
+                  safety_settings: Optional[List[Dict[str, str]]] = None) -> Any:
+        return get_gemini_model(model_name, generation_config=generation_config, safety_settings=safety_settings)
+
+
+class FakeChunk:
+    def __init__(self, text: str) -> None:
+        self.text = text
+
+
+class FakeResponse:
+    """Response shaped like the SDK's: .text is the full text, iteration yields chunks."""
+
+    def __init__(self, text: str, chunks: Optional[Iterator[str]] = None) -> None:
+        self._text = text
+        self._chunks = chunks
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    def __iter__(self) -> Iterator[FakeChunk]:
+        if self._chunks is None:
+            yield FakeChunk(self._text)
+            return
+        for chunk in self._chunks:
+            yield FakeChunk(chunk)
+
+
+class FakeChatSession:
+    def __init__(self, model: 'FakeModel', history: Optional[List[Dict[str, Any]]] = None) -> None:
+        self.model = model
+        self.history = list(history or [])
+
+    def send_message(self, content: Any, stream: bool = False) -> FakeResponse:
+        contents = [part for turn in self.history for part in turn.get('parts', [])]
+        contents.extend(content if isinstance(content, list) else [content])
+        response = self.model.generate_content(contents, stream=stream)
+        self.history.append({'role': 'user', 'parts': content if isinstance(content, list) else [content]})
+        self.history.append({'role': 'model', 'parts': [response.text]})
+        return response
+
+
+class FakeModel:
+    """Deterministic stand-in for a GenerativeModel; see FakeProvider."""
+
+    WORDS = (
+        "patient blood pressure within normal range follow-up recommended laboratory results show "
+        "stable values imaging findings unremarkable medication adherence reviewed no acute "
+        "concerns noted continue current treatment plan schedule routine monitoring"
+    ).split()
+
+    def __init__(self, provider: 'FakeProvider', model_name: str) -> None:
+        self.provider = provider
+        self.model_name = model_name
+
+    @staticmethod
+    def _digest(contents: Any) -> str:
+        """Stable hash of the request: text as-is, inline images by their data."""
+        sha = hashlib.sha256()
+        for part in contents if isinstance(contents, list) else [contents]:
+            if isinstance(part, dict):
+                sha.update(str(part.get('data', part.get('inline_data', ''))).encode())
+            else:
+                sha.update(str(part).encode())
+        return sha.hexdigest()
+
+    def _text_for(self, contents: Any, digest: str) -> str:
+        parts = contents if isinstance(contents, list) else [contents]
+        rng = random.Random(digest)
+        words = self.provider.settings['response_words']
+
+        def paragraph(count: int) -> str:
+            return " ".join(rng.choice(self.WORDS) for _ in range(count)).capitalize() + "."
+
+        prompt_text = " ".join(part for part in parts if isinstance(part, str))
+        if 'JSON array' in prompt_text:
+            # Batched image analysis: one entry per inline image, as the prompt asks
+            images = sum(1 for part in parts if isinstance(part, dict))
+            return json.dumps([{'image': number, 'analysis': f"**Image {number}**: {paragraph(max(8, words // 4))}"}
+                               for number in range(1, images + 1)])
+        sections = max(1, math.ceil(words / 40))
+        per_section = max(1, words // sections)
+        return "\n\n".join(f"## Finding {index + 1}\n\n{paragraph(per_section)}" for index in range(sections))
+
+    def generate_content(self, contents: Any, stream: bool = False, **kwargs: Any) -> FakeResponse:
+        digest = self._digest(contents)
+        self.provider.simulate_call()
+        text = self._text_for(contents, digest)
+        if not stream:
+            return FakeResponse(text)
+        return FakeResponse(text, self.provider.stream_chunks(text))
+
+    def start_chat(self, history: Optional[List[Dict[str, Any]]] = None) -> FakeChatSession:
+        return FakeChatSession(self, history)
+
+
+class FakeProvider(LLMProvider):
+    """
+    Offline provider for load tests.
+
+    Responses depend only on the request content, so repeated runs produce the same text
+    (and the JSON array the batched image prompt asks for). Latency is drawn from a
+    log-normal distribution around LLM_FAKE_LATENCY_MS, streamed responses arrive in
+    LLM_FAKE_CHUNK_CHARS chunks, and LLM_FAKE_ERROR_RATE of calls fail with a 429 or 503 so
+    the retry and circuit-breaker paths are exercised. Latency and errors come from one
+    generator seeded with LLM_FAKE_SEED.
+    """
+
+    name = 'fake'
+
+    def __init__(self, settings: Dict[str, Any]) -> None:
+        self.settings = settings
+        self._rng = random.Random(settings['seed'])
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        return True
+
+    def get_model(self, model_name: Optional[str] = None, generation_config: Optional[Dict[str, Any]] = None,
+                  safety_settings: Optional[List[Dict[str, str]]] = None) -> FakeModel:
+        return FakeModel(self, model_name or 'fake')
+
+    def simulate_call(self) -> None:
+        """Sleep for a sampled latency, then raise an injected error if one was drawn."""
+        with self._lock:
+            median = self.settings['latency_ms'] / 1000.0
+            sigma = self.settings['latency_sigma']
+            latency = median * math.exp(self._rng.gauss(0, sigma)) if median > 0 else 0.0
+            failed = self._rng.random() < self.settings['error_rate']
+            rate_limited = self._rng.random() < 0.5
+        if latency:
+            time.sleep(latency)
+        if failed:
+            if rate_limited:
+                raise google_exceptions.TooManyRequests("Injected fake rate limit error")
+            raise google_exceptions.ServiceUnavailable("Injected fake service error")
+
+    def stream_chunks(self, text: str) -> Iterator[str]:
+        size = max(1, self.settings['chunk_chars'])
+        delay = self.settings['chunk_delay_ms'] / 1000.0
+        for start in range(0, len(text), size):
+            if start and delay:
+                time.sleep(delay)
+            yield text[start:start + size]
+
+
+_providers: Dict[Any, LLMProvider] = {}
+_providers_lock = threading.Lock()
+
+
+def get_llm_provider() -> LLMProvider:
+    """Return the process-wide provider selected by LLM_PROVIDER ('gemini' or 'fake')."""
+    config = current_app.config
+    name = config.get('LLM_PROVIDER', 'gemini').lower()
+    if name == 'gemini':
+        key: Any = 'gemini'
+    elif name == 'fake':
+        settings = {
+            'latency_ms': float(config.get('LLM_FAKE_LATENCY_MS', 800)),
+            'latency_sigma': float(config.get('LLM_FAKE_LATENCY_SIGMA', 0.5)),
+            'error_rate': float(config.get('LLM_FAKE_ERROR_RATE', 0.0)),
+            'seed': int(config.get('LLM_FAKE_SEED', 0)),
+            'response_words': int(config.get('LLM_FAKE_RESPONSE_WORDS', 200)),
+            'chunk_chars': int(config.get('LLM_FAKE_CHUNK_CHARS', 40)),
+            'chunk_delay_ms': float(config.get('LLM_FAKE_CHUNK_DELAY_MS', 30))
+        }
+        key = ('fake', tuple(sorted(settings.items())))
+    else:
+        raise ValueError(f"Unknown LLM_PROVIDER: {name}")
+
+    with _providers_lock:
+        if key not in _providers:
+            _providers[key] = GeminiProvider() if name == 'gemini' else FakeProvider(dict(key[1]))
+            logger.info(f"Using {name} LLM provider")
+        return _providers[key]
+
+
+def get_llm_model(model_name: Optional[str] = None, generation_config: Optional[Dict[str, Any]] = None,
+                  safety_settings: Optional[List[Dict[str, str]]] = None) -> Any:
+    """
+    Return a model from the configured provider.
+
+    Args:
+        model_name (Optional[str]): Model name (defaults to GEMINI_MODEL)
+        generation_config (Optional[Dict[str, Any]]): Generation parameters
+        safety_settings (Optional[List[Dict[str, str]]]): Safety settings
+
+    Returns:
+        Any: A model with generate_content and start_chat
+    """
+    return get_llm_provider().get_model(model_name, generation_config=generation_config,
+                                        safety_settings=safety_settings)
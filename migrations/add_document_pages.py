@@ -0,0 +1,102 @@
+from flask import Flask
+import click
+import logging
+from sqlalchemy import text, inspect
+from sqlalchemy.engine import Inspector
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_COLUMNS = {
+    'page_count': 'INTEGER',
+    'has_text': 'BOOLEAN',
+    'image_count': 'INTEGER'
+}
+
+def add_document_pages() -> None:
+    """Add page/text/image count columns to documents and create the document_pages table."""
+    from extensions import db
+    from models import DocumentPage
+
+    try:
+        inspector: Inspector = inspect(db.engine)
+        existing_columns: list[str] = [col['name'] for col in inspector.get_columns('documents')]
+
+        for column, column_type in DOCUMENT_COLUMNS.items():
+            if column in existing_columns:
+                logger.info(f"{column} column already exists")
+                continue
+            db.session.execute(text(f"ALTER TABLE documents ADD COLUMN {column} {column_type}"))
+            logger.info(f"Added {column} column to documents table")
+        db.session.commit()
+
+        # Creates the table and its indexes only if missing
+        DocumentPage.__table__.create(db.engine, checkfirst=True)
+        logger.info("Successfully created document_pages table")
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error adding document pages schema: {str(e)}")
+        raise
+
+def backfill_document_pages(batch_size: int = 50, force: bool = False) -> dict:
+    """
+    Ingest per-page rows for documents uploaded before pages were stored.
+
+    Args:
+        batch_size (int): Documents ingested per batch (one commit per batch)
+        force (bool): Re-ingest documents that already have page rows
+
+    Returns:
+        dict: Counts of 'documents', 'pages' and 'errors'
+    """
+    from extensions import db
+    from models import Document
+
+    counts = {'documents': 0, 'pages': 0, 'errors': 0}
+    last_id = 0
+    while True:
+        query = Document.query.filter(Document.id > last_id)
+        if not force:
+            query = query.filter(Document.page_count.is_(None))
+        batch = query.order_by(Document.id).limit(batch_size).all()
+        if not batch:
+            break
+
+        for document in batch:
+            try:
+                counts['pages'] += document.ingest_pages(commit=False)
+                counts['documents'] += 1
+            except Exception as e:
+                counts['errors'] += 1
+                logger.error(f"Error ingesting pages for document {document.id}: {str(e)}")
+        db.session.commit()
+        last_id = batch[-1].id
+        db.session.expunge_all()
+        logger.info(f"Page backfill: {counts['documents']} documents, {counts['pages']} pages (last id {last_id})")
+
+    return counts
+
+def register_migration_command(app: Flask) -> None:
+    """Register the document pages migration commands."""
+    @app.cli.command('add-document-pages')
+    def add_document_pages_command() -> None:
+        """Add document page columns and the document_pages table."""
+        try:
+            add_document_pages()
+            print("Successfully added document pages schema")
+        except Exception as e:
+            print(f"Error adding document pages schema: {e}")
+            raise
+
+    @app.cli.command('backfill-document-pages')
+    @click.option('--batch-size', default=50, show_default=True, help='Documents ingested per batch.')
+    @click.option('--force', is_flag=True, help='Re-ingest documents that already have page rows.')
+    def backfill_document_pages_command(batch_size: int, force: bool) -> None:
+        """Store per-page text and counts for existing documents."""
+        try:
+            counts = backfill_document_pages(batch_size=batch_size, force=force)
+            print(f"Ingested {counts['pages']} pages from {counts['documents']} documents "
+                  f"({counts['errors']} errors)")
+        except Exception as e:
+            print(f"Error backfilling document pages: {e}")
+            raise
@@ -0,0 +1,73 @@
+from flask import Flask
+import click
+import logging
+import time
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+def backfill_search_index(batch_size: int = 200, user_id: int = None) -> dict:
+    """
+    Index the text of existing documents into the full-text search table.
+
+    Documents are read in id order in batches (keyset pagination), committing after each
+    batch so a long backfill can be interrupted and resumed without holding a write lock.
+
+    Args:
+        batch_size (int): Documents per batch
+        user_id (int): Only backfill this user's documents
+
+    Returns:
+        dict: Counts of 'documents', 'pages' and 'errors'
+    """
+    from extensions import db
+    from models import Document
+    from search_index import ensure_search_index, index_document, FTS_TABLE
+
+    if not ensure_search_index():
+        raise RuntimeError("Full-text search index is not available on this database")
+
+    counts = {'documents': 0, 'pages': 0, 'errors': 0}
+    last_id = 0
+    started = time.perf_counter()
+    while True:
+        query = Document.query.filter(Document.id > last_id)
+        if user_id is not None:
+            query = query.filter(Document.user_id == user_id)
+        batch = query.order_by(Document.id).limit(batch_size).all()
+        if not batch:
+            break
+
+        for document in batch:
+            try:
+                counts['pages'] += index_document(document, commit=False)
+                counts['documents'] += 1
+            except Exception as e:
+                counts['errors'] += 1
+                logger.error(f"Error indexing document {document.id}: {str(e)}")
+        db.session.commit()
+        last_id = batch[-1].id
+        # Release the batch so memory stays flat on large libraries
+        db.session.expunge_all()
+        logger.info(f"Search backfill: {counts['documents']} documents, {counts['pages']} pages indexed "
+                    f"(last id {last_id}, {time.perf_counter() - started:.1f}s)")
+
+    # Merge the FTS segments written by the many small inserts
+    db.session.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')"))
+    db.session.commit()
+    return counts
+
+def register_migration_command(app: Flask) -> None:
+    """Register the search index backfill command."""
+    @app.cli.command('backfill-search-index')
+    @click.option('--batch-size', default=200, show_default=True, help='Documents indexed per batch.')
+    @click.option('--user-id', type=int, default=None, help='Only backfill documents of this user.')
+    def backfill_search_index_command(batch_size: int, user_id: int) -> None:
+        """Index existing documents for full-text search."""
+        try:
+            counts = backfill_search_index(batch_size=batch_size, user_id=user_id)
+            print(f"Indexed {counts['pages']} pages from {counts['documents']} documents "
+                  f"({counts['errors']} errors)")
+        except Exception as e:
+            print(f"Error backfilling search index: {e}")
+            raise
@@ -0,0 +1,57 @@
+from flask import Flask, current_app
+import click
+import logging
+
+logger = logging.getLogger(__name__)
+
+def prune_document_analyses(dry_run: bool = False) -> dict:
+    """
+    Delete stored analyses whose version is no longer current for their kind.
+
+    Only rows of kinds that still have a current version are considered, and within a kind
+    only rows from other prompt versions or models are removed.
+
+    Args:
+        dry_run (bool): Count the rows that would be deleted without deleting them
+
+    Returns:
+        dict: Deleted (or deletable) row count per kind
+    """
+    from extensions import db
+    from models import DocumentAnalysis
+
+    model_name = current_app.config.get('GEMINI_MODEL', 'gemini-1.5-flash')
+    counts = {}
+    try:
+        for kind, prompt_version in DocumentAnalysis.PROMPT_VERSIONS.items():
+            # Image versions may carry extraction-option and batch-mode suffixes, so match on the prefix
+            current_prefix = f"{prompt_version}|{model_name}"
+            stale = DocumentAnalysis.query.filter(
+                DocumentAnalysis.kind == kind,
+                DocumentAnalysis.version != current_prefix,
+                ~DocumentAnalysis.version.startswith(current_prefix + '|')
+            )
+            counts[kind] = stale.count() if dry_run else stale.delete(synchronize_session=False)
+        if not dry_run:
+            db.session.commit()
+        logger.info(f"Pruned stale document analyses: {counts}")
+        return counts
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error pruning document analyses: {str(e)}")
+        raise
+
+def register_migration_command(app: Flask) -> None:
+    """Register the document analysis pruning command."""
+    @app.cli.command('prune-document-analyses')
+    @click.option('--dry-run', is_flag=True, help='Only report how many rows would be deleted.')
+    def prune_document_analyses_command(dry_run: bool) -> None:
+        """Delete stored analyses from old prompt versions or models."""
+        try:
+            counts = prune_document_analyses(dry_run=dry_run)
+            action = "Would delete" if dry_run else "Deleted"
+            for kind, count in counts.items():
+                print(f"{action} {count} stale {kind} analyses")
+        except Exception as e:
+            print(f"Error pruning document analyses: {e}")
+            raise
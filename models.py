@@ -3,17 +3,70 @@ import os
 import shutil
 import uuid
 import hashlib
+import base64
 import bcrypt
 import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional, List, Dict, Union
 from flask import current_app
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-import google.generativeai as genai
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 
 from extensions import db  # Import db from extensions to avoid circular imports
+from image_prep import prepare_inline_image
+from gemini_client import call_gemini
+from llm_providers import get_llm_provider, get_llm_model
+from single_flight import single_flight
+from context_packer import estimate_tokens, make_part, pack_parts, total_tokens
+
+
+def pdf_extraction_options() -> Dict[str, Union[bool, int]]:
+    """Return the configured extraction options for pdf_reader.iter_pdf_pages."""
+    return {
+        'parallel': current_app.config.get('PDF_PARALLEL_EXTRACTION', False),
+        'max_workers': current_app.config.get('PDF_PARALLEL_WORKERS'),
+        'min_parallel_pages': current_app.config.get('PDF_PARALLEL_MIN_PAGES', 100),
+        'dedupe_images': current_app.config.get('PDF_DEDUPE_IMAGES', True),
+        'min_image_size': current_app.config.get('PDF_MIN_IMAGE_SIZE', 0)
+    }
+
+def _as_items(result: Union[Dict, List[Dict]]) -> List[Dict]:
+    """Normalise a task result (one item or a list of items from a batch) to a list."""
+    return result if isinstance(result, list) else [result]
+
+
+def _parse_batch_analyses(response_text: str, count: int) -> Dict[int, str]:
+    """
+    Parse a batched image analysis response into {image number: analysis}.
+
+    Accepts the JSON array on its own or wrapped in a markdown code fence; entries that are
+    malformed or out of range are skipped so the caller can fall back for just those images.
+    """
+    text = (response_text or '').strip()
+    start, end = text.find('['), text.rfind(']')
+    if start == -1 or end <= start:
+        return {}
+    try:
+        entries = json.loads(text[start:end + 1])
+    except ValueError:
+        return {}
+    analyses = {}
+    for entry in entries if isinstance(entries, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        try:
+            number = int(entry.get('image'))
+        except (TypeError, ValueError):
+            continue
+        analysis = entry.get('analysis')
+        if 1 <= number <= count and isinstance(analysis, str) and analysis.strip():
+            analyses[number] = analysis.strip()
+    return analyses
 
 
 class User(db.Model, UserMixin):
@@ -106,25 +159,84 @@ class FolderSummary(db.Model):
 
     REGENERATION_COOLDOWN: int = 1800  # seconds
 
+    # Map step prompt for folders over FOLDER_SUMMARY_TOKEN_BUDGET; bump
+    # DocumentAnalysis.PROMPT_VERSIONS['document_summary'] when it changes
+    DOCUMENT_SUMMARY_PROMPT: str = (
+        'Summarize the medical document "{filename}" for a later folder-wide analysis (within 250 words). '
+        "List diagnoses and conditions, treatments and medications, abnormal or critical values with their "
+        "normal ranges and dates, imaging findings, visit and procedure dates, and recommended follow-up. "
+        "Keep exact values, units and dates; do not add interpretation that is not in the document."
+    )
+    ROLLUP_PROMPT_NOTE: str = (
+        "\n            NOTE: This folder has subfolders. Their summaries are included below and cover the "
+        "documents inside them; combine them with this folder's own documents.\n"
+    )
+    REDUCE_PROMPT_NOTE: str = (
+        "\n            NOTE: This folder is too large to send in full, so each document has been summarized "
+        "separately. The per-document summaries below are your context.\n"
+    )
+
     folder = db.relationship('Folder', backref=db.backref('summary', uselist=False, cascade='all, delete-orphan'))
 
     def __repr__(self) -> str:
         return f'<FolderSummary for folder_id {self.folder_id}>'
 
     @staticmethod
-    def calculate_folder_hash(folder_id: int) -> Optional[str]:
-        """Calculate a hash representing the state of all files in a folder."""
+    def calculate_folder_hash(folder_id: int, _hashes: Optional[Dict[int, Optional[str]]] = None) -> Optional[str]:
+        """
+        Calculate a hash representing the state of all files in a folder.
+
+        A folder with subfolders also hashes its children's hashes, so a change anywhere below
+        a folder changes the hash of every ancestor and marks their roll-up summaries stale.
+
+        Args:
+            folder_id (int): The folder to hash
+            _hashes (Optional[Dict[int, Optional[str]]]): Hashes already computed in this pass,
+                filled in for every folder of the subtree
+        """
+        if _hashes is None:
+            _hashes = {}
         try:
+            # Placeholder first, so a parent_id cycle cannot recurse forever
+            _hashes[folder_id] = None
             documents = Document.query.filter_by(folder_id=folder_id).all()
             documents.sort(key=lambda x: x.filename)
             file_data = [(doc.filename, doc.content_hash, doc.file_size) for doc in documents]
-            file_data_str = json.dumps(file_data)
+            child_ids = [row.id for row in db.session.query(Folder.id).filter_by(parent_id=folder_id).order_by(Folder.id)]
+            if child_ids:
+                children = [
+                    (child_id, _hashes[child_id] if child_id in _hashes
+                     else FolderSummary.calculate_folder_hash(child_id, _hashes))
+                    for child_id in child_ids
+                ]
+                file_data_str = json.dumps({'files': file_data, 'children': children})
+            else:
+                # Unchanged format for leaf folders keeps their stored hashes valid
+                file_data_str = json.dumps(file_data)
             folder_hash = hashlib.sha256(file_data_str.encode()).hexdigest()
+            _hashes[folder_id] = folder_hash
             return folder_hash
         except Exception as e:
             current_app.logger.error(f"Error calculating folder hash: {str(e)}")
             return None
 
+    @staticmethod
+    def folder_subtree(folder_id: int) -> List[int]:
+        """Ids of the folder and all folders below it, children before their parents."""
+        order: List[int] = []
+        seen = set()
+
+        def visit(current_id: int) -> None:
+            if current_id in seen:
+                return
+            seen.add(current_id)
+            for row in db.session.query(Folder.id).filter_by(parent_id=current_id).order_by(Folder.id):
+                visit(row.id)
+            order.append(current_id)
+
+        visit(folder_id)
+        return order
+
     @staticmethod
     def needs_update(folder_id: int, current_hash: Optional[str] = None, force_refresh: bool = False) -> bool:
         """Check if the summary needs to be updated."""
@@ -184,36 +296,80 @@ class FolderSummary(db.Model):
         return False
     
     @staticmethod
-    def generate_summary(folder_id):
+    def generate_summary(folder_id, force_refresh=False):
+        """
+        Generate a summary of the folder contents, coalescing concurrent requests.
+        
+        Callers asking for the same folder in the same state share one generation: threads
+        in this process wait for the first caller's result, and other processes wait on a file
+        lock and then reuse the summary it stored instead of generating it again.
+        
+        Args:
+            folder_id: The ID of the folder to summarize
+            force_refresh: If True, regenerate even if the stored summary matches the folder hash
+        """
+        current_hash = FolderSummary.calculate_folder_hash(folder_id)
+        requested_at = datetime.utcnow()
+        
+        def reuse():
+            # Read on a separate connection: the caller's transaction may predate the other
+            # process's commit, and its pending work must not be rolled back from in here
+            table = FolderSummary.__table__
+            with db.engine.connect() as connection:
+                row = connection.execute(
+                    select(table.c.summary_text, table.c.file_hash, table.c.last_updated)
+                    .where(table.c.folder_id == folder_id)
+                ).first()
+            if not (row and row.summary_text and row.file_hash == current_hash
+                    and row.last_updated and row.last_updated >= requested_at):
+                return None
+            # The caller may hold this folder's row from before; reload it on next access
+            for instance in list(db.session.identity_map.values()):
+                if isinstance(instance, FolderSummary) and instance.folder_id == folder_id \
+                        and instance not in db.session.dirty:
+                    db.session.expire(instance)
+            return row.summary_text
+        
+        return single_flight(f"folder_summary:{folder_id}:{current_hash}",
+                             lambda: FolderSummary._generate_summary(folder_id, force_refresh), reuse=reuse)
+    
+    @staticmethod
+    def _generate_summary(folder_id, force_refresh=False):
         """
-        Generate a summary of the folder contents using Gemini 2.0 Flash.
-        Uploads all files in the folder directly to the Gemini API as context.
+        Generate a summary of the folder contents using Gemini.
+        The summary is composed from per-document digests (see update_document_digests), so
+        only new or changed documents are read again. With FOLDER_SUMMARY_INCREMENTAL off,
+        folders whose files fit FOLDER_SUMMARY_TOKEN_BUDGET are summarized in one request with
+        all files as context.
+        
+        Args:
+            folder_id: The ID of the folder to summarize
+            force_refresh: If True, regenerate even if the stored summary matches the folder hash
         """
         try:
             # Calculate current folder hash
             current_hash = FolderSummary.calculate_folder_hash(folder_id)
             
-            # Check if folder has files
+            # Check if folder has files or subfolders
             documents = Document.query.filter_by(folder_id=folder_id).all()
-            if not documents:
+            child_parts, child_info = FolderSummary._child_summary_parts(folder_id)
+            if not documents and not child_parts:
                 return "This folder is empty."
             
             # Get existing summary
             summary = FolderSummary.query.filter_by(folder_id=folder_id).first()
             
             # If hash hasn't changed and we have a summary, return existing summary
-            if summary and summary.file_hash == current_hash and summary.summary_text:
+            if not force_refresh and summary and summary.file_hash == current_hash and summary.summary_text:
                 current_app.logger.debug(f"Using cached summary for folder {folder_id}")
                 return summary.summary_text
             
-            # Initialize Gemini
-            api_key = current_app.config.get('GEMINI_API_KEY')
-            if not api_key:
+            # Initialize the configured LLM provider
+            if not get_llm_provider().available():
                 current_app.logger.error("GEMINI_API_KEY not found in configuration")
                 return "Unable to generate summary: API key not configured."
             
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel('gemini-1.5-flash')
+            model = get_llm_model()
             
             # Get folder name for context
             folder_obj = Folder.query.get(folder_id)
@@ -279,90 +435,49 @@ class FolderSummary(db.Model):
             IMPORTANT: Prioritize clinically significant findings and abnormal results. If critical values or urgent findings are present, highlight these at the beginning of the summary with ⚠️ URGENT ATTENTION REQUIRED markers.
             """
             
-            # Prepare content parts for the API call - starting with the text prompt
-            parts = [text_prompt]
-            file_info = []
-            
-            # Process each document to add as context
-            for doc in documents:
-                file_path = doc.get_file_path()
-                if not file_path or not file_path.exists():
-                    current_app.logger.warning(f"File not found: {doc.original_filename}")
-                    file_info.append(f"File: {doc.original_filename} (File not found)")
-                    continue
-                
-                file_type = doc.file_type.lower()
-                
-                try:
-                    # For text-based files, read content and add as text
-                    if file_type in ['txt', 'md', 'csv', 'json', 'xml', 'html']:
-                        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                            content = f.read()
-                            # Include file content as text
-                            parts.append(f"File: {doc.original_filename}\n\n{content}")
-                            file_info.append(f"Text file: {doc.original_filename}")
-                    
-                    # For PDFs, extract both text and images using pdf_reader.py
-                    elif file_type == 'pdf':
-                        current_app.logger.info(f"Processing PDF: {doc.original_filename}")
-                        
-                        # Import PDF utilities
-                        from pdf_reader import extract_pdf_content
-                        
-                        # Extract both text and images
-                        pdf_content_result = extract_pdf_content(str(file_path), extract_images=True)
-                        
-                        if not pdf_content_result['success']:
-                            current_app.logger.error(f"Failed to extract PDF content: {pdf_content_result['text_status']}")
-                            file_info.append(f"File: {doc.original_filename} (Could not extract PDF content)")
-                            continue
-                        
-                        # Get text content and add it
-                        text_content = pdf_content_result['text']
-                        if text_content and not text_content.startswith("Error:"):
-                            parts.append(f"PDF Text from {doc.original_filename}:\n\n{text_content}")
-                            file_info.append(f"PDF text from: {doc.original_filename}")
-                        
-                        # Get images and add them (up to 15 per file to avoid context limits)
-                        images = pdf_content_result['images']
-                        if images:
-                            current_app.logger.info(f"Found {len(images)} images in PDF: {doc.original_filename}")
-                            
-                            # Limit to 15 images per file to avoid context limits
-                            image_count = min(len(images), 15)
-                            for i in range(image_count):
-                                img = images[i]
-                                if 'data' in img and img['data']:
-                                    # Add image as context with page information
-                                    image_part = {
-                                        'mime_type': f'image/{img["format"]}',
-                                        'data': img['data']
-                                    }
-                                    parts.append(image_part)
-                                    file_info.append(f"Image {i+1} from page {img['page_num']} of {doc.original_filename}")
-                    
-                    # For images, add them directly
-                    elif file_type in ['jpg', 'jpeg', 'png', 'gif', 'webp']:
-                        with open(file_path, 'rb') as img_file:
-                            import base64
-                            # Read and encode the image data
-                            image_data = base64.b64encode(img_file.read()).decode('utf-8')
-                            
-                            # Add image as context
-                            image_part = {
-                                'mime_type': f'image/{file_type}',
-                                'data': image_data
-                            }
-                            parts.append(image_part)
-                            file_info.append(f"Image file: {doc.original_filename}")
-                    
-                    # For other files, just include metadata
+            # By default the summary is recomposed from stored per-document digests; with incremental
+            # mode off, folders that fit the token budget are sent in one request
+            budget = current_app.config.get('FOLDER_SUMMARY_TOKEN_BUDGET', 120000)
+            used_tokens = estimate_tokens(text_prompt)
+            collected = []
+            if not current_app.config.get('FOLDER_SUMMARY_INCREMENTAL', True):
+                for doc in documents:
+                    doc_parts, doc_info = FolderSummary._document_parts(doc)
+                    collected.append((doc_parts, doc_info))
+                    used_tokens += total_tokens(doc_parts)
+                    if used_tokens > budget:
+                        break
+            
+            if child_parts:
+                text_prompt += FolderSummary.ROLLUP_PROMPT_NOTE
+            
+            if collected and used_tokens + total_tokens(child_parts) <= budget:
+                content_parts = child_parts + [part for doc_parts, _ in collected for part in doc_parts]
+                file_info = child_info + [info for _, doc_info in collected for info in doc_info]
+                packed = pack_parts(content_parts, budget - estimate_tokens(text_prompt))
+                parts = [text_prompt] + packed['contents']
+            else:
+                # Release what was collected; digests are built one document at a time
+                collected = None
+                model_name = current_app.config.get('GEMINI_MODEL', 'gemini-1.5-flash')
+                digests = FolderSummary.update_document_digests(folder_id, documents, model, model_name) if documents else {}
+                if documents:
+                    text_prompt += FolderSummary.REDUCE_PROMPT_NOTE
+                file_info = list(child_info)
+                summary_parts = list(child_parts)
+                for doc in documents:
+                    digest = digests.get(doc.id)
+                    if digest:
+                        file_info.append(f"Summary of: {doc.original_filename}")
+                        summary_parts.append(make_part(f"Summary of {doc.original_filename}:\n\n{digest}",
+                                                       label=doc.original_filename))
                     else:
                         file_info.append(f"File: {doc.original_filename} (Type: {doc.file_type}, Size: {doc.file_size} bytes)")
-                
-                except Exception as e:
-                    current_app.logger.error(f"Error processing file {doc.filename}: {str(e)}")
-                    file_info.append(f"File: {doc.original_filename} (Error: {str(e)})")
+                packed = pack_parts(summary_parts, budget - estimate_tokens(text_prompt))
+                parts = [text_prompt] + packed['contents']
+            
+            for label in packed['omitted']:
+                file_info.append(f"{label} (Omitted: over the context budget)")
             
             # Add file info summary to the prompt
             file_info_text = "Files included in this analysis:\n" + "\n".join([f"- {info}" for info in file_info])
@@ -372,24 +487,18 @@ class FolderSummary(db.Model):
             
             # Generate summary with all content parts
             try:
-                response = model.generate_content(parts)
+                response = call_gemini(model.generate_content, parts)
                 summary_text = response.text
                 
                 # Begin a new transaction (ensure any previous transaction is rolled back)
                 db.session.rollback()
                 
                 try:
-                    # First, get the document's content_hash directly for single-document folders
-                    document = Document.query.filter_by(folder_id=folder_id).first()
-                    if document:
-                        current_hash = document.content_hash
-                        current_app.logger.info(f"Using document content_hash for folder {folder_id}: {current_hash}")
-                    else:
-                        current_app.logger.warning(f"No document found for folder {folder_id}, using calculated hash")
-                        # Fall back to calculated hash if no document is found
-                        current_hash = FolderSummary.calculate_folder_hash(folder_id)
+                    # Store the same folder hash needs_update() compares against, so an
+                    # unchanged folder is not summarized again
+                    current_hash = FolderSummary.calculate_folder_hash(folder_id)
                     
-                    # Use SQLAlchemy's merge operation for proper upsert behavior
+                    # Upsert by folder_id
                     existing_summary = FolderSummary.query.filter_by(folder_id=folder_id).first()
                     
                     if existing_summary:
@@ -410,7 +519,17 @@ class FolderSummary(db.Model):
                         current_app.logger.info(f"Created new summary for folder {folder_id} with hash {current_hash}")
                     
                     # Commit the changes
-                    db.session.commit()
+                    try:
+                        db.session.commit()
+                    except IntegrityError:
+                        # Another process created the row first (unique folder_id): update it instead
+                        db.session.rollback()
+                        existing_summary = FolderSummary.query.filter_by(folder_id=folder_id).first()
+                        existing_summary.summary_text = summary_text
+                        existing_summary.file_hash = current_hash
+                        existing_summary.last_updated = datetime.utcnow()
+                        db.session.commit()
+                        current_app.logger.info(f"Updated concurrently created summary for folder {folder_id}")
                     return summary_text
                     
                 except Exception as db_error:
@@ -429,14 +548,257 @@ class FolderSummary(db.Model):
             current_app.logger.error(f"Error in generate_summary: {str(e)}")
             return "An error occurred while generating the folder summary."
     
+    @staticmethod
+    def _document_parts(doc, max_images=15):
+        """
+        Build the context parts for one document.
+        
+        Text is packed before standalone images, and those before images embedded in PDFs,
+        when the parts do not all fit the budget.
+        
+        Args:
+            doc: The Document to read
+            max_images: Unique images taken from a PDF
+            
+        Returns:
+            tuple: (list of parts from context_packer.make_part, list of file info lines)
+        """
+        parts = []
+        file_info = []
+        file_path = doc.get_file_path()
+        if not file_path or not file_path.exists():
+            current_app.logger.warning(f"File not found: {doc.original_filename}")
+            return parts, [f"File: {doc.original_filename} (File not found)"]
+        
+        file_type = doc.file_type.lower()
+        
+        try:
+            # For text-based files, read content and add as text
+            if file_type in ['txt', 'md', 'csv', 'json', 'xml', 'html']:
+                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                    content = f.read()
+                parts.append(make_part(f"File: {doc.original_filename}\n\n{content}", priority=0,
+                                       label=doc.original_filename))
+                file_info.append(f"Text file: {doc.original_filename}")
+            
+            # For PDFs, stream text and images page by page using pdf_reader.py
+            elif file_type == 'pdf':
+                current_app.logger.info(f"Processing PDF: {doc.original_filename}")
+                
+                from pdf_reader import PDFExtractionError
+                from pdf_cache import iter_cached_pdf_pages
+                
+                # Images are capped per file to avoid context limits; extraction stops pulling
+                # images once the cap is reached
+                page_texts = []
+                pdf_images = []
+                if doc.pages_ingested and not doc.image_count:
+                    pages = doc._iter_stored_pdf_pages()
+                else:
+                    pages = iter_cached_pdf_pages(str(file_path), doc.content_hash, max_images=max_images,
+                                                  **pdf_extraction_options())
+                try:
+                    for page in pages:
+                        if page['text'].strip():
+                            page_texts.append(page['text'])
+                        pdf_images.extend(page['images'])
+                except PDFExtractionError as extract_err:
+                    current_app.logger.error(f"Failed to extract PDF content: {str(extract_err)}")
+                    return [], [f"File: {doc.original_filename} (Could not extract PDF content)"]
+                
+                if page_texts:
+                    parts.append(make_part(f"PDF Text from {doc.original_filename}:\n\n" + "\n\n".join(page_texts),
+                                           priority=0, label=f"PDF text from {doc.original_filename}"))
+                    file_info.append(f"PDF text from: {doc.original_filename}")
+                
+                if pdf_images:
+                    current_app.logger.info(f"Including {len(pdf_images)} unique images from PDF: {doc.original_filename}")
+                    for i, img in enumerate(pdf_images):
+                        # Repeated images are sent once; list every page they appear on
+                        pages_text = ", ".join(str(p) for p in img.get('pages', [img['page_num']]))
+                        label = f"Image {i+1} from page(s) {pages_text} of {doc.original_filename}"
+                        parts.append(make_part(prepare_inline_image(img['bytes'], img['format']), priority=2,
+                                               label=label))
+                        file_info.append(label)
+            
+            # For images, add them directly
+            elif file_type in ['jpg', 'jpeg', 'png', 'gif', 'webp']:
+                with open(file_path, 'rb') as img_file:
+                    # Downscale and re-encode before adding the image as context
+                    parts.append(make_part(prepare_inline_image(img_file.read(), file_type), priority=1,
+                                           label=f"Image file: {doc.original_filename}"))
+                file_info.append(f"Image file: {doc.original_filename}")
+            
+            # For other files, just include metadata
+            else:
+                file_info.append(f"File: {doc.original_filename} (Type: {doc.file_type}, Size: {doc.file_size} bytes)")
+        
+        except Exception as e:
+            current_app.logger.error(f"Error processing file {doc.filename}: {str(e)}")
+            return [], [f"File: {doc.original_filename} (Error: {str(e)})"]
+        
+        return parts, file_info
+    
+    @staticmethod
+    def _summarize_document(model, document_id):
+        """Summarize one document within FOLDER_SUMMARY_DOCUMENT_BUDGET tokens (the map step)."""
+        doc = Document.query.get(document_id)
+        if not doc:
+            return None
+        doc_parts, _ = FolderSummary._document_parts(doc)
+        if not doc_parts:
+            return None
+        prompt = FolderSummary.DOCUMENT_SUMMARY_PROMPT.format(filename=doc.original_filename)
+        budget = current_app.config.get('FOLDER_SUMMARY_DOCUMENT_BUDGET', 30000)
+        packed = pack_parts(doc_parts, budget - estimate_tokens(prompt))
+        response = call_gemini(model.generate_content, [prompt] + packed['contents'])
+        return response.text
+    
+    @staticmethod
+    def _map_document_summaries(documents, model, model_name):
+        """
+        Summarize each document in parallel, reusing stored partial summaries.
+        
+        Partial summaries are stored in DocumentAnalysis under the document's content hash,
+        so unchanged documents are not summarized again when their folder changes (or when
+        the same file appears in another folder).
+        
+        Returns:
+            dict: Document id to partial summary text (None if it could not be summarized)
+        """
+        versions = {'document_summary': DocumentAnalysis.current_version(
+            'document_summary', model_name, pdf_extraction_options())}
+        key = ('document_summary', 0, -1)
+        partials = {}
+        missing = []
+        for doc in documents:
+            stored = DocumentAnalysis.load(doc.content_hash, versions).get(key)
+            if stored:
+                partials[doc.id] = stored
+            else:
+                missing.append(doc)
+        current_app.logger.info(f"Reusing {len(partials)} stored document summaries, generating {len(missing)}")
+        
+        app = current_app._get_current_object()
+        max_workers = max(1, app.config.get('GEMINI_MAX_CONCURRENCY', 4))
+        
+        def run(document_id):
+            with app.app_context():
+                try:
+                    return FolderSummary._summarize_document(model, document_id)
+                except Exception as e:
+                    app.logger.error(f"Error summarizing document {document_id}: {str(e)}")
+                    return None
+        
+        if missing:
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='gemini') as executor:
+                generated = list(executor.map(run, [doc.id for doc in missing]))
+            for doc, text in zip(missing, generated):
+                partials[doc.id] = text
+                if text:
+                    DocumentAnalysis.store(doc.content_hash, versions, [key + (text,)])
+        return partials
+    
+    @staticmethod
+    def _child_summary_parts(folder_id):
+        """
+        Context parts for the stored summaries of a folder's direct subfolders.
+        
+        Roll-up summaries are built from these rather than from the files below, so each
+        level of the tree only reads its own documents.
+        
+        Returns:
+            tuple: (list of parts, list of file info lines)
+        """
+        rows = db.session.query(Folder.name, FolderSummary.summary_text) \
+            .join(FolderSummary, FolderSummary.folder_id == Folder.id) \
+            .filter(Folder.parent_id == folder_id, FolderSummary.summary_text.isnot(None)) \
+            .order_by(Folder.name).all()
+        parts = [make_part(f"Summary of subfolder {name}:\n\n{text}", priority=0, label=f"Subfolder: {name}")
+                 for name, text in rows]
+        return parts, [f"Subfolder summary: {name}" for name, _ in rows]
+    
+    @staticmethod
+    def update_document_digests(folder_id, documents, model, model_name):
+        """
+        Bring the folder's per-document digests up to date.
+        
+        Only documents that are new to the folder, whose content changed, or whose digest was
+        made with another prompt version or model are digested (in parallel, reusing stored
+        summaries of identical files). Digests of documents deleted from or moved out of the
+        folder are dropped.
+        
+        Args:
+            folder_id: The folder being summarized
+            documents: The folder's current documents
+            model: Gemini model for new digests
+            model_name: Name of that model, part of the digest version
+            
+        Returns:
+            dict: Document id to digest text for every document that has one
+        """
+        version = DocumentAnalysis.current_version('document_summary', model_name, pdf_extraction_options())
+        existing = {row.document_id: row for row in FolderDocumentDigest.query.filter_by(folder_id=folder_id)}
+        changed = [
+            doc for doc in documents
+            if doc.id not in existing
+            or existing[doc.id].content_hash != doc.content_hash
+            or existing[doc.id].version != version
+        ]
+        
+        partials = FolderSummary._map_document_summaries(changed, model, model_name) if changed else {}
+        
+        current_ids = {doc.id for doc in documents}
+        dropped = 0
+        for document_id, row in list(existing.items()):
+            if document_id not in current_ids:
+                db.session.delete(row)
+                del existing[document_id]
+                dropped += 1
+        
+        for doc in changed:
+            digest = partials.get(doc.id)
+            row = existing.get(doc.id)
+            if not digest:
+                # A stale digest would describe content the document no longer has
+                if row is not None:
+                    db.session.delete(row)
+                    del existing[doc.id]
+                continue
+            if row is None:
+                row = FolderDocumentDigest(folder_id=folder_id, document_id=doc.id)
+                db.session.add(row)
+                existing[doc.id] = row
+            row.content_hash = doc.content_hash
+            row.version = version
+            row.digest = digest
+            row.updated_at = datetime.utcnow()
+        
+        digests = {document_id: row.digest for document_id, row in existing.items()}
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Error saving document digests for folder {folder_id}: {str(e)}")
+            raise
+        current_app.logger.info(
+            f"Folder {folder_id} digests: {len(changed)} updated, {len(documents) - len(changed)} reused, "
+            f"{dropped} dropped"
+        )
+        return digests
+    
     @staticmethod
     def get_or_generate_summary(folder_id, force_refresh=False):
         """
         Get the existing summary or generate a new one if needed.
         
+        Stale subfolder summaries are regenerated first, deepest folders first, so each level
+        of the tree is generated at most once and parents roll up current child summaries.
+        
         Args:
             folder_id: The ID of the folder to summarize
-            force_refresh: If True, force regeneration of summary
+            force_refresh: If True, force regeneration of summary (subfolders are only
+                regenerated when stale)
             
         Returns:
             str: The summary text
@@ -447,12 +809,17 @@ class FolderSummary(db.Model):
             if not folder:
                 return "Folder not found."
             
-            # Calculate current hash
-            current_hash = FolderSummary.calculate_folder_hash(folder_id)
+            # Calculate current hashes for the whole subtree in one pass
+            hashes = {}
+            current_hash = FolderSummary.calculate_folder_hash(folder_id, hashes)
+            
+            for descendant_id in FolderSummary.folder_subtree(folder_id)[:-1]:
+                if FolderSummary.needs_update(descendant_id, hashes.get(descendant_id)):
+                    FolderSummary.generate_summary(descendant_id)
             
             # Check if we need to update the summary
             if FolderSummary.needs_update(folder_id, current_hash, force_refresh):
-                return FolderSummary.generate_summary(folder_id)
+                return FolderSummary.generate_summary(folder_id, force_refresh)
             
             # Get existing summary
             summary = FolderSummary.query.filter_by(folder_id=folder_id).first()
@@ -467,6 +834,27 @@ class FolderSummary(db.Model):
             current_app.logger.error(f"Error in get_or_generate_summary: {str(e)}")
             return "An error occurred while retrieving the folder summary."
 
+class FolderDocumentDigest(db.Model):
+    """Per-document digest a folder summary is composed from"""
+    __tablename__ = 'folder_document_digests'
+    __table_args__ = (
+        db.UniqueConstraint('folder_id', 'document_id', name='uq_folder_document_digests_document'),
+    )
+
+    id: int = db.Column(db.Integer, primary_key=True)
+    folder_id: int = db.Column(db.Integer, db.ForeignKey('folders.id', ondelete='CASCADE'), nullable=False, index=True)
+    document_id: int = db.Column(db.Integer, db.ForeignKey('documents.id', ondelete='CASCADE'), nullable=False, index=True)
+    content_hash: Optional[str] = db.Column(db.String(64), nullable=True)  # Document.content_hash when digested
+    version: str = db.Column(db.String(100), nullable=False)  # DocumentAnalysis document_summary version
+    digest: str = db.Column(db.Text, nullable=False)
+    updated_at: datetime = db.Column(db.DateTime, default=datetime.utcnow)
+
+    folder = db.relationship('Folder', backref=db.backref('document_digests', lazy='dynamic',
+                                                          cascade='all, delete-orphan'))
+
+    def __repr__(self) -> str:
+        return f'<FolderDocumentDigest folder_id {self.folder_id} document_id {self.document_id}>'
+
 
 class Document(db.Model):
     """Document model for storing uploaded files"""
@@ -483,6 +871,16 @@ class Document(db.Model):
     upload_date = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     description = db.Column(db.Text, nullable=True)  # Optional description for the document
     content_hash = db.Column(db.String(64), index=True)  # SHA-256 hash of file content for duplicate detection
+    # Filled once at upload by ingest_pages(); None means the document has not been ingested yet
+    page_count = db.Column(db.Integer, nullable=True)
+    has_text = db.Column(db.Boolean, nullable=True)
+    image_count = db.Column(db.Integer, nullable=True)
+    
+    pages = db.relationship('DocumentPage', backref='document', lazy='dynamic',
+                            cascade='all, delete-orphan', order_by='DocumentPage.page_num')
+    # Deleting a document drops its digests; the folder summary is recomposed without it
+    digests = db.relationship('FolderDocumentDigest', backref='document', lazy='dynamic',
+                              cascade='all, delete-orphan')
     # Constants for file validation
     MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
     ALLOWED_EXTENSIONS = {'pdf', 'jpg', 'jpeg', 'png', 'gif', 'doc', 'docx', 'xls', 'xlsx'}
@@ -686,6 +1084,9 @@ class Document(db.Model):
             'file_size': self.file_size or 0,
             'upload_date': self.upload_date.strftime('%Y-%m-%d %H:%M:%S') if self.upload_date else 'Unknown',
             'description': self.description or '',
+            'page_count': self.page_count,
+            'has_text': self.has_text,
+            'image_count': self.image_count,
             'url_path': self.get_url_path() or '#',
             'file_exists': self.get_file_path().exists() if self.get_file_path() else False
         }
@@ -880,9 +1281,307 @@ class Document(db.Model):
             current_app.logger.error(f"Error moving file {self.filename}: {str(e)}")
             raise Exception(f"Error moving file: {str(e)}")
     
+    @property
+    def pages_ingested(self):
+        """Whether per-page rows and counts were stored for this document."""
+        return self.page_count is not None
+    
+    def ingest_pages(self, commit=True):
+        """
+        Extract the document once and store per-page text and counts.
+        
+        PDFs get one DocumentPage row per page; image files are stored as a single page
+        without text. Other file types are left un-ingested. Re-running replaces the rows.
+        
+        Args:
+            commit (bool): Whether to commit the session afterwards
+        
+        Returns:
+            int: Number of pages stored
+        """
+        file_path = self.get_file_path()
+        if not file_path or not file_path.exists():
+            current_app.logger.warning(f"Cannot ingest missing file: {self.file_path}")
+            return 0
+        
+        file_type = (self.file_type or '').lower()
+        page_rows = []
+        if file_type == 'pdf':
+            from pdf_cache import iter_cached_pdf_pages
+            # Same options as process_pdf_images, so the extraction cache is warm for later AI calls
+            for page in iter_cached_pdf_pages(str(file_path), self.content_hash, **pdf_extraction_options()):
+                page_text = page['text'] or ''
+                page_rows.append(DocumentPage(
+                    page_num=page['page_num'],
+                    text=page_text,
+                    image_count=len(page['images']) + len(page.get('duplicate_images', [])),
+                    char_count=len(page_text.strip())
+                ))
+        elif file_type in ['jpg', 'jpeg', 'png', 'gif', 'webp']:
+            page_rows.append(DocumentPage(page_num=1, text='', image_count=1, char_count=0))
+        else:
+            return 0
+        
+        self.pages.delete(synchronize_session=False)
+        for page_row in page_rows:
+            page_row.document_id = self.id
+            db.session.add(page_row)
+        self.page_count = len(page_rows)
+        self.has_text = any(page_row.char_count for page_row in page_rows)
+        self.image_count = sum(page_row.image_count for page_row in page_rows)
+        if commit:
+            db.session.commit()
+        current_app.logger.debug(
+            f"Ingested {self.page_count} pages ({self.image_count} images) for {self.original_filename}")
+        return self.page_count
+    
+    def get_pdf_image(self, page_num, image_idx):
+        """
+        Return one embedded image of this PDF from the extraction cache (re-extracting on a miss).
+        
+        Returns:
+            dict: The image as yielded by iter_cached_pdf_pages, or None if it does not exist
+        """
+        file_path = self.get_file_path()
+        if not file_path or not file_path.exists():
+            return None
+        from pdf_cache import get_cached_pdf_image
+        return get_cached_pdf_image(str(file_path), self.content_hash, page_num, image_idx,
+                                    **pdf_extraction_options())
+    
+    def get_page_texts(self):
+        """
+        Return stored (page_num, text) pairs, or None if the document has not been ingested.
+        """
+        if not self.pages_ingested:
+            return None
+        return [(page.page_num, page.text or '') for page in self.pages]
+    
+    def _iter_stored_pdf_pages(self):
+        """Yield page dicts shaped like iter_pdf_pages output from the stored text-only rows."""
+        for page_num, page_text in self.get_page_texts():
+            yield {'page_num': page_num, 'page_count': self.page_count, 'text': page_text, 'images': []}
+    
+    def _run_analysis_tasks(self, tasks):
+        """
+        Run planned Gemini calls on a bounded thread pool (GEMINI_MAX_CONCURRENCY in flight).
+        
+        tasks may be a generator fed by the streaming PDF reader: at most twice the pool size is
+        submitted ahead of the oldest unfinished call, so the images of later pages are not all
+        held in memory. Results come back in task order and a failing call only turns its own
+        item into an error.
+        
+        Returns:
+            list: Result items in task order (batch tasks contribute one item per image)
+        """
+        app = current_app._get_current_object()
+        max_workers = max(1, app.config.get('GEMINI_MAX_CONCURRENCY', 4))
+        
+        def run(page_num, img_idx, func, args):
+            with app.app_context():
+                try:
+                    return func(*args)
+                except Exception as task_err:
+                    app.logger.error(f"Error processing page {page_num}: {str(task_err)}")
+                    item = {
+                        'page_num': page_num,
+                        'analysis': f"Error processing page: {str(task_err)}",
+                        'content_type': 'error',
+                        'error': True
+                    }
+                    if img_idx is not None:
+                        item['image_idx'] = img_idx
+                    return item
+        
+        results = []
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='gemini') as executor:
+            for page_num, img_idx, func, args in tasks:
+                pending.append(executor.submit(run, page_num, img_idx, func, args))
+                while len(pending) >= max_workers * 2:
+                    results.extend(_as_items(pending.popleft().result()))
+            while pending:
+                results.extend(_as_items(pending.popleft().result()))
+        return results
+    
+    def _generate_content(self, model, contents):
+        """Send one Gemini request through the shared deadline/retry/circuit-breaker wrapper."""
+        return call_gemini(model.generate_content, contents)
+    
+    def _analyze_pdf_image(self, model, page_num, img_idx, image, page_text):
+        """Analyze one image from a PDF page, using the page text as context when available."""
+        try:
+            # Create a context-aware prompt that includes text if available
+            if page_text and page_text.strip():
+                text_preview = page_text[:1000] + "..." if len(page_text) > 1000 else page_text
+                prompt = f"""
+                Analyze this medical image from page {page_num} of the PDF document along with the text from the same page. 
+                
+                Text content from page {page_num}:
+                {text_preview}
+                
+                Please provide:
+                1. Description of what the image shows
+                2. Any notable findings or abnormalities visible in the image
+                3. Potential medical significance if applicable
+                4. How the image relates to the text content on the same page (if relevant)
+                
+                Be clear and professional in your analysis, and indicate if the image quality 
+                is too poor to make conclusive observations.
+                """
+            else:
+                # Create prompt for just the image if no text is available
+                prompt = f"""
+                Analyze this medical image from page {page_num} of the PDF document. Please provide:
+                1. Description of what the image shows
+                2. Any notable findings or abnormalities visible in the image
+                3. Potential medical significance if applicable
+                
+                Be clear and professional in your analysis, and indicate if the image quality 
+                is too poor to make conclusive observations.
+                """
+            
+            # Create a multipart message with the prompt and a downscaled image part
+            parts = [prompt, prepare_inline_image(image['bytes'], image['format'])]
+            response = self._generate_content(model, parts)
+            
+            current_app.logger.info(f"Successfully processed image {img_idx+1} from page {page_num}")
+            return self._image_result(page_num, img_idx, image, response.text, page_text)
+            
+        except Exception as img_err:
+            current_app.logger.error(f"Error processing image {img_idx+1} from page {page_num}: {str(img_err)}")
+            return self._image_result(page_num, img_idx, image, f"Error processing image: {str(img_err)}", error=True)
+    
+    @staticmethod
+    def _image_result(page_num, img_idx, image, analysis, page_text=None, error=False):
+        """Build the result item for one analyzed PDF image."""
+        result = {
+            'page_num': page_num,
+            'image_idx': img_idx,
+            'image_data': base64.b64encode(image['bytes']).decode('utf-8'),  # base64 encoded image
+            'analysis': analysis,
+            'format': image['format'],
+            'pages': image.get('pages', [page_num]),  # every page a repeated image appears on
+            'content_type': 'image'
+        }
+        if error:
+            result['error'] = True
+        else:
+            result['has_text_context'] = bool(page_text and page_text.strip())
+        return result
+    
+    def _analyze_pdf_image_batch(self, model, batch):
+        """
+        Analyze several PDF images in one multimodal request.
+        
+        The text of each page involved is sent once rather than once per image, and the model
+        is asked for a JSON array with one analysis per numbered image. Images whose analysis
+        cannot be parsed from the response fall back to single-image calls.
+        
+        Args:
+            model: Gemini model
+            batch (list): (page_num, img_idx, image, page_text) tuples
+        
+        Returns:
+            list: Result items in batch order
+        """
+        if len(batch) == 1:
+            return [self._analyze_pdf_image(model, *batch[0])]
+        
+        page_texts = {}
+        for page_num, _, _, page_text in batch:
+            if page_text and page_text.strip() and page_num not in page_texts:
+                page_texts[page_num] = page_text[:1000] + "..." if len(page_text) > 1000 else page_text
+        
+        prompt = f"""
+        Analyze each of the {len(batch)} numbered medical images below from a PDF document{' along with the text from their pages' if page_texts else ''}.
+        
+        For each image provide:
+        1. Description of what the image shows
+        2. Any notable findings or abnormalities visible in the image
+        3. Potential medical significance if applicable
+        4. How the image relates to the text content on the same page (if relevant)
+        
+        Be clear and professional in your analysis, and indicate if the image quality 
+        is too poor to make conclusive observations.
+        
+        Respond with only a JSON array containing one object per image, in image order:
+        [{{"image": 1, "analysis": "analysis of image 1 (markdown allowed)"}}, {{"image": 2, "analysis": "..."}}]
+        """
+        parts = [prompt]
+        for page_num, page_text in page_texts.items():
+            parts.append(f"Text content from page {page_num}:\n{page_text}")
+        for number, (page_num, img_idx, image, _) in enumerate(batch, 1):
+            parts.append(f"Image {number} (page {page_num}):")
+            parts.append(prepare_inline_image(image['bytes'], image['format']))
+        
+        try:
+            response = self._generate_content(model, parts)
+        except Exception as batch_err:
+            current_app.logger.error(f"Error processing batch of {len(batch)} images: {str(batch_err)}")
+            return [self._image_result(page_num, img_idx, image, f"Error processing image: {str(batch_err)}", error=True)
+                    for page_num, img_idx, image, _ in batch]
+        
+        analyses = _parse_batch_analyses(response.text, len(batch))
+        if len(analyses) < len(batch):
+            current_app.logger.warning(
+                f"Batch response covered {len(analyses)} of {len(batch)} images; "
+                f"falling back to single-image calls for the rest")
+        
+        results = []
+        for number, (page_num, img_idx, image, page_text) in enumerate(batch, 1):
+            if number in analyses:
+                results.append(self._image_result(page_num, img_idx, image, analyses[number], page_text))
+            else:
+                results.append(self._analyze_pdf_image(model, page_num, img_idx, image, page_text))
+        current_app.logger.info(f"Processed batch of {len(batch)} images from pages "
+                                f"{batch[0][0]}-{batch[-1][0]}")
+        return results
+    
+    def _analyze_pdf_text(self, model, page_num, page_text):
+        """Analyze the text of a PDF page that has no images."""
+        try:
+            text_preview = page_text[:3000] + "..." if len(page_text) > 3000 else page_text
+            prompt = f"""
+            Analyze this medical text from page {page_num} of the PDF document. Please provide:
+            1. Summary of the key information presented
+            2. Any medical findings, diagnoses, or treatments mentioned
+            3. Important medical terminology explained in simple terms
+            
+            Text content from page {page_num}:
+            {text_preview}
+            
+            Be clear and professional in your analysis.
+            """
+            response = self._generate_content(model, prompt)
+            
+            current_app.logger.info(f"Successfully processed text from page {page_num}")
+            return self._text_result(page_num, page_text, response.text)
+            
+        except Exception as text_err:
+            current_app.logger.error(f"Error processing text from page {page_num}: {str(text_err)}")
+            return self._text_result(page_num, page_text, f"Error processing text: {str(text_err)}", error=True)
+    
+    @staticmethod
+    def _text_result(page_num, page_text, analysis, error=False):
+        """Build the result item for one analyzed text-only PDF page."""
+        result = {
+            'page_num': page_num,
+            'text_preview': page_text[:100] + "..." if len(page_text) > 100 else page_text,
+            'analysis': analysis,
+            'content_type': 'text'
+        }
+        if error:
+            result['error'] = True
+        return result
+    
     def process_pdf_images(self, from_flask_login=True, extract_text=True):
         """
-        Process PDF content (text and images) using Gemini 2.0 Flash model.
+        Process PDF content (text and images) using Gemini.
+        
+        Concurrent requests for the same file content and mode share one run: threads in this
+        process wait for the first caller's result, and other processes wait on a file lock and
+        then find every analysis already stored, so they make no Gemini calls.
         
         Args:
             from_flask_login (bool): Whether this method is being called from a Flask route with
@@ -895,17 +1594,29 @@ class Document(db.Model):
                 - 'results' (list): List of dictionaries with processed PDF content results by page
                 - 'message' (str): Success or error message
         """
+        # Verify user has access to this document if called from Flask route
+        if from_flask_login:
+            from flask_login import current_user
+            if not current_user or not current_user.is_authenticated or self.user_id != current_user.id:
+                return {
+                    'success': False,
+                    'results': [],
+                    'message': 'Access denied: You do not have permission to process this document'
+                }
+        
+        content_key = self.content_hash or f"document-{self.id}"
+        mode = 'text_and_images' if extract_text else 'images'
+        # The shared result holds only content-derived data; per-document fields (the filename
+        # is PHI) are added for each caller on a copy
+        result = dict(single_flight(f"pdf_analysis:{content_key}:{mode}",
+                                    lambda: self._process_pdf_images(extract_text=extract_text)))
+        if result['success']:
+            result['document_name'] = self.original_filename
+        return result
+    
+    def _process_pdf_images(self, extract_text=True):
+        """Run the PDF analysis for process_pdf_images (same return value, without 'document_name')."""
         try:
-            # Verify user has access to this document if called from Flask route
-            if from_flask_login:
-                from flask_login import current_user
-                if not current_user or not current_user.is_authenticated or self.user_id != current_user.id:
-                    return {
-                        'success': False,
-                        'results': [],
-                        'message': 'Access denied: You do not have permission to process this document'
-                    }
-            
             # Get file path and verify it exists
             file_path = self.get_file_path()
             if not file_path or not file_path.exists():
@@ -924,243 +1635,120 @@ class Document(db.Model):
                     'message': 'File is not a PDF'
                 }
             
-            # Extract both text and images from PDF
-            from pdf_reader import extract_pdf_content, extract_pdf_images, extract_pdf_text
+            # Initialize the configured LLM provider (same configuration as FolderSummary)
+            if not get_llm_provider().available():
+                current_app.logger.error("GEMINI_API_KEY not found in configuration")
+                return {
+                    'success': False,
+                    'results': [],
+                    'message': 'Gemini API key not configured'
+                }
+            
+            model_name = current_app.config.get('GEMINI_MODEL', 'gemini-1.5-flash')
+            model = get_llm_model(model_name)
+            
+            from pdf_reader import PDFExtractionError
+            from pdf_cache import iter_cached_pdf_pages
             
-            # Determine what to extract based on the extract_text parameter
             if extract_text:
                 current_app.logger.info(f"Extracting both text and images from PDF: {self.original_filename}")
-                pdf_content_result = extract_pdf_content(str(file_path), extract_images=True)
-                
-                if not pdf_content_result['success']:
-                    current_app.logger.error(f"Failed to extract PDF content: {pdf_content_result['text_status']}")
-                    return {
-                        'success': False,
-                        'results': [],
-                        'message': f'Failed to extract PDF content: {pdf_content_result["text_status"]}'
-                    }
-                
-                # Extract text and images from the result
-                text_content = pdf_content_result['text']
-                images = pdf_content_result['images']
-                page_count = pdf_content_result['page_count']
-                
-                # Log extraction results
-                current_app.logger.info(f"Extracted {len(images)} images and {page_count} pages of text from PDF")
-                
-                # Check if no images were found but text exists
-                if not images and not text_content.strip():
-                    return {
-                        'success': True,
-                        'results': [],
-                        'message': 'No content found in PDF document'
-                    }
             else:
-                # Extract only images (original behavior)
                 current_app.logger.info(f"Extracting only images from PDF: {self.original_filename}")
-                extraction_result = extract_pdf_images(str(file_path))
-                
-                if not extraction_result['success']:
-                    return {
-                        'success': False,
-                        'results': [],
-                        'message': f'Failed to extract images: {extraction_result["message"]}'
-                    }
-                
-                images = extraction_result['images']
-                text_content = None
-                
-                # Get page count for reference
-                try:
-                    with open(str(file_path), 'rb') as file:
-                        pdf_reader = PyPDF2.PdfReader(file)
-                        page_count = len(pdf_reader.pages)
-                except Exception as e:
-                    current_app.logger.error(f"Error getting page count: {str(e)}")
-                    page_count = 0
-                
-                if not images:
-                    return {
-                        'success': True,
-                        'results': [],
-                        'message': 'No images found in PDF'
-                    }
             
-            # Initialize Gemini (using same configuration as FolderSummary)
-            api_key = current_app.config.get('GEMINI_API_KEY')
-            if not api_key:
-                current_app.logger.error("GEMINI_API_KEY not found in configuration")
+            # Stream the PDF page by page; Gemini calls for a page start while later pages are
+            # still being read, and only a bounded window of pages' images is held in memory
+            counts = {'page_count': 0, 'image_count': 0, 'has_text': False}
+            if self.pages_ingested and not self.image_count:
+                # Text-only PDF: the stored page rows have everything, no need to reopen the file
+                pages = self._iter_stored_pdf_pages()
+            else:
+                pages = iter_cached_pdf_pages(str(file_path), self.content_hash, extract_text=extract_text,
+                                              extract_images=True, **pdf_extraction_options())
+            
+            # Analyses already stored for this file content, prompt version and model are reused;
+            # only missing ones are sent to Gemini
+            # Batching packs up to batch_size images into one request: per page, or across pages
+            batch_size = max(1, current_app.config.get('PDF_ANALYSIS_BATCH_SIZE', 1))
+            batch_across_pages = current_app.config.get('PDF_ANALYSIS_BATCH_ACROSS_PAGES', False)
+            
+            extraction_options = pdf_extraction_options()
+            versions = {
+                'pdf_image': DocumentAnalysis.current_version('pdf_image', model_name, extraction_options,
+                                                              batch_size, batch_across_pages),
+                'pdf_text': DocumentAnalysis.current_version('pdf_text', model_name)
+            }
+            stored = DocumentAnalysis.load(self.content_hash, versions)
+            stored_results = []
+            
+            def batch_task(batch):
+                return (batch[0][0], batch[0][1], self._analyze_pdf_image_batch, (model, batch))
+            
+            def plan_tasks():
+                batch = []
+                for page in pages:
+                    page_num = page['page_num']
+                    page_text = page['text'] if extract_text else None
+                    counts['page_count'] = page['page_count']
+                    counts['image_count'] += len(page['images'])
+                    counts['has_text'] = counts['has_text'] or bool(page_text and page_text.strip())
+                    
+                    if page['images']:
+                        # One analysis per image, with the page text as context. Images are keyed by
+                        # their position on the page (before dedupe and size filtering), which is also
+                        # how the extraction cache and the dashboard image route address them
+                        for image in page['images']:
+                            img_idx = image['image_idx']
+                            analysis = stored.get(('pdf_image', page_num, img_idx))
+                            if analysis is not None:
+                                stored_results.append(self._image_result(page_num, img_idx, image, analysis, page_text))
+                            elif batch_size == 1:
+                                yield (page_num, img_idx, self._analyze_pdf_image, (model, page_num, img_idx, image, page_text))
+                            else:
+                                batch.append((page_num, img_idx, image, page_text))
+                                if len(batch) >= batch_size:
+                                    yield batch_task(batch)
+                                    batch = []
+                        if batch and not batch_across_pages:
+                            yield batch_task(batch)
+                            batch = []
+                    elif page_text and page_text.strip() and extract_text:
+                        # Pages with only text get a text analysis
+                        analysis = stored.get(('pdf_text', page_num, -1))
+                        if analysis is not None:
+                            stored_results.append(self._text_result(page_num, page_text, analysis))
+                        else:
+                            yield (page_num, None, self._analyze_pdf_text, (model, page_num, page_text))
+                if batch:
+                    yield batch_task(batch)
+            
+            try:
+                results = self._run_analysis_tasks(plan_tasks())
+            except PDFExtractionError as extract_err:
+                current_app.logger.error(f"Failed to extract PDF content: {str(extract_err)}")
                 return {
                     'success': False,
                     'results': [],
-                    'message': 'Gemini API key not configured'
+                    'message': f'Failed to extract PDF content: {str(extract_err)}'
                 }
+            page_count, image_count, has_text = counts['page_count'], counts['image_count'], counts['has_text']
             
-            import google.generativeai as genai
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            
-            # Organize content by page for processing
-            page_content = {}
-            
-            # First, organize images by page
-            for img in images:
-                page_num = img['page_num']
-                if page_num not in page_content:
-                    page_content[page_num] = {'images': [], 'text': None}
-                page_content[page_num]['images'].append(img)
-            
-            # If text extraction was enabled, split text by page and add to page_content
-            if extract_text and text_content and not text_content.startswith("Error:"):
-                # Split the text content by page if possible
-                # This is a simplified approach; in reality, you might need a more sophisticated
-                # method to accurately split PDF text by page
-                try:
-                    with open(str(file_path), 'rb') as file:
-                        pdf_reader = PyPDF2.PdfReader(file)
-                        for page_num in range(len(pdf_reader.pages)):
-                            page = pdf_reader.pages[page_num]
-                            page_text = page.extract_text()
-                            
-                            if page_num + 1 not in page_content:
-                                page_content[page_num + 1] = {'images': [], 'text': None}
-                            
-                            page_content[page_num + 1]['text'] = page_text
-                except Exception as e:
-                    current_app.logger.error(f"Error splitting text by page: {str(e)}")
-                    # If splitting fails, use the whole text for all pages with images
-                    for page_num in page_content.keys():
-                        page_content[page_num]['text'] = text_content
+            DocumentAnalysis.store(self.content_hash, versions, [
+                ('pdf_image', item['page_num'], item['image_idx'], item['analysis']) if item['content_type'] == 'image'
+                else ('pdf_text', item['page_num'], -1, item['analysis'])
+                for item in results if not item.get('error') and item['content_type'] in ('image', 'text')
+            ])
+            if stored_results:
+                current_app.logger.info(f"Reused {len(stored_results)} stored analyses for {self.original_filename}")
+            results.extend(stored_results)
             
-            # Process content page by page with Gemini
-            results = []
+            current_app.logger.info(f"Extracted {image_count} images and {page_count} pages of text from PDF")
             
-            for page_num, content in sorted(page_content.items()):
-                try:
-                    page_images = content['images']
-                    page_text = content['text']
-                    
-                    # If this page has images
-                    if page_images:
-                        for img_idx, img_data in enumerate(page_images):
-                            try:
-                                # Create a context-aware prompt that includes text if available
-                                if page_text and page_text.strip():
-                                    text_preview = page_text[:1000] + "..." if len(page_text) > 1000 else page_text
-                                    prompt = f"""
-                                    Analyze this medical image from page {page_num} of the PDF document along with the text from the same page. 
-                                    
-                                    Text content from page {page_num}:
-                                    {text_preview}
-                                    
-                                    Please provide:
-                                    1. Description of what the image shows
-                                    2. Any notable findings or abnormalities visible in the image
-                                    3. Potential medical significance if applicable
-                                    4. How the image relates to the text content on the same page (if relevant)
-                                    
-                                    Be clear and professional in your analysis, and indicate if the image quality 
-                                    is too poor to make conclusive observations.
-                                    """
-                                else:
-                                    # Create prompt for just the image if no text is available
-                                    prompt = f"""
-                                    Analyze this medical image from page {page_num} of the PDF document. Please provide:
-                                    1. Description of what the image shows
-                                    2. Any notable findings or abnormalities visible in the image
-                                    3. Potential medical significance if applicable
-                                    
-                                    Be clear and professional in your analysis, and indicate if the image quality 
-                                    is too poor to make conclusive observations.
-                                    """
-                                
-                                # Create a multipart message with the prompt and image
-                                parts = [prompt]
-                                
-                                # Create a base64 image part for Gemini
-                                image_part = {
-                                    'mime_type': f'image/{img_data["format"]}',
-                                    'data': img_data['data']
-                                }
-                                parts.append(image_part)
-                                
-                                # Process image with Gemini
-                                response = model.generate_content(parts)
-                                
-                                # Add processed result
-                                result_item = {
-                                    'page_num': page_num,
-                                    'image_idx': img_idx,
-                                    'image_data': img_data['data'],  # base64 encoded image
-                                    'analysis': response.text,
-                                    'format': img_data['format'],
-                                    'content_type': 'image',
-                                    'has_text_context': bool(page_text and page_text.strip())
-                                }
-                                
-                                results.append(result_item)
-                                current_app.logger.info(f"Successfully processed image {img_idx+1} from page {page_num}")
-                                
-                            except Exception as img_err:
-                                current_app.logger.error(f"Error processing image {img_idx+1} from page {page_num}: {str(img_err)}")
-                                results.append({
-                                    'page_num': page_num,
-                                    'image_idx': img_idx,
-                                    'image_data': img_data['data'],
-                                    'analysis': f"Error processing image: {str(img_err)}",
-                                    'format': img_data['format'],
-                                    'content_type': 'image',
-                                    'error': True
-                                })
-                    
-                    # If this page has text but no images, or if there are images but we want to process text separately
-                    elif page_text and page_text.strip() and extract_text:
-                        try:
-                            # Create prompt for text-only analysis
-                            text_preview = page_text[:3000] + "..." if len(page_text) > 3000 else page_text
-                            prompt = f"""
-                            Analyze this medical text from page {page_num} of the PDF document. Please provide:
-                            1. Summary of the key information presented
-                            2. Any medical findings, diagnoses, or treatments mentioned
-                            3. Important medical terminology explained in simple terms
-                            
-                            Text content from page {page_num}:
-                            {text_preview}
-                            
-                            Be clear and professional in your analysis.
-                            """
-                            
-                            # Process text with Gemini
-                            response = model.generate_content(prompt)
-                            
-                            # Add processed result
-                            results.append({
-                                'page_num': page_num,
-                                'text_preview': text_preview[:100] + "..." if len(text_preview) > 100 else text_preview,
-                                'analysis': response.text,
-                                'content_type': 'text'
-                            })
-                            
-                            current_app.logger.info(f"Successfully processed text from page {page_num}")
-                            
-                        except Exception as text_err:
-                            current_app.logger.error(f"Error processing text from page {page_num}: {str(text_err)}")
-                            results.append({
-                                'page_num': page_num,
-                                'text_preview': page_text[:100] + "..." if len(page_text) > 100 else page_text,
-                                'analysis': f"Error processing text: {str(text_err)}",
-                                'content_type': 'text',
-                                'error': True
-                            })
-                
-                except Exception as page_err:
-                    current_app.logger.error(f"Error processing page {page_num}: {str(page_err)}")
-                    results.append({
-                        'page_num': page_num,
-                        'analysis': f"Error processing page: {str(page_err)}",
-                        'content_type': 'error',
-                        'error': True
-                    })
+            if not image_count and not has_text:
+                return {
+                    'success': True,
+                    'results': [],
+                    'message': 'No content found in PDF document' if extract_text else 'No images found in PDF'
+                }
             
             # Sort results by page number for consistency
             results.sort(key=lambda x: (x['page_num'], x.get('image_idx', 0)))
@@ -1185,7 +1773,6 @@ class Document(db.Model):
                 'success': True,
                 'results': results,
                 'message': message,
-                'document_name': self.original_filename,
                 'page_count': page_count
             }
             
@@ -1197,6 +1784,186 @@ class Document(db.Model):
                 'message': f'Error processing PDF content: {str(e)}'
             }
 
+class DocumentPage(db.Model):
+    """Per-page text and counts extracted once when a document is uploaded"""
+    __tablename__ = 'document_pages'
+    __table_args__ = (db.UniqueConstraint('document_id', 'page_num', name='uq_document_pages_document_page'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id', ondelete='CASCADE'), nullable=False, index=True)
+    page_num = db.Column(db.Integer, nullable=False)  # 1-based
+    text = db.Column(db.Text, nullable=True)
+    image_count = db.Column(db.Integer, default=0, nullable=False)
+    char_count = db.Column(db.Integer, default=0, nullable=False)  # Length of the stripped page text
+    
+    def __repr__(self):
+        return f'<DocumentPage {self.document_id}:{self.page_num}>'
+
+
+class DocumentAnalysis(db.Model):
+    """
+    Stored Gemini analysis results, keyed by file content rather than by Document row.
+    
+    The version column combines the prompt version of the analysis kind with the model name
+    (and, for images and document summaries, the extraction options that decide which images
+    are read), so bumping a prompt version makes only that kind's old rows unreachable; they
+    are removed by `flask prune-document-analyses`.
+    """
+    __tablename__ = 'document_analyses'
+    __table_args__ = (
+        db.UniqueConstraint('content_hash', 'kind', 'page_num', 'image_idx', 'version',
+                            name='uq_document_analyses_key'),
+    )
+    
+    # Bump a kind's prompt version whenever its prompt changes
+    PROMPT_VERSIONS = {
+        # v2: v1 rows did not record whether they came from the batched prompt
+        # v3: image_idx is the position on the page, v2 rows used the position after filtering
+        'pdf_image': 'v3',
+        'pdf_text': 'v1',
+        'document_summary': 'v1'
+    }
+    
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False, index=True)  # Document.content_hash
+    kind = db.Column(db.String(50), nullable=False)  # pdf_image, pdf_text, document_summary
+    page_num = db.Column(db.Integer, nullable=False, default=0)  # 0 when not page-specific
+    image_idx = db.Column(db.Integer, nullable=False, default=-1)  # -1 when not image-specific
+    version = db.Column(db.String(100), nullable=False)
+    analysis = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    @classmethod
+    def current_version(cls, kind, model_name, extraction_options=None, batch_size=1, batch_across_pages=False):
+        """
+        Version string for new and readable rows of this kind.
+        
+        Image analyses made with the batched multi-image prompt (batch_size > 1, see
+        Document._analyze_pdf_image_batch) carry the batch mode, so changing
+        PDF_ANALYSIS_BATCH_SIZE or PDF_ANALYSIS_BATCH_ACROSS_PAGES never reuses rows produced
+        by the other prompt.
+        """
+        version = f"{cls.PROMPT_VERSIONS[kind]}|{model_name}"
+        if kind in ('pdf_image', 'document_summary') and extraction_options:
+            version += f"|d{int(bool(extraction_options.get('dedupe_images')))}m{extraction_options.get('min_image_size', 0)}"
+        if kind == 'pdf_image' and batch_size > 1:
+            version += f"|b{batch_size}{'x' if batch_across_pages else ''}"
+        return version
+    
+    @classmethod
+    def load(cls, content_hash, versions):
+        """
+        Return stored analyses for a file as {(kind, page_num, image_idx): analysis}.
+        
+        Args:
+            content_hash (str): Document.content_hash
+            versions (dict): Current version per kind; rows with any other version are ignored
+        """
+        if not content_hash:
+            return {}
+        rows = cls.query.filter(cls.content_hash == content_hash, cls.kind.in_(list(versions))).all()
+        return {(row.kind, row.page_num, row.image_idx): row.analysis
+                for row in rows if row.version == versions[row.kind]}
+    
+    @classmethod
+    def store(cls, content_hash, versions, entries):
+        """
+        Store new analyses; entries are (kind, page_num, image_idx, analysis) tuples.
+        
+        A concurrent writer storing the same keys first is not an error: the rows are equal.
+        """
+        if not content_hash or not entries:
+            return
+        try:
+            for kind, page_num, image_idx, analysis in entries:
+                db.session.add(cls(content_hash=content_hash, kind=kind, page_num=page_num,
+                                   image_idx=image_idx, version=versions[kind], analysis=analysis))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            current_app.logger.info(f"Analyses for {content_hash[:12]} were stored concurrently; keeping existing rows")
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Error storing analyses for {content_hash[:12]}: {str(e)}")
+    
+    def __repr__(self):
+        return f'<DocumentAnalysis {self.content_hash[:12]} {self.kind} p{self.page_num} i{self.image_idx}>'
+
+
+class BackgroundJob(db.Model):
+    """Durable job record for work run outside the request (see job_queue.py)"""
+    __tablename__ = 'background_jobs'
+    __table_args__ = (db.Index('ix_background_jobs_claim', 'status', 'run_after'),)
+    
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(50), nullable=False, index=True)  # folder_summary, pdf_analysis
+    status = db.Column(db.String(20), nullable=False, default=STATUS_QUEUED)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True, index=True)
+    payload = db.Column(db.Text, nullable=False, default='{}')  # JSON arguments for the handler
+    dedupe_key = db.Column(db.String(255), nullable=True, index=True)  # job_type plus payload, for active-job reuse
+    result = db.Column(db.Text, nullable=True)  # JSON returned by the handler
+    error = db.Column(db.Text, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(100), nullable=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    @property
+    def payload_data(self):
+        return json.loads(self.payload or '{}')
+    
+    @property
+    def result_data(self):
+        return json.loads(self.result) if self.result else None
+    
+    def to_dict(self):
+        """Return the job status and result for the JSON status endpoint"""
+        return {
+            'id': self.id,
+            'job_type': self.job_type,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'result': self.result_data,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'run_after': self.run_after.isoformat() if self.run_after else None
+        }
+    
+    def __repr__(self):
+        return f'<BackgroundJob {self.id} {self.job_type} {self.status}>'
+
+
+class AIUsage(db.Model):
+    """Per-user daily AI usage by kind (chat, folder_summary, pdf_analysis), written by rate_limiter.UsageRecorder"""
+    __tablename__ = 'ai_usage'
+    __table_args__ = (db.UniqueConstraint('user_id', 'day', 'kind', name='uq_ai_usage_user_day_kind'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    day = db.Column(db.Date, nullable=False, index=True)  # UTC
+    kind = db.Column(db.String(32), nullable=False)
+    requests = db.Column(db.Integer, nullable=False, default=0)
+    input_tokens = db.Column(db.Integer, nullable=False, default=0)  # Estimated at admission
+    rejected = db.Column(db.Integer, nullable=False, default=0)  # Requests refused by the rate limiter
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<AIUsage user {self.user_id} {self.day} {self.kind}: {self.requests} requests>'
+
+
 class VitalMeasurement(db.Model):
     """Model for storing vital sign measurements"""
     __tablename__ = 'vital_measurements'
@@ -1271,6 +2038,20 @@ class Conversation(db.Model):
         return f'<Conversation {self.title}>'
 
 
+class ChatSession(db.Model):
+    """Chat state shared between worker processes: a user's active conversation and a version bumped on every write"""
+    __tablename__ = 'chat_sessions'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, unique=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), nullable=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ChatSession user {self.user_id} v{self.version}>'
+
+
 class Message(db.Model):
     """Model for storing individual chat messages"""
     __tablename__ = 'messages'
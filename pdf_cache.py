@@ -0,0 +1,432 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import uuid
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Dict, Iterator, List, Any
+from flask import current_app
+
+from pdf_reader import iter_pdf_pages
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Bump when the manifest layout changes; older entries are treated as corrupt and dropped
+CACHE_FORMAT_VERSION = 2
+
+
+class PDFExtractionCache:
+    """
+    Persistent cache of PDF extraction artifacts keyed by the document's SHA-256 content hash.
+
+    Each entry is a directory holding a manifest.json (per-page text, page count and image
+    metadata) and the extracted image files. Documents are immutable once uploaded, so an
+    entry never needs to be refreshed; entries are evicted least-recently-used once the
+    cache grows past max_bytes.
+
+    Eviction scans every entry, so stores only trigger it when the bytes stored since the last
+    scan may have pushed the cache over max_bytes, or EVICT_INTERVAL seconds after the last
+    scan (other processes may share the directory). A scan trims to EVICT_LOW_WATER of the
+    limit and never touches entries still being written under tmp/, except ones older than
+    STALE_TMP_SECONDS (left by a crashed writer).
+    """
+    MANIFEST = 'manifest.json'
+    EVICT_INTERVAL = 300.0
+    EVICT_LOW_WATER = 0.9
+    STALE_TMP_SECONDS = 3600.0
+
+    def __init__(self, root_dir: str, max_bytes: int) -> None:
+        self.root = Path(root_dir)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'corrupt': 0}
+        self._evict_lock = threading.Lock()
+        self._cache_bytes: Optional[int] = None  # estimate since the last scan; None until the first
+        self._last_evict = 0.0
+        (self.root / 'tmp').mkdir(parents=True, exist_ok=True)
+
+    def _entry_dir(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def _count(self, counter: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[counter] += amount
+
+    def _discard(self, entry_dir: Path) -> None:
+        shutil.rmtree(entry_dir, ignore_errors=True)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a cache entry.
+
+        Returns:
+            Optional[Dict[str, Any]]: The entry manifest, or None on a miss. Entries whose
+            manifest cannot be parsed or whose image files are missing or truncated are
+            removed and reported as a miss.
+        """
+        entry_dir = self._entry_dir(key)
+        manifest_path = entry_dir / self.MANIFEST
+        if not manifest_path.exists():
+            self._count('misses')
+            return None
+
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('version') != CACHE_FORMAT_VERSION or manifest.get('key') != key:
+                raise ValueError("manifest version or key mismatch")
+            if len(manifest['pages']) != manifest['page_count']:
+                raise ValueError("page count mismatch")
+            for page in manifest['pages']:
+                for image in page['images']:
+                    if (entry_dir / image['file']).stat().st_size != image['size']:
+                        raise ValueError(f"image {image['file']} is truncated")
+        except Exception as e:
+            logger.warning(f"Discarding corrupt PDF cache entry {key}: {str(e)}")
+            self._discard(entry_dir)
+            self._count('corrupt')
+            self._count('misses')
+            return None
+
+        # Touch the manifest so eviction sees this entry as recently used
+        try:
+            os.utime(manifest_path)
+        except OSError:
+            pass
+        self._count('hits')
+        return manifest
+
+    def iter_pages(self, key: str, manifest: Dict[str, Any], extract_text: bool = True,
+                   extract_images: bool = True, max_images: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """Yield cached pages in the pdf_reader.iter_pdf_pages shape, reading image files lazily."""
+        entry_dir = self._entry_dir(key)
+        images_yielded = 0
+        for page in manifest['pages']:
+            images = []
+            if extract_images:
+                for image in page['images']:
+                    if max_images is not None and images_yielded >= max_images:
+                        break
+                    with open(entry_dir / image['file'], 'rb') as f:
+                        image_bytes = f.read()
+                    images.append(dict({k: v for k, v in image.items() if k not in ('file', 'size')},
+                                       bytes=image_bytes))
+                    images_yielded += 1
+            yield {
+                'page_num': page['page_num'],
+                'page_count': manifest['page_count'],
+                'text': page['text'] if extract_text else "",
+                'images': images,
+                'duplicate_images': page['duplicate_images'] if extract_images else [],
+                'width': page['width'],
+                'height': page['height']
+            }
+
+    def writer(self, key: str) -> "_CacheEntryWriter":
+        """Start writing a new entry; pages are spooled to disk as they are added."""
+        return _CacheEntryWriter(self, key)
+
+    def _commit(self, key: str, tmp_dir: Path) -> None:
+        entry_dir = self._entry_dir(key)
+        entry_dir.parent.mkdir(parents=True, exist_ok=True)
+        size = sum(f.stat().st_size for f in tmp_dir.iterdir())
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Another worker stored the same document first; keep theirs
+            self._discard(tmp_dir)
+            return
+        self._count('stores')
+        with self._lock:
+            if self._cache_bytes is not None:
+                self._cache_bytes += size
+            due = (self._cache_bytes is None or self._cache_bytes > self.max_bytes
+                   or time.monotonic() - self._last_evict >= self.EVICT_INTERVAL)
+        if due:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        Remove least-recently-used entries until the cache fits in max_bytes (down to
+        EVICT_LOW_WATER of it). A scan already running in another thread is not repeated.
+
+        Returns:
+            int: Number of entries evicted
+        """
+        if not self._evict_lock.acquire(blocking=False):
+            return 0
+        try:
+            entries = []
+            total = 0
+            for manifest_path in self.root.glob(f'*/*/{self.MANIFEST}'):
+                entry_dir = manifest_path.parent
+                if entry_dir.parent.name == 'tmp':
+                    continue
+                try:
+                    size = sum(f.stat().st_size for f in entry_dir.iterdir())
+                    entries.append((manifest_path.stat().st_mtime, size, entry_dir))
+                    total += size
+                except OSError:
+                    continue
+            self._discard_stale_tmp()
+
+            evicted = 0
+            if total > self.max_bytes:
+                target = self.max_bytes * self.EVICT_LOW_WATER
+                for _, size, entry_dir in sorted(entries, key=lambda entry: entry[0]):
+                    if total <= target:
+                        break
+                    self._discard(entry_dir)
+                    total -= size
+                    evicted += 1
+
+            with self._lock:
+                self._cache_bytes = total
+                self._last_evict = time.monotonic()
+            if evicted:
+                self._count('evictions', evicted)
+                logger.info(f"Evicted {evicted} PDF cache entries, cache size now {total} bytes")
+            return evicted
+        finally:
+            self._evict_lock.release()
+
+    def _discard_stale_tmp(self) -> None:
+        """Remove temporary entries abandoned by writers that crashed mid-extraction."""
+        cutoff = time.time() - self.STALE_TMP_SECONDS
+        for tmp_dir in (self.root / 'tmp').iterdir():
+            try:
+                if tmp_dir.stat().st_mtime < cutoff:
+                    self._discard(tmp_dir)
+            except OSError:
+                continue
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit, miss, store, eviction and corrupt-entry counters for this process."""
+        with self._lock:
+            stats = dict(self._counters)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        stats['max_bytes'] = self.max_bytes
+        return stats
+
+
+class _CacheEntryWriter:
+    """Spools extracted pages of one document into a temporary entry directory."""
+
+    def __init__(self, cache: PDFExtractionCache, key: str) -> None:
+        self.cache = cache
+        self.key = key
+        self.tmp_dir = cache.root / 'tmp' / uuid.uuid4().hex
+        self.tmp_dir.mkdir(parents=True)
+        self.pages: List[Dict[str, Any]] = []
+
+    def add_page(self, page: Dict[str, Any]) -> None:
+        images = []
+        for image in page['images']:
+            filename = f"p{image['page_num']}_{image['image_idx']}.{image['format']}"
+            with open(self.tmp_dir / filename, 'wb') as f:
+                f.write(image['bytes'])
+            # Shallow copy: the 'pages' list stays shared with the extractor, so pages on
+            # which a deduplicated image repeats later are still recorded at commit time
+            meta = {k: v for k, v in image.items() if k != 'bytes'}
+            meta.update(file=filename, size=len(image['bytes']))
+            images.append(meta)
+        self.pages.append({
+            'page_num': page['page_num'],
+            'text': page['text'],
+            'images': images,
+            'duplicate_images': page.get('duplicate_images', []),
+            'width': page['width'],
+            'height': page['height']
+        })
+
+    def commit(self) -> None:
+        manifest = {
+            'version': CACHE_FORMAT_VERSION,
+            'key': self.key,
+            'page_count': len(self.pages),
+            'pages': self.pages
+        }
+        with open(self.tmp_dir / PDFExtractionCache.MANIFEST, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        self.cache._commit(self.key, self.tmp_dir)
+
+    def abort(self) -> None:
+        self.cache._discard(self.tmp_dir)
+
+
+def _cache_key(content_hash: str, extract_options: Dict[str, Any]) -> str:
+    """Cache key for a document; image filtering options change the stored images, so they are part of it."""
+    dedupe = bool(extract_options.get('dedupe_images'))
+    min_size = int(extract_options.get('min_image_size') or 0)
+    if not dedupe and not min_size:
+        return content_hash
+    return f"{content_hash}-d{int(dedupe)}m{min_size}"
+
+
+_caches: Dict[str, PDFExtractionCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_pdf_cache() -> Optional[PDFExtractionCache]:
+    """Return the process-wide extraction cache for the current app, or None if disabled."""
+    if not current_app.config.get('PDF_CACHE_ENABLED', True):
+        return None
+    root_dir = current_app.config.get('PDF_CACHE_DIR') or os.path.join(current_app.instance_path, 'pdf_cache')
+    with _caches_lock:
+        if root_dir not in _caches:
+            _caches[root_dir] = PDFExtractionCache(
+                root_dir, current_app.config.get('PDF_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+            )
+        return _caches[root_dir]
+
+
+def iter_cached_pdf_pages(pdf_path: str, content_hash: Optional[str], extract_text: bool = True,
+                          extract_images: bool = True, max_images: Optional[int] = None,
+                          **extract_options: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Cache-aware drop-in for pdf_reader.iter_pdf_pages.
+
+    On a hit the pages are served from the cache without opening the PDF. On a miss the
+    full document is extracted once, spooled into the cache page by page and yielded to
+    the caller with the requested text/image filtering applied. If the caller stops early
+    the partial entry is discarded.
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        content_hash (Optional[str]): SHA-256 of the file; caching is skipped when None
+        extract_text (bool): Whether to return page text
+        extract_images (bool): Whether to return embedded images
+        max_images (Optional[int]): Stop returning images once this many have been yielded
+        **extract_options: Passed through to iter_pdf_pages (parallel extraction options)
+
+    Raises:
+        PDFExtractionError: If the file cannot be read on a cache miss
+    """
+    cache = get_pdf_cache() if content_hash else None
+    if cache is None:
+        yield from iter_pdf_pages(pdf_path, extract_text=extract_text, extract_images=extract_images,
+                                  max_images=max_images, **extract_options)
+        return
+
+    key = _cache_key(content_hash, extract_options)
+    manifest = cache.get(key)
+    if manifest is not None:
+        yield from cache.iter_pages(key, manifest, extract_text=extract_text,
+                                    extract_images=extract_images, max_images=max_images)
+        return
+
+    yield from _iter_and_store(cache, pdf_path, key, extract_text, extract_images, max_images, extract_options)
+
+
+def get_cached_pdf_image(pdf_path: str, content_hash: Optional[str], page_num: int, image_idx: int,
+                         **extract_options: Any) -> Optional[Dict[str, Any]]:
+    """
+    Return one extracted image, shaped like the images yielded by iter_cached_pdf_pages.
+
+    On a cache hit only that image's file is read. On a miss the whole document is extracted
+    (and stored, so later lookups hit) while the requested image is picked out.
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        content_hash (Optional[str]): SHA-256 of the file; caching is skipped when None
+        page_num (int): One-based page number
+        image_idx (int): Position of the image on its page
+        **extract_options: The image filtering options the image was extracted with
+
+    Returns:
+        Optional[Dict[str, Any]]: The image, or None if the page has no such image
+
+    Raises:
+        PDFExtractionError: If the file cannot be read on a cache miss
+    """
+    cache = get_pdf_cache() if content_hash else None
+    if cache is not None:
+        key = _cache_key(content_hash, extract_options)
+        manifest = cache.get(key)
+        if manifest is not None:
+            if not 1 <= page_num <= len(manifest['pages']):
+                return None
+            for meta in manifest['pages'][page_num - 1]['images']:
+                if meta['image_idx'] == image_idx:
+                    with open(cache._entry_dir(key) / meta['file'], 'rb') as f:
+                        image_bytes = f.read()
+                    image = {k: v for k, v in meta.items() if k not in ('file', 'size')}
+                    image['bytes'] = image_bytes
+                    return image
+            return None
+
+    found = None
+    # Read to the end: stopping early would discard the cache entry being spooled
+    for page in iter_cached_pdf_pages(pdf_path, content_hash, extract_text=False, **extract_options):
+        if page['page_num'] == page_num:
+            found = next((image for image in page['images'] if image['image_idx'] == image_idx), None)
+    return found
+
+
+def iter_cached_pdf_bytes(pdf_bytes: bytes, extract_text: bool = True, extract_images: bool = True,
+                          max_images: Optional[int] = None, **extract_options: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Variant of iter_cached_pdf_pages for in-memory PDFs (e.g. chat attachments).
+
+    The content hash is computed from the bytes; the PDF is only spooled to a temporary
+    file when it has to be extracted.
+    """
+    key = _cache_key(hashlib.sha256(pdf_bytes).hexdigest(), extract_options)
+    cache = get_pdf_cache()
+    manifest = cache.get(key) if cache is not None else None
+    if manifest is not None:
+        yield from cache.iter_pages(key, manifest, extract_text=extract_text,
+                                    extract_images=extract_images, max_images=max_images)
+        return
+
+    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp_file:
+        tmp_file.write(pdf_bytes)
+    try:
+        if cache is None:
+            yield from iter_pdf_pages(tmp_file.name, extract_text=extract_text, extract_images=extract_images,
+                                      max_images=max_images, **extract_options)
+        else:
+            yield from _iter_and_store(cache, tmp_file.name, key, extract_text, extract_images,
+                                       max_images, extract_options)
+    finally:
+        os.remove(tmp_file.name)
+
+
+def _iter_and_store(cache: PDFExtractionCache, pdf_path: str, key: str, extract_text: bool,
+                    extract_images: bool, max_images: Optional[int],
+                    extract_options: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Cache-miss path: extract the full document once, spool it into the cache and yield filtered pages."""
+    try:
+        writer: Optional[_CacheEntryWriter] = cache.writer(key)
+    except OSError as e:
+        logger.error(f"Could not create PDF cache entry {key}: {str(e)}")
+        writer = None
+    images_yielded = 0
+    try:
+        for page in iter_pdf_pages(pdf_path, **extract_options):
+            if writer is not None:
+                try:
+                    writer.add_page(page)
+                except OSError as e:
+                    # A full or unwritable cache must not break extraction itself
+                    logger.error(f"Could not write PDF cache entry {key}: {str(e)}")
+                    writer.abort()
+                    writer = None
+            images = []
+            if extract_images:
+                remaining = len(page['images']) if max_images is None else max(0, max_images - images_yielded)
+                images = page['images'][:remaining]
+                images_yielded += len(images)
+            yield dict(page, text=page['text'] if extract_text else "", images=images)
+        if writer is not None:
+            writer.commit()
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
@@ -1,144 +1,382 @@
 import os
 import io
+import math
 import uuid
+import hashlib
 import logging
 import base64
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Optional, Dict, List, Union, Any
+from typing import Optional, Callable, Dict, Iterator, List, Tuple, Union, Any
 from PIL import Image
 import fitz  # PyMuPDF
-import PyPDF2
 
 # Setup logging
 logger = logging.getLogger(__name__)
 
-def extract_pdf_images(pdf_path: str, output_dir: Optional[str] = None) -> Dict[str, Union[bool, List[Dict[str, Any]], str]]:
+# Parallel extraction defaults (see iter_pdf_pages)
+PARALLEL_MIN_PAGES = 100
+PARALLEL_MIN_CHUNK_PAGES = 8
+
+NO_TEXT_WARNING = "Warning: No text could be extracted from the PDF. The PDF might be scanned images without OCR or have content restrictions."
+
+class PDFExtractionError(Exception):
+    """Raised by iter_pdf_pages when the document cannot be opened or read."""
+    pass
+
+def _load_image(doc: "fitz.Document", xref: int, img_idx: int, page_num: int) -> Optional[Dict[str, Any]]:
     """
-    Extracts images from a PDF file using PyMuPDF.
+    Extracts one embedded image from an already opened document.
     
     Args:
-        pdf_path (str): Path to the PDF file
-        output_dir (Optional[str]): Directory to save extracted images. 
-                                    If None, images are not saved to disk.
+        doc (fitz.Document): The open PyMuPDF document
+        xref (int): Cross-reference number of the image
+        img_idx (int): Position of the image on its page
+        page_num (int): Zero-based page index
         
     Returns:
-        Dict[str, Union[bool, List[Dict[str, Any]], str]]: Dictionary containing:
-            - 'success' (bool): Whether the extraction was successful
-            - 'images' (list): List of image data dictionaries with:
-                - 'data' (bytes/str): Image data as bytes or base64 string
-                - 'format' (str): Image format (e.g., 'jpeg', 'png')
-                - 'page_num' (int): Page number where image was found
-                - 'path' (str): Path where image was saved (if output_dir provided)
-            - 'message' (str): Success or error message
+        Optional[Dict[str, Any]]: Raw image dictionary (see iter_pdf_pages), or None on error
     """
     try:
-        if not os.path.exists(pdf_path):
-            return {'success': False, 'images': [], 'message': f"Error: File not found at {pdf_path}"}
-            
-        if output_dir:
-            Path(output_dir).mkdir(parents=True, exist_ok=True)
+        base_image = doc.extract_image(xref)
+        return {
+            'bytes': base_image["image"],
+            'format': base_image["ext"],
+            'width': base_image.get("width", 0),
+            'height': base_image.get("height", 0),
+            'xref': xref,
+            'image_idx': img_idx,
+            'page_num': page_num + 1
+        }
+    except Exception as img_err:
+        logger.error(f"Error extracting image {img_idx} from page {page_num+1}: {str(img_err)}")
+        return None
+
+class _ImageFilter:
+    """
+    Per-document image filter applied while pages are extracted.
+    
+    Repeated images (hospital logos, letterheads) are collapsed first by PyMuPDF xref,
+    which avoids decoding the repeat at all, and then by a SHA-256 of the image bytes.
+    The first occurrence is kept and records every page it appears on in 'pages'.
+    Images smaller than min_size pixels on either side are dropped, and at most
+    max_images unique images are kept.
+    """
+    
+    def __init__(self, dedupe: bool = False, min_size: int = 0, max_images: Optional[int] = None) -> None:
+        self.dedupe = dedupe
+        self.min_size = min_size
+        self.max_images = max_images
+        self.count = 0
+        self._by_xref: Dict[int, Optional[Dict[str, Any]]] = {}
+        self._by_hash: Dict[str, Dict[str, Any]] = {}
+    
+    @property
+    def full(self) -> bool:
+        return self.max_images is not None and self.count >= self.max_images
+    
+    def process(self, xref: int, page_num: int, load: Callable[[], Optional[Dict[str, Any]]]) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        Classify one image occurrence.
+        
+        Args:
+            xref (int): Cross-reference number of the occurrence
+            page_num (int): One-based page number of the occurrence
+            load (Callable): Returns the raw image dictionary; only called when needed
             
-        images = []
-        doc = fitz.open(pdf_path)
+        Returns:
+            Tuple[Optional[str], Optional[Dict[str, Any]]]: ('image', image) for a new unique
+            image, ('duplicate', reference) for a repeat, or (None, None) if filtered out
+        """
+        if self.dedupe and xref in self._by_xref:
+            return self._duplicate(self._by_xref[xref], xref, page_num)
+        if self.full:
+            return None, None
         
-        if len(doc) == 0:
-            return {'success': False, 'images': [], 'message': "Error: PDF has no pages"}
+        image = load()
+        if image is None:
+            return None, None
+        if self.min_size and min(image['width'], image['height']) < self.min_size:
+            if self.dedupe:
+                self._by_xref[xref] = None
+            return None, None
         
-        for page_num, page in enumerate(doc):
-            image_list = page.get_images(full=True)
-            if not image_list:
-                continue
-                
-            for img_idx, img_info in enumerate(image_list):
-                try:
-                    xref = img_info[0]
-                    base_image = doc.extract_image(xref)
-                    image_bytes = base_image["image"]
-                    image_format = base_image["ext"]
-                    
-                    image_path = None
-                    if output_dir:
-                        image_filename = f"page{page_num+1}_img{img_idx+1}_{uuid.uuid4().hex}.{image_format}"
-                        image_path = os.path.join(output_dir, image_filename)
-                        with open(image_path, "wb") as f:
-                            f.write(image_bytes)
-                    
-                    images.append({
-                        'data': base64.b64encode(image_bytes).decode('utf-8') if not output_dir else None,
-                        'format': image_format,
-                        'page_num': page_num + 1,
-                        'path': image_path
-                    })
-                    
-                except Exception as img_err:
-                    logger.error(f"Error extracting image {img_idx} from page {page_num+1}: {str(img_err)}")
-                    continue
-        
-        if not images:
-            return {'success': True, 'images': [], 'message': "No images found in the PDF document."}
+        if self.dedupe:
+            digest = image.get('content_hash') or hashlib.sha256(image['bytes']).hexdigest()
+            original = self._by_hash.get(digest)
+            if original is not None:
+                self._by_xref[xref] = original
+                return self._duplicate(original, xref, page_num)
+            image['content_hash'] = digest
+            self._by_xref[xref] = image
+            self._by_hash[digest] = image
+        # A worker's image arrives with its range's pages; they are re-added as its repeats are
+        # replayed through process_duplicate, which also applies the cap as a serial run would
+        image['pages'] = [page_num]
+        self.count += 1
+        return 'image', image
+    
+    def process_duplicate(self, ref: Dict[str, Any]) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        Classify a repeat already collapsed by a parallel worker.
+        
+        The worker matched it by content hash to an image in its own page range, possibly under
+        an xref this filter has never seen, so it is matched here by 'content_hash' as well.
+        
+        Args:
+            ref (Dict[str, Any]): A worker's 'duplicate_images' entry
             
-        return {'success': True, 'images': images, 'message': f"Successfully extracted {len(images)} images from PDF."}
+        Returns:
+            Tuple[Optional[str], Optional[Dict[str, Any]]]: As process()
+        """
+        xref = ref['xref']
+        if xref in self._by_xref:
+            return self._duplicate(self._by_xref[xref], xref, ref['page_num'])
+        if self.full:
+            return None, None
+        original = self._by_hash.get(ref['content_hash'])
+        if original is None:
+            # Repeat of an image that was filtered out
+            return None, None
+        self._by_xref[xref] = original
+        return self._duplicate(original, xref, ref['page_num'])
+    
+    def _duplicate(self, original: Optional[Dict[str, Any]], xref: int, page_num: int) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        if original is None:
+            # Repeat of an image that was filtered out
+            return None, None
+        if page_num not in original['pages']:
+            original['pages'].append(page_num)
+        return 'duplicate', {
+            'xref': xref,
+            'content_hash': original['content_hash'],
+            'page_num': page_num,
+            'first_page': original['page_num']
+        }
+
+def _filter_page_images(page: "fitz.Page", page_num: int, image_filter: _ImageFilter,
+                        load: Callable[[int, int], Optional[Dict[str, Any]]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Runs every image occurrence on a page through the filter, returning (images, duplicates)."""
+    images, duplicates = [], []
+    for img_idx, img_info in enumerate(page.get_images(full=True)):
+        if image_filter.full and not image_filter.dedupe:
+            break
+        xref = img_info[0]
+        kind, item = image_filter.process(xref, page_num + 1, lambda: load(xref, img_idx))
+        if kind == 'image':
+            images.append(item)
+        elif kind == 'duplicate':
+            duplicates.append(item)
+    return images, duplicates
+
+def _extract_page_range(pdf_path: str, start: int, stop: int, extract_text: bool, extract_images: bool,
+                        dedupe_images: bool, min_image_size: int) -> List[Dict[str, Any]]:
+    """
+    Process-pool worker: opens the PDF independently by path and extracts pages [start, stop).
+    Repeats within the range are collapsed here; the parent collapses repeats across ranges.
+    
+    Returns:
+        List[Dict[str, Any]]: Page dictionaries in the iter_pdf_pages shape
+    """
+    pages = []
+    image_filter = _ImageFilter(dedupe_images, min_image_size)
+    with fitz.open(pdf_path) as doc:
+        page_count = len(doc)
+        for page_num in range(start, stop):
+            page = doc[page_num]
+            images, duplicates = [], []
+            if extract_images:
+                images, duplicates = _filter_page_images(
+                    page, page_num, image_filter, lambda xref, img_idx: _load_image(doc, xref, img_idx, page_num)
+                )
+            pages.append({
+                'page_num': page_num + 1,
+                'page_count': page_count,
+                'text': page.get_text() if extract_text else "",
+                'images': images,
+                'duplicate_images': duplicates,
+                'width': page.rect.width,
+                'height': page.rect.height
+            })
+    return pages
+
+def _iter_pages_parallel(pdf_path: str, page_count: int, extract_text: bool, extract_images: bool,
+                         image_filter: _ImageFilter, max_workers: int) -> Iterator[Dict[str, Any]]:
+    """
+    Splits the document into page ranges, extracts them on a process pool and yields
+    the pages back in page order. At most two ranges per worker are in flight at once
+    so memory stays bounded for very large documents.
+    """
+    chunk_size = max(PARALLEL_MIN_CHUNK_PAGES, math.ceil(page_count / (max_workers * 4)))
+    ranges = deque((start, min(start + chunk_size, page_count)) for start in range(0, page_count, chunk_size))
+    executor = ProcessPoolExecutor(max_workers=max_workers)
+    pending = deque()
+    try:
+        while ranges or pending:
+            while ranges and len(pending) < max_workers * 2:
+                start, stop = ranges.popleft()
+                pending.append(executor.submit(_extract_page_range, pdf_path, start, stop, extract_text,
+                                               extract_images, image_filter.dedupe, image_filter.min_size))
             
-    except fitz.FileDataError:
-        return {'success': False, 'images': [], 'message': "Error: The PDF file is corrupted or invalid"}
-    except PermissionError:
-        return {'success': False, 'images': [], 'message': "Error: Permission denied when trying to access the file"}
-    except Exception as e:
-        logger.error(f"Unexpected error extracting images: {str(e)}", exc_info=True)
-        return {'success': False, 'images': [], 'message': f"Error: An unexpected error occurred: {str(e)}"}
+            for page in pending.popleft().result():
+                # Re-run the worker output through the document-wide filter to collapse
+                # repeats across page ranges and apply the image cap
+                images, duplicates = [], []
+                results = [image_filter.process(image['xref'], page['page_num'], lambda: image)
+                           for image in page['images']]
+                results += [image_filter.process_duplicate(ref) for ref in page['duplicate_images']]
+                for kind, item in results:
+                    if kind == 'image':
+                        images.append(item)
+                    elif kind == 'duplicate':
+                        duplicates.append(item)
+                page['images'] = images
+                page['duplicate_images'] = duplicates
+                yield page
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
 
-def extract_pdf_text(pdf_path: str) -> str:
+def iter_pdf_pages(pdf_path: str, extract_text: bool = True, extract_images: bool = True,
+                   max_images: Optional[int] = None, parallel: bool = False, max_workers: Optional[int] = None,
+                   min_parallel_pages: int = PARALLEL_MIN_PAGES, dedupe_images: bool = False,
+                   min_image_size: int = 0) -> Iterator[Dict[str, Any]]:
     """
-    Extracts text content from a PDF file.
+    Streams a PDF one page at a time.
+    
+    The document is opened once with PyMuPDF and only the current page's text and
+    images are held in memory, so callers can stop early or forward each page as it
+    arrives. The document is closed when the generator is exhausted or closed.
+    
+    With parallel=True, documents of at least min_parallel_pages pages are split into
+    page ranges that are extracted on a process pool (each worker opens the PDF by
+    path); pages are still yielded in page order with the same structure.
+    
+    With dedupe_images=True, an image repeated across the document is yielded once, on
+    the first page it appears; later occurrences are listed under 'duplicate_images'
+    and appended to the original image's 'pages' list.
     
     Args:
         pdf_path (str): Path to the PDF file
+        extract_text (bool): Whether to extract page text
+        extract_images (bool): Whether to extract embedded images
+        max_images (Optional[int]): Stop extracting images once this many have been yielded
+        parallel (bool): Allow process-pool extraction for large documents
+        max_workers (Optional[int]): Process pool size (defaults to the CPU count)
+        min_parallel_pages (int): Page count below which extraction stays serial
+        dedupe_images (bool): Collapse repeated images by xref and content hash
+        min_image_size (int): Drop images smaller than this many pixels on either side
         
-    Returns:
-        str: Extracted text content or error message
+    Yields:
+        Dict[str, Any]: One dictionary per page containing:
+            - 'page_num' (int): One-based page number
+            - 'page_count' (int): Number of pages in the PDF
+            - 'text' (str): Page text ('' if text extraction is disabled)
+            - 'images' (list): Raw image dictionaries with:
+                - 'bytes' (bytes): Encoded image data
+                - 'format' (str): Image format (e.g., 'jpeg', 'png')
+                - 'width' / 'height' (int): Pixel dimensions
+                - 'xref' (int): PyMuPDF cross-reference number
+                - 'image_idx' (int): Position of the image on its page
+                - 'page_num' (int): Page number where image was first found
+                - 'pages' (list): Every page the image appears on
+                - 'content_hash' (str): SHA-256 of the image bytes (when deduplicating)
+            - 'duplicate_images' (list): Repeats of earlier images on this page, each with
+              'xref', 'content_hash', 'page_num' and 'first_page'
+            - 'width' / 'height' (float): Page dimensions in points
+            
+    Raises:
+        PDFExtractionError: If the file is missing, unreadable or has no pages
     """
+    if not os.path.exists(pdf_path):
+        raise PDFExtractionError(f"Error: File not found at {pdf_path}")
+    
     try:
-        if not os.path.exists(pdf_path):
-            return f"Error: File not found at {pdf_path}"
-            
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            num_pages = len(pdf_reader.pages)
-            
-            if num_pages == 0:
-                return "Error: PDF has no pages"
-            
-            text = ""
-            for page_num in range(num_pages):
-                page = pdf_reader.pages[page_num]
-                text += page.extract_text() + "\n\n"
-            
-            if not text.strip():
-                return "Warning: No text could be extracted from the PDF. The PDF might be scanned images without OCR or have content restrictions."
-                
-            return text
-            
-    except PyPDF2.errors.PdfReadError:
-        return "Error: The PDF file is corrupted or invalid"
+        doc = fitz.open(pdf_path)
+    except fitz.FileDataError:
+        raise PDFExtractionError("Error: The PDF file is corrupted or invalid")
     except PermissionError:
-        return "Error: Permission denied when trying to access the file"
-    except Exception as e:
-        logger.error(f"Error extracting PDF text: {str(e)}", exc_info=True)
-        return f"Error: An unexpected error occurred: {str(e)}"
+        raise PDFExtractionError("Error: Permission denied when trying to access the file")
+    
+    try:
+        page_count = len(doc)
+        if page_count == 0:
+            raise PDFExtractionError("Error: PDF has no pages")
         
-def extract_pdf_content(pdf_path: str, extract_images: bool = True, images_output_dir: Optional[str] = None) -> Dict[str, Union[bool, str, List[Dict[str, Any]], int]]:
+        image_filter = _ImageFilter(dedupe_images, min_image_size, max_images)
+        workers = max_workers or os.cpu_count() or 1
+        if parallel and workers > 1 and page_count >= min_parallel_pages:
+            doc.close()
+            logger.debug(f"Extracting {page_count} pages from {pdf_path} on {workers} processes")
+            yield from _iter_pages_parallel(pdf_path, page_count, extract_text, extract_images, image_filter, workers)
+            return
+        
+        for page_num, page in enumerate(doc):
+            images, duplicates = [], []
+            if extract_images:
+                images, duplicates = _filter_page_images(
+                    page, page_num, image_filter, lambda xref, img_idx: _load_image(doc, xref, img_idx, page_num)
+                )
+            
+            yield {
+                'page_num': page_num + 1,
+                'page_count': page_count,
+                'text': page.get_text() if extract_text else "",
+                'images': images,
+                'duplicate_images': duplicates,
+                'width': page.rect.width,
+                'height': page.rect.height
+            }
+    finally:
+        if not doc.is_closed:
+            doc.close()
+
+def _export_image(image: Dict[str, Any], output_dir: Optional[str]) -> Dict[str, Any]:
+    """Converts a raw image from iter_pdf_pages into the legacy image dictionary shape."""
+    image_path = None
+    if output_dir:
+        image_filename = f"page{image['page_num']}_img{image['image_idx']+1}_{uuid.uuid4().hex}.{image['format']}"
+        image_path = os.path.join(output_dir, image_filename)
+        with open(image_path, "wb") as f:
+            f.write(image['bytes'])
+    
+    return {
+        'data': base64.b64encode(image['bytes']).decode('utf-8') if not output_dir else None,
+        'format': image['format'],
+        'page_num': image['page_num'],
+        'pages': image.get('pages', [image['page_num']]),
+        'path': image_path
+    }
+
+def extract_pdf_document(pdf_path: str, extract_text: bool = True, extract_images: bool = True,
+                         images_output_dir: Optional[str] = None, parallel: bool = False,
+                         max_workers: Optional[int] = None, min_parallel_pages: int = PARALLEL_MIN_PAGES,
+                         dedupe_images: bool = False,
+                         min_image_size: int = 0) -> Dict[str, Union[bool, str, List[Any], int]]:
     """
-    Extracts both text and images from a PDF file.
+    Single-pass PDF extraction engine.
+    
+    Collects the output of iter_pdf_pages into one result: per-page text, embedded
+    images and the page count, all from a single open of the document. Prefer
+    iter_pdf_pages directly when the whole document does not need to be in memory.
     
     Args:
         pdf_path (str): Path to the PDF file
+        extract_text (bool): Whether to extract text
         extract_images (bool): Whether to extract images
-        images_output_dir (Optional[str]): Directory to save extracted images
+        images_output_dir (Optional[str]): Directory to save extracted images.
+                                           If None, images are returned base64 encoded.
+        parallel (bool): Allow process-pool extraction for large documents
+        max_workers (Optional[int]): Process pool size (defaults to the CPU count)
+        min_parallel_pages (int): Page count below which extraction stays serial
+        dedupe_images (bool): Return repeated images once, with every page they appear on
+        min_image_size (int): Drop images smaller than this many pixels on either side
         
     Returns:
-        Dict[str, Union[bool, str, List[Dict[str, Any]], int]]: Dictionary containing:
-            - 'success' (bool): Whether the extraction was successful
-            - 'text' (str): Extracted text content
+        Dict[str, Union[bool, str, List[Any], int]]: Dictionary containing:
+            - 'success' (bool): Whether the document could be read
+            - 'pages' (list): Extracted text of each page, in page order
+            - 'text' (str): Full text, pages separated by blank lines
             - 'text_status' (str): Text extraction status
             - 'images' (list): List of image data dictionaries
             - 'images_status' (str): Image extraction status
@@ -146,6 +384,7 @@ def extract_pdf_content(pdf_path: str, extract_images: bool = True, images_outpu
     """
     result = {
         'success': False,
+        'pages': [],
         'text': "",
         'text_status': "",
         'images': [],
@@ -154,35 +393,113 @@ def extract_pdf_content(pdf_path: str, extract_images: bool = True, images_outpu
     }
     
     try:
-        if not os.path.exists(pdf_path):
-            result['text_status'] = f"Error: File not found at {pdf_path}"
-            return result
-            
-        text_result = extract_pdf_text(pdf_path)
+        if images_output_dir and extract_images:
+            Path(images_output_dir).mkdir(parents=True, exist_ok=True)
         
-        if text_result.startswith("Error:"):
-            result['text_status'] = text_result
-            return result
-            
-        result['text'] = text_result
-        result['text_status'] = "Text extracted successfully"
+        for page in iter_pdf_pages(pdf_path, extract_text=extract_text, extract_images=extract_images,
+                                   parallel=parallel, max_workers=max_workers,
+                                   min_parallel_pages=min_parallel_pages, dedupe_images=dedupe_images,
+                                   min_image_size=min_image_size):
+            result['page_count'] = page['page_count']
+            if extract_text:
+                result['pages'].append(page['text'])
+            for image in page['images']:
+                result['images'].append(_export_image(image, images_output_dir))
         
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            result['page_count'] = len(pdf_reader.pages)
+        if extract_text:
+            result['text'] = "\n\n".join(result['pages']) + "\n\n"
+            if not result['text'].strip():
+                result['text'] = NO_TEXT_WARNING
+            result['text_status'] = "Text extracted successfully"
         
         if extract_images:
-            images_result = extract_pdf_images(pdf_path, images_output_dir)
-            result['images'] = images_result['images']
-            result['images_status'] = images_result['message']
+            if result['images']:
+                result['images_status'] = f"Successfully extracted {len(result['images'])} images from PDF."
+            else:
+                result['images_status'] = "No images found in the PDF document."
         
         result['success'] = True
         return result
         
+    except PDFExtractionError as e:
+        result['text_status'] = str(e)
+    except PermissionError:
+        result['text_status'] = "Error: Permission denied when trying to access the file"
     except Exception as e:
-        logger.error(f"Error in extract_pdf_content: {str(e)}", exc_info=True)
+        logger.error(f"Unexpected error extracting PDF: {str(e)}", exc_info=True)
         result['text_status'] = f"Error: An unexpected error occurred: {str(e)}"
-        return result
+    
+    result['pages'] = []
+    result['images'] = []
+    result['page_count'] = 0
+    return result
+
+def extract_pdf_images(pdf_path: str, output_dir: Optional[str] = None) -> Dict[str, Union[bool, List[Dict[str, Any]], str]]:
+    """
+    Extracts images from a PDF file using PyMuPDF.
+    
+    Args:
+        pdf_path (str): Path to the PDF file
+        output_dir (Optional[str]): Directory to save extracted images. 
+                                    If None, images are not saved to disk.
+        
+    Returns:
+        Dict[str, Union[bool, List[Dict[str, Any]], str]]: Dictionary containing:
+            - 'success' (bool): Whether the extraction was successful
+            - 'images' (list): List of image data dictionaries with:
+                - 'data' (bytes/str): Image data as bytes or base64 string
+                - 'format' (str): Image format (e.g., 'jpeg', 'png')
+                - 'page_num' (int): Page number where image was found
+                - 'path' (str): Path where image was saved (if output_dir provided)
+            - 'message' (str): Success or error message
+    """
+    result = extract_pdf_document(pdf_path, extract_text=False, extract_images=True, images_output_dir=output_dir)
+    if not result['success']:
+        return {'success': False, 'images': [], 'message': result['text_status']}
+    return {'success': True, 'images': result['images'], 'message': result['images_status']}
+
+def extract_pdf_text(pdf_path: str) -> str:
+    """
+    Extracts text content from a PDF file.
+    
+    Args:
+        pdf_path (str): Path to the PDF file
+        
+    Returns:
+        str: Extracted text content or error message
+    """
+    result = extract_pdf_document(pdf_path, extract_text=True, extract_images=False)
+    if not result['success']:
+        return result['text_status']
+    return result['text']
+        
+def extract_pdf_content(pdf_path: str, extract_images: bool = True, images_output_dir: Optional[str] = None,
+                        parallel: bool = False, max_workers: Optional[int] = None,
+                        min_parallel_pages: int = PARALLEL_MIN_PAGES) -> Dict[str, Union[bool, str, List[Dict[str, Any]], int]]:
+    """
+    Extracts both text and images from a PDF file.
+    
+    Args:
+        pdf_path (str): Path to the PDF file
+        extract_images (bool): Whether to extract images
+        images_output_dir (Optional[str]): Directory to save extracted images
+        parallel (bool): Split pages of large documents across a process pool
+        max_workers (Optional[int]): Process pool size (defaults to the CPU count)
+        min_parallel_pages (int): Page count below which extraction stays serial
+        
+    Returns:
+        Dict[str, Union[bool, str, List[Dict[str, Any]], int]]: Dictionary containing:
+            - 'success' (bool): Whether the extraction was successful
+            - 'text' (str): Extracted text content
+            - 'text_status' (str): Text extraction status
+            - 'pages' (list): Extracted text of each page
+            - 'images' (list): List of image data dictionaries
+            - 'images_status' (str): Image extraction status
+            - 'page_count' (int): Number of pages in the PDF
+    """
+    return extract_pdf_document(pdf_path, extract_text=True, extract_images=extract_images,
+                                images_output_dir=images_output_dir, parallel=parallel,
+                                max_workers=max_workers, min_parallel_pages=min_parallel_pages)
         
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, 
@@ -0,0 +1,337 @@
+import atexit
+import math
+import threading
+import time
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+from flask import current_app, jsonify
+
+from extensions import db
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+
+    Tokens refill continuously at `rate` per second up to `capacity`; callers take tokens
+    before doing rate-limited work and block until enough have accumulated.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        if rate <= 0 or capacity <= 0:
+            raise ValueError("rate and capacity must be positive")
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1) -> Tuple[bool, float]:
+        """
+        Take tokens if available without blocking.
+
+        Returns:
+            Tuple[bool, float]: Whether the tokens were taken, and if not, seconds until they would be
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True, 0.0
+            return False, (tokens - self._tokens) / self.rate
+
+    def refund(self, tokens: float = 1) -> None:
+        """Give back tokens taken for work that did not go ahead."""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + tokens)
+
+    def acquire(self, tokens: float = 1, timeout: Optional[float] = None) -> bool:
+        """
+        Block until tokens are available.
+
+        Args:
+            tokens (float): Tokens to take (capped at the bucket capacity)
+            timeout (Optional[float]): Give up after this many seconds
+
+        Returns:
+            bool: True if the tokens were taken, False on timeout
+        """
+        tokens = min(tokens, self.capacity)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            acquired, wait = self.try_acquire(tokens)
+            if acquired:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+_buckets: Dict[Tuple[str, float, float], TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str, per_minute: float, burst: Optional[float] = None) -> TokenBucket:
+    """Return the process-wide bucket for this name and limit, creating it on first use."""
+    key = (name, float(per_minute), float(burst or per_minute))
+    with _buckets_lock:
+        if key not in _buckets:
+            _buckets[key] = TokenBucket(rate=per_minute / 60.0, capacity=burst or per_minute)
+        return _buckets[key]
+
+
+def get_gemini_rate_limiter() -> TokenBucket:
+    """Shared limiter for all Gemini requests made by this process (GEMINI_RATE_LIMIT_RPM)."""
+    per_minute = current_app.config.get('GEMINI_RATE_LIMIT_RPM', 60)
+    burst = current_app.config.get('GEMINI_RATE_LIMIT_BURST') or max(1, per_minute // 6)
+    return get_rate_limiter('gemini', per_minute, burst)
+
+
+class RateLimitExceeded(Exception):
+    """A user is over their per-user allowance of AI requests or estimated input tokens."""
+
+    def __init__(self, kind: str, limit: str, retry_after: float) -> None:
+        super().__init__(f"Too many AI {limit} for {kind}; retry in {math.ceil(retry_after)}s")
+        self.kind = kind
+        self.limit = limit  # 'requests' or 'tokens'
+        self.retry_after = max(1, math.ceil(retry_after))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'success': False,
+            'error': 'rate_limited',
+            'message': f"You are sending too many AI requests. Please try again in {self.retry_after}s.",
+            'kind': self.kind,
+            'limit': self.limit,
+            'retry_after': self.retry_after
+        }
+
+
+def rate_limit_response(error: RateLimitExceeded) -> Any:
+    """429 JSON response for a rejected AI request, with a Retry-After header."""
+    response = jsonify(error.to_dict())
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+class UserRateLimiter:
+    """
+    Per-user request and input-token buckets for AI work, held in process memory.
+
+    A check touches only the user's two buckets, so it is O(1) and never queries the database.
+    Buckets live in an LRU of at most `max_users` users; the least recently seen user is
+    dropped beyond that (by then their buckets have usually refilled, so nothing is lost).
+    Estimates larger than the token burst are capped at it, so a big document drains the
+    bucket instead of being refused forever.
+    """
+
+    def __init__(self, requests_per_minute: float, request_burst: float, tokens_per_minute: float,
+                 token_burst: float, max_users: int = 10000) -> None:
+        self.requests_per_minute = requests_per_minute
+        self.request_burst = request_burst
+        self.tokens_per_minute = tokens_per_minute
+        self.token_burst = token_burst
+        self.max_users = max(1, max_users)
+        self._users: 'OrderedDict[str, Tuple[TokenBucket, TokenBucket]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _buckets_for(self, user_key: str) -> Tuple[TokenBucket, TokenBucket]:
+        with self._lock:
+            buckets = self._users.get(user_key)
+            if buckets is None:
+                buckets = (TokenBucket(self.requests_per_minute / 60.0, self.request_burst),
+                           TokenBucket(self.tokens_per_minute / 60.0, self.token_burst))
+                self._users[user_key] = buckets
+                if len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            else:
+                self._users.move_to_end(user_key)
+            return buckets
+
+    def check(self, user_key: str, tokens: int) -> Tuple[bool, Optional[str], float]:
+        """
+        Take one request and `tokens` input tokens from the user's buckets if both allow it.
+
+        Returns:
+            Tuple[bool, Optional[str], float]: Whether admitted, and if not, the exhausted limit
+            ('requests' or 'tokens') and seconds until it would admit the request
+        """
+        request_bucket, token_bucket = self._buckets_for(user_key)
+        admitted, wait = request_bucket.try_acquire(1)
+        if not admitted:
+            return False, 'requests', wait
+        admitted, wait = token_bucket.try_acquire(min(tokens, token_bucket.capacity))
+        if not admitted:
+            request_bucket.refund(1)
+            return False, 'tokens', wait
+        return True, None, 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'users': len(self._users)}
+
+
+class UsageRecorder:
+    """
+    Per-user daily AI usage, counted in memory and added to AIUsage rows in the background.
+
+    record() only updates a dict, keeping the database off the request path; a daemon thread
+    adds the counts to the day's rows every `flush_interval` seconds (and at exit) with
+    increments, so several processes can write to the same rows.
+    """
+
+    def __init__(self, flush_interval: float = 30.0) -> None:
+        self.flush_interval = flush_interval
+        self._pending: Dict[Tuple[int, Any, str], Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._app: Any = None
+        self._flusher: Optional[threading.Thread] = None
+        self._stats = {'flushed': 0, 'flush_errors': 0}
+
+    def record(self, user_id: int, kind: str, requests: int = 0, tokens: int = 0, rejected: int = 0) -> None:
+        key = (user_id, datetime.utcnow().date(), kind)
+        with self._lock:
+            counts = self._pending.setdefault(key, {'requests': 0, 'input_tokens': 0, 'rejected': 0})
+            counts['requests'] += requests
+            counts['input_tokens'] += tokens
+            counts['rejected'] += rejected
+        self._start_flusher()
+
+    def flush(self) -> int:
+        """Add pending counts to the AIUsage rows in one transaction. Requires an app context. Returns rows touched."""
+        from models import AIUsage
+
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            try:
+                now = datetime.utcnow()
+                for (user_id, day, kind), counts in batch.items():
+                    updated = AIUsage.query.filter_by(user_id=user_id, day=day, kind=kind).update({
+                        AIUsage.requests: AIUsage.requests + counts['requests'],
+                        AIUsage.input_tokens: AIUsage.input_tokens + counts['input_tokens'],
+                        AIUsage.rejected: AIUsage.rejected + counts['rejected'],
+                        AIUsage.updated_at: now
+                    }, synchronize_session=False)
+                    if not updated:
+                        db.session.add(AIUsage(user_id=user_id, day=day, kind=kind, updated_at=now, **counts))
+                db.session.commit()
+                with self._lock:
+                    self._stats['flushed'] += len(batch)
+                return len(batch)
+            except Exception as e:
+                # A row inserted concurrently by another process lands here too; the retry updates it
+                db.session.rollback()
+                with self._lock:
+                    for key, counts in batch.items():
+                        pending = self._pending.setdefault(key, {'requests': 0, 'input_tokens': 0, 'rejected': 0})
+                        for name, value in counts.items():
+                            pending[name] += value
+                    self._stats['flush_errors'] += 1
+                logger.error(f"Error flushing AI usage for {len(batch)} user/day row(s): {str(e)}")
+                return 0
+
+    def _start_flusher(self) -> None:
+        if self._flusher is not None:
+            return
+        with self._flush_lock:
+            if self._flusher is not None:
+                return
+            self._app = current_app._get_current_object()
+            self._flusher = threading.Thread(target=self._run_flusher, name='ai-usage-flusher', daemon=True)
+            self._flusher.start()
+            atexit.register(self._flush_on_exit)
+
+    def _run_flusher(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            with self._app.app_context():
+                try:
+                    self.flush()
+                finally:
+                    db.session.remove()
+
+    def _flush_on_exit(self) -> None:
+        if self._app is not None:
+            with self._app.app_context():
+                self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, pending=len(self._pending))
+
+
+_user_limiters: Dict[Tuple[float, float, float, float, int], UserRateLimiter] = {}
+_usage_recorder: Optional[UsageRecorder] = None
+
+
+def get_user_rate_limiter() -> UserRateLimiter:
+    """Process-wide per-user limiter for the USER_RATE_LIMIT_* and USER_TOKEN_LIMIT_* settings."""
+    config = current_app.config
+    requests_per_minute = float(config.get('USER_RATE_LIMIT_RPM', 20))
+    tokens_per_minute = float(config.get('USER_TOKEN_LIMIT_TPM', 100000))
+    key = (
+        requests_per_minute,
+        float(config.get('USER_RATE_LIMIT_BURST') or requests_per_minute),
+        tokens_per_minute,
+        float(config.get('USER_TOKEN_LIMIT_BURST') or tokens_per_minute),
+        int(config.get('USER_RATE_LIMIT_MAX_USERS', 10000))
+    )
+    with _buckets_lock:
+        if key not in _user_limiters:
+            _user_limiters[key] = UserRateLimiter(*key)
+        return _user_limiters[key]
+
+
+def get_usage_recorder() -> UsageRecorder:
+    global _usage_recorder
+    with _buckets_lock:
+        if _usage_recorder is None:
+            _usage_recorder = UsageRecorder(float(current_app.config.get('AI_USAGE_FLUSH_INTERVAL', 30)))
+        return _usage_recorder
+
+
+def check_user_rate_limit(user_key: Any, kind: str, tokens: int) -> None:
+    """
+    Admit one AI request for a user, charging it and its estimated input tokens.
+
+    Both buckets are shared by all kinds of AI work (chat, folder_summary, pdf_analysis); the
+    kind is recorded for usage accounting. Usage is recorded only for database users, so
+    anonymous chat connections are limited (by connection) but not accounted.
+
+    Args:
+        user_key (Any): User id, or another stable key for anonymous callers
+        kind (str): Kind of AI work
+        tokens (int): Estimated input tokens of the request
+
+    Raises:
+        RateLimitExceeded: If the user is over either limit
+    """
+    if not current_app.config.get('USER_RATE_LIMIT_ENABLED', True):
+        admitted, limit, wait = True, None, 0.0
+    else:
+        admitted, limit, wait = get_user_rate_limiter().check(str(user_key), tokens)
+    if str(user_key).isdigit():
+        if admitted:
+            get_usage_recorder().record(int(user_key), kind, requests=1, tokens=tokens)
+        else:
+            get_usage_recorder().record(int(user_key), kind, rejected=1)
+    if not admitted:
+        logger.info(f"Rate limited {kind} request for user {user_key}: {limit} (retry in {wait:.1f}s)")
+        raise RateLimitExceeded(kind, limit, wait)
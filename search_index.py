@@ -0,0 +1,225 @@
+import re
+import html
+import time
+import logging
+from typing import Optional, Dict, Iterable, Any, Tuple
+from sqlalchemy import event, text
+
+from extensions import db
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'document_pages_fts'
+
+# Row ids are document_id * PAGE_STRIDE + page_num so a document's pages can be
+# replaced or removed with a rowid range instead of scanning the FTS table
+PAGE_STRIDE = 100_000
+
+TEXT_FILE_TYPES = {'txt', 'md', 'csv', 'json', 'xml', 'html'}
+
+# Private-use markers for snippet highlighting, swapped for <mark> after HTML escaping
+_MARK_START, _MARK_END = '\x02', '\x03'
+
+
+def is_supported() -> bool:
+    """Full-text search needs SQLite with the FTS5 extension."""
+    return db.engine.dialect.name == 'sqlite'
+
+
+def ensure_search_index() -> bool:
+    """
+    Create the FTS5 table holding per-page document text if it does not exist.
+
+    The user is stored as an indexed token column ('u<id>') so queries are scoped to one
+    user inside the full-text index rather than by filtering the matches afterwards.
+
+    Returns:
+        bool: Whether the search index is available
+    """
+    if not is_supported():
+        logger.warning("Full-text search requires SQLite; search index disabled")
+        return False
+    try:
+        db.session.execute(text(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+                text,
+                user_tag,
+                document_id UNINDEXED,
+                page_num UNINDEXED,
+                tokenize = 'porter unicode61 remove_diacritics 2'
+            )
+        """))
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error creating search index: {str(e)}")
+        return False
+
+
+def _user_tag(user_id: int) -> str:
+    return f"u{user_id}"
+
+
+def iter_document_pages(document: Any) -> Iterable[Tuple[int, str]]:
+    """
+    Yield (page_num, text) for a document's searchable text.
+
+    Ingested documents are read from their stored DocumentPage rows. Otherwise PDFs are read
+    through the extraction cache and text-like files are indexed as a single page; other file
+    types have no searchable text.
+    """
+    stored_pages = document.get_page_texts()
+    if stored_pages is not None:
+        yield from stored_pages
+        return
+    file_path = document.get_file_path()
+    if not file_path or not file_path.exists():
+        return
+    file_type = (document.file_type or '').lower()
+    if file_type == 'pdf':
+        from pdf_cache import iter_cached_pdf_pages
+        for page in iter_cached_pdf_pages(str(file_path), document.content_hash, extract_images=False):
+            yield page['page_num'], page['text']
+    elif file_type in TEXT_FILE_TYPES:
+        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+            yield 1, f.read()
+
+
+def _replace_pages(document_id: int, user_id: int, pages: Iterable[Tuple[int, str]]) -> int:
+    """Replace the indexed pages of one document; the caller commits."""
+    base = document_id * PAGE_STRIDE
+    db.session.execute(
+        text(f"DELETE FROM {FTS_TABLE} WHERE rowid BETWEEN :start AND :end"),
+        {'start': base, 'end': base + PAGE_STRIDE - 1}
+    )
+    rows = [
+        {'rowid': base + page_num, 'text': page_text, 'user_tag': _user_tag(user_id),
+         'document_id': document_id, 'page_num': page_num}
+        for page_num, page_text in pages
+        if page_text and page_text.strip() and page_num < PAGE_STRIDE
+    ]
+    if rows:
+        db.session.execute(
+            text(f"INSERT INTO {FTS_TABLE} (rowid, text, user_tag, document_id, page_num) "
+                 f"VALUES (:rowid, :text, :user_tag, :document_id, :page_num)"),
+            rows
+        )
+    return len(rows)
+
+
+def index_document(document: Any, commit: bool = True) -> int:
+    """
+    (Re)index the per-page text of a document.
+
+    Returns:
+        int: Number of pages indexed
+    """
+    page_count = _replace_pages(document.id, document.user_id, iter_document_pages(document))
+    if commit:
+        db.session.commit()
+    logger.debug(f"Indexed {page_count} pages for document {document.id}")
+    return page_count
+
+
+def index_documents(documents: Iterable[Any]) -> int:
+    """
+    Index newly ingested documents, logging rather than raising on failure so an upload
+    never fails because of the search index.
+
+    Returns:
+        int: Number of documents indexed
+    """
+    if not is_supported():
+        return 0
+    indexed = 0
+    for document in documents:
+        try:
+            index_document(document)
+            indexed += 1
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error indexing document {document.id} for search: {str(e)}")
+    return indexed
+
+
+def remove_document(document_id: int, connection: Optional[Any] = None) -> None:
+    """Remove a document's pages from the search index."""
+    base = document_id * PAGE_STRIDE
+    statement = text(f"DELETE FROM {FTS_TABLE} WHERE rowid BETWEEN :start AND :end")
+    params = {'start': base, 'end': base + PAGE_STRIDE - 1}
+    if connection is not None:
+        connection.execute(statement, params)
+    else:
+        db.session.execute(statement, params)
+
+
+def build_match_query(query: str, user_id: int) -> Optional[str]:
+    """
+    Turn free text into a safe FTS5 MATCH expression scoped to one user.
+
+    Every word must match (implicit AND) and the last word is treated as a prefix, so
+    partially typed terms still find results. FTS5 operators in the input are ignored.
+    """
+    terms = re.findall(r'\w+', query.lower())[:16]
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return f'text : ({" ".join(quoted)}) AND user_tag : "{_user_tag(user_id)}"'
+
+
+def _render_snippet(snippet: str) -> str:
+    return html.escape(snippet).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+
+def search(user_id: int, query: str, limit: int = 20, offset: int = 0) -> Dict[str, Any]:
+    """
+    Ranked full-text search over one user's documents.
+
+    Returns:
+        Dict[str, Any]: Dictionary containing:
+            - 'hits' (list): Dictionaries with 'document_id', 'page_num', 'snippet'
+              (HTML with <mark> highlights) and 'score' (lower is better, bm25)
+            - 'took_ms' (float): Query time in milliseconds
+    """
+    started = time.perf_counter()
+    match_query = build_match_query(query, user_id)
+    if not match_query:
+        return {'hits': [], 'took_ms': 0.0}
+
+    rows = db.session.execute(text(f"""
+        SELECT document_id, page_num,
+               snippet({FTS_TABLE}, 0, :mark_start, :mark_end, '…', 16) AS snippet,
+               bm25({FTS_TABLE}, 1.0, 0.0) AS score
+        FROM {FTS_TABLE}
+        WHERE {FTS_TABLE} MATCH :query
+        ORDER BY score
+        LIMIT :limit OFFSET :offset
+    """), {
+        'mark_start': _MARK_START, 'mark_end': _MARK_END,
+        'query': match_query, 'limit': limit, 'offset': offset
+    }).fetchall()
+
+    hits = [{
+        'document_id': row.document_id,
+        'page_num': row.page_num,
+        'snippet': _render_snippet(row.snippet),
+        'score': row.score
+    } for row in rows]
+    return {'hits': hits, 'took_ms': round((time.perf_counter() - started) * 1000, 2)}
+
+
+def _remove_deleted_document(mapper: Any, connection: Any, target: Any) -> None:
+    try:
+        remove_document(target.id, connection)
+    except Exception as e:
+        logger.error(f"Error removing document {target.id} from search index: {str(e)}")
+
+
+def register_search_index_events() -> None:
+    """Keep the search index in sync when documents are deleted through the ORM."""
+    from models import Document
+    if not event.contains(Document, 'after_delete', _remove_deleted_document):
+        event.listen(Document, 'after_delete', _remove_deleted_document)
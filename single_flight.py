@@ -0,0 +1,104 @@
+import hashlib
+import os
+import threading
+import time
+import logging
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from flask import current_app
+
+try:
+    import fcntl
+except ImportError:  # Windows: coalescing is per process only
+    fcntl = None
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+_in_flight: Dict[str, Future] = {}
+_in_flight_lock = threading.Lock()
+
+
+def _lock_path(key: str) -> str:
+    lock_dir = current_app.config.get('SINGLE_FLIGHT_LOCK_DIR') or os.path.join(current_app.instance_path, 'locks')
+    os.makedirs(lock_dir, exist_ok=True)
+    return os.path.join(lock_dir, hashlib.sha256(key.encode()).hexdigest()[:32] + '.lock')
+
+
+@contextmanager
+def _process_lock(key: str, timeout: float) -> Iterator[bool]:
+    """
+    Hold an exclusive file lock for key across processes.
+
+    Yields True once locked, or False if the lock could not be taken within timeout (the
+    caller then runs unlocked rather than failing).
+    """
+    if fcntl is None:
+        yield True
+        return
+    with open(_lock_path(key), 'a') as lock_file:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    logger.warning(f"Timed out waiting for single-flight lock {key}; running without it")
+                    yield False
+                    return
+                time.sleep(0.1)
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def single_flight(key: str, func: Callable[[], Any], reuse: Optional[Callable[[], Any]] = None,
+                  timeout: Optional[float] = None) -> Any:
+    """
+    Run func once for concurrent callers with the same key.
+
+    Within a process, the first caller runs func and later callers wait for its result (or
+    exception). Across processes (gunicorn workers, job workers) callers are serialised by a
+    file lock under instance/locks; a caller that got the lock after another process finished
+    first calls reuse(), which returns the stored result of that run, or None to run func.
+
+    Args:
+        key (str): Identity of the work, e.g. "folder_summary:<folder id>:<folder hash>"
+        func (Callable[[], Any]): Does the work
+        reuse (Optional[Callable[[], Any]]): Looks up a result another process already stored
+        timeout (Optional[float]): Seconds to wait for another process (defaults to SINGLE_FLIGHT_TIMEOUT)
+
+    Returns:
+        Any: func's (or reuse's) result
+    """
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _in_flight[key] = future
+
+    if not leader:
+        logger.debug(f"Waiting for in-flight {key}")
+        return future.result()
+
+    timeout = timeout if timeout is not None else current_app.config.get('SINGLE_FLIGHT_TIMEOUT', 600)
+    try:
+        with _process_lock(key, timeout):
+            result = reuse() if reuse is not None else None
+            if result is None:
+                result = func()
+            else:
+                logger.info(f"Reusing result of {key} from another process")
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _in_flight_lock:
+            _in_flight.pop(key, None)
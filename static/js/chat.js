@@ -1,5 +1,53 @@
 // Chat functionality for Medical Dashboard
 
+// Assembles streamed responses ('response_chunk' / 'response_complete' events).
+// Chunks are applied in sequence order; the completion event carries the full text,
+// so a message still renders correctly if chunks were dropped.
+class ChatStream {
+    constructor({ create, update, finish }) {
+        this.create = create;
+        this.update = update;
+        this.finish = finish;
+        this.messages = new Map();
+    }
+
+    _get(messageId) {
+        let entry = this.messages.get(messageId);
+        if (!entry) {
+            entry = { text: '', nextSeq: 0, pending: new Map(), element: this.create(messageId) };
+            this.messages.set(messageId, entry);
+        }
+        return entry;
+    }
+
+    chunk(data) {
+        const entry = this._get(data.message_id);
+        entry.pending.set(data.seq, data.data);
+        while (entry.pending.has(entry.nextSeq)) {
+            entry.text += entry.pending.get(entry.nextSeq);
+            entry.pending.delete(entry.nextSeq);
+            entry.nextSeq += 1;
+        }
+        this.update(entry.element, entry.text);
+    }
+
+    complete(data) {
+        const entry = this._get(data.message_id);
+        this.messages.delete(data.message_id);
+        this.finish(entry.element, data.data, data);
+    }
+
+    cancel(data) {
+        // Keep whatever text had arrived; nothing more is coming for this message
+        const entry = this.messages.get(data.message_id);
+        if (!entry) return;
+        this.messages.delete(data.message_id);
+        this.finish(entry.element, entry.text, data);
+    }
+}
+
+window.ChatStream = ChatStream;
+
 document.addEventListener('DOMContentLoaded', function() {
     // Check if we're on the chat page
     const chatContainer = document.querySelector('.chat-container');
@@ -40,6 +88,21 @@ document.addEventListener('DOMContentLoaded', function() {
         chatMessages.scrollTop = chatMessages.scrollHeight;
     });
     
+    // Streamed responses: render chunks as they arrive
+    const stream = new ChatStream({
+        create: () => addMessage('', 'ai'),
+        update: (element, text) => {
+            element.querySelector('.message-content').textContent = text;
+            chatMessages.scrollTop = chatMessages.scrollHeight;
+        },
+        finish: (element, text) => {
+            element.querySelector('.message-content').textContent = text;
+            chatMessages.scrollTop = chatMessages.scrollHeight;
+        }
+    });
+    socket.on('response_chunk', (data) => stream.chunk(data));
+    socket.on('response_complete', (data) => stream.complete(data));
+    
     // Send message on form submit
     if (chatForm) {
         chatForm.addEventListener('submit', function(e) {
@@ -121,5 +184,6 @@ document.addEventListener('DOMContentLoaded', function() {
         
         chatMessages.appendChild(messageDiv);
         chatMessages.scrollTop = chatMessages.scrollHeight;
+        return messageDiv;
     }
 });
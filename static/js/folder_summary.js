@@ -101,6 +101,83 @@ document.addEventListener("DOMContentLoaded", function () {
 	const summaryTimestamp = document.getElementById("summaryTimestamp");
 	const errorMessage = document.getElementById("errorMessage");
 
+	// Poll a background job until it finishes; resolves with the job's result
+	function pollJob(jobId, intervalMs = 2000, timeoutMs = 10 * 60 * 1000) {
+		const deadline = Date.now() + timeoutMs;
+		return new Promise((resolve, reject) => {
+			const check = () => {
+				fetch(`/dashboard/jobs/${jobId}`, {
+					headers: { Accept: "application/json" },
+				})
+					.then((response) => {
+						if (!response.ok) {
+							throw new Error(
+								`Server returned ${response.status}: ${response.statusText}`
+							);
+						}
+						return response.json();
+					})
+					.then((job) => {
+						if (job.status === "succeeded") {
+							resolve(job.result);
+						} else if (job.status === "failed") {
+							reject(new Error(job.error || "Summary generation failed"));
+						} else if (Date.now() > deadline) {
+							reject(new Error("Timed out waiting for the summary"));
+						} else {
+							setTimeout(check, intervalMs);
+						}
+					})
+					.catch(reject);
+			};
+			check();
+		});
+	}
+
+	// Show the loading state and wait for a summary job to finish
+	function waitForSummary(jobId, successMessage) {
+		// Show loading state
+		if (summaryContent) summaryContent.classList.add("d-none");
+		if (summaryLoading) summaryLoading.classList.remove("d-none");
+		if (summaryError) summaryError.classList.add("d-none");
+
+		// Disable the button during regeneration
+		regenerateBtn.disabled = true;
+		regenerateBtn.innerHTML =
+			'<span class="spinner-border spinner-border-sm" role="status" aria-hidden="true"></span> Generating...';
+
+		return pollJob(jobId)
+			.then((result) => {
+				// Update the summary content with markdown rendering
+				if (summaryText) {
+					summaryText.innerHTML = renderMarkdown(result.summary);
+				}
+
+				// Update the timestamp
+				if (summaryTimestamp && result.last_updated) {
+					summaryTimestamp.textContent = `Last updated: ${formatTimestamp(
+						result.last_updated
+					)}`;
+				}
+
+				if (successMessage) showMessage(successMessage, "success");
+
+				// Show the content
+				if (summaryContent) summaryContent.classList.remove("d-none");
+			})
+			.catch((error) => {
+				showSummaryError(error.message);
+				console.error("Error generating summary:", error);
+			})
+			.finally(() => {
+				// Hide loading state and restore button
+				if (summaryLoading) summaryLoading.classList.add("d-none");
+				regenerateBtn.disabled = false;
+				regenerateBtn.innerHTML =
+					'<i class="fas fa-sync-alt me-1"></i> Regenerate';
+			});
+	}
+
 	if (regenerateBtn) {
 		regenerateBtn.addEventListener("click", function () {
 			const folderId = this.getAttribute("data-folder-id");
@@ -109,17 +186,9 @@ document.addEventListener("DOMContentLoaded", function () {
 				return;
 			}
 
-			// Show loading state
-			if (summaryContent) summaryContent.classList.add("d-none");
-			if (summaryLoading) summaryLoading.classList.remove("d-none");
-			if (summaryError) summaryError.classList.add("d-none");
-
-			// Disable the button during regeneration
 			regenerateBtn.disabled = true;
-			regenerateBtn.innerHTML =
-				'<span class="spinner-border spinner-border-sm" role="status" aria-hidden="true"></span> Generating...';
 
-			// Make the AJAX request
+			// Queue the regeneration, then poll the job status endpoint
 			fetch(`/dashboard/regenerate_summary/${folderId}`, {
 				method: "POST",
 				headers: {
@@ -129,7 +198,8 @@ document.addEventListener("DOMContentLoaded", function () {
 				},
 			})
 				.then((response) => {
-					if (!response.ok) {
+					// A 429 carries a JSON message saying when to try again
+					if (!response.ok && response.status !== 429) {
 						throw new Error(
 							`Server returned ${response.status}: ${response.statusText}`
 						);
@@ -137,42 +207,23 @@ document.addEventListener("DOMContentLoaded", function () {
 					return response.json();
 				})
 				.then((data) => {
-					if (data.success) {
-						// Update the summary content with markdown rendering
-						if (summaryText) {
-							// Render markdown content
-							const renderedContent = renderMarkdown(data.summary);
-							summaryText.innerHTML = renderedContent;
-						}
-
-						// Update the timestamp
-						if (summaryTimestamp) {
-							summaryTimestamp.textContent = `Last updated: ${formatTimestamp(
-								data.last_updated
-							)}`;
-						}
-
-						// Show success message
-						showMessage("Summary regenerated successfully", "success");
-
-						// Show the content
-						if (summaryContent) summaryContent.classList.remove("d-none");
-					} else {
+					if (!data.success) {
 						throw new Error(data.message || "Failed to regenerate summary");
 					}
+					return waitForSummary(data.job_id, "Summary regenerated successfully");
 				})
 				.catch((error) => {
 					showSummaryError(error.message);
 					console.error("Error regenerating summary:", error);
-				})
-				.finally(() => {
-					// Hide loading state and restore button
-					if (summaryLoading) summaryLoading.classList.add("d-none");
 					regenerateBtn.disabled = false;
-					regenerateBtn.innerHTML =
-						'<i class="fas fa-sync-alt me-1"></i> Regenerate';
 				});
 		});
+
+		// The page queued a refresh because the folder changed; pick it up when it is done
+		const pendingJobId = regenerateBtn.getAttribute("data-job-id");
+		if (pendingJobId) {
+			waitForSummary(pendingJobId, null);
+		}
 	}
 
 	// Helper function to show error message
@@ -30,9 +30,11 @@ class PDFProcessor {
     constructor() {
         // Configuration
         this.config = {
-            processingEndpoint: '/api/process-pdf-images',
+            analyzeEndpoint: '/dashboard/documents',  // POST {analyzeEndpoint}/{id}/analyze queues a job
+            jobStatusEndpoint: '/dashboard/jobs',
+            pollInterval: 2000,
             maxRetries: 2,
-            loadingTimeout: 30000 // 30 seconds timeout
+            loadingTimeout: 300000 // 5 minutes; analysis runs in the background job workers
         };
         
         // State
@@ -124,10 +126,14 @@ class PDFProcessor {
             return;
         }
         
-        // If the file is a PDF, show the process button
+        // If the file is a PDF, pick up the analysis job queued by the page or show the process button
         const fileType = processingContainer.dataset.fileType;
         if (fileType && fileType.toLowerCase() === 'pdf') {
-            this.showProcessButton(documentId);
+            if (window.pdfAnalysisJobId) {
+                this.processPDFImages(documentId, window.pdfAnalysisJobId);
+            } else {
+                this.showProcessButton(documentId);
+            }
         }
     }
     
@@ -151,8 +157,10 @@ class PDFProcessor {
     
     /**
      * Process images from a PDF document
+     * 
+     * Queues a background analysis job (or follows an existing one) and polls its status.
      */
-    processPDFImages(documentId) {
+    processPDFImages(documentId, existingJobId = null) {
         if (this.state.isProcessing) return;
         
         this.state.isProcessing = true;
@@ -167,19 +175,36 @@ class PDFProcessor {
             this.handleProcessingTimeout();
         }, this.config.loadingTimeout);
         
-        // Make the API request
-        fetch(`${this.config.processingEndpoint}/${documentId}`)
-            .then(response => {
-                if (!response.ok) {
+        const jobRequest = existingJobId
+            ? Promise.resolve({ success: true, job_id: existingJobId })
+            : fetch(`${this.config.analyzeEndpoint}/${documentId}/analyze`, {
+                method: 'POST',
+                headers: {
+                    'X-CSRFToken': document.querySelector('input[name="csrf_token"]')?.value
+                }
+            }).then(response => {
+                // A 429 carries a JSON message saying when to try again
+                if (!response.ok && response.status !== 429) {
                     throw new Error(`Status: ${response.status}`);
                 }
                 return response.json();
+            });
+        
+        jobRequest
+            .then(data => {
+                if (!data.success) {
+                    throw new Error(data.message || 'Could not queue PDF analysis');
+                }
+                return this.pollJob(data.job_id);
             })
             .then(data => {
                 this.handleProcessingSuccess(data);
             })
             .catch(error => {
-                this.handleProcessingError(error);
+                // A timeout already rendered its own message
+                if (this.state.isProcessing) {
+                    this.handleProcessingError(error);
+                }
             })
             .finally(() => {
                 clearTimeout(this.state.processingTimer);
@@ -188,6 +213,39 @@ class PDFProcessor {
             });
     }
     
+    /**
+     * Poll a background job until it succeeds or fails
+     * @returns {Promise<Object>} - The job result (same shape as process_pdf_images)
+     */
+    pollJob(jobId) {
+        return new Promise((resolve, reject) => {
+            const check = () => {
+                if (!this.state.isProcessing) {
+                    reject(new Error('Processing cancelled'));
+                    return;
+                }
+                fetch(`${this.config.jobStatusEndpoint}/${jobId}`)
+                    .then(response => {
+                        if (!response.ok) {
+                            throw new Error(`Status: ${response.status}`);
+                        }
+                        return response.json();
+                    })
+                    .then(job => {
+                        if (job.status === 'succeeded') {
+                            resolve(job.result);
+                        } else if (job.status === 'failed') {
+                            reject(new Error(job.error || 'PDF analysis failed'));
+                        } else {
+                            setTimeout(check, this.config.pollInterval);
+                        }
+                    })
+                    .catch(reject);
+            };
+            check();
+        });
+    }
+    
     /**
      * Handle successful processing response
      */
@@ -265,7 +323,7 @@ class PDFProcessor {
                     <div class="card-body">
                         <div class="row">
                             <div class="col-md-6 text-center mb-3">
-                                <img src="data:image/${result.format};base64,${result.image_data}" 
+                                <img src="${this.getResultImageSrc(result)}" 
                                      class="result-image img-fluid" 
                                      alt="Image from page ${result.page_num}"
                                      data-page="${result.page_num}"
@@ -293,6 +351,18 @@ class PDFProcessor {
         this.updateGalleryControls();
     }
     
+    /**
+     * Image source for an analysis result
+     *
+     * Stored job results only reference their images, which are served from the extraction cache.
+     */
+    getResultImageSrc(result) {
+        if (result.image_data) {
+            return `data:image/${result.format};base64,${result.image_data}`;
+        }
+        return `${this.config.analyzeEndpoint}/${encodeURIComponent(this.state.currentDocumentId)}/pdf_images/${result.page_num}/${result.image_idx}`;
+    }
+
     /**
      * Format analysis text with proper styling
      */
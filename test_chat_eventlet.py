@@ -0,0 +1,83 @@
+import json
+import os
+import subprocess
+import sys
+from typing import Any, Dict
+
+# Only the standard library is imported at module level: the worker below runs this file in a
+# fresh interpreter and must monkey-patch with eventlet before Flask and the app are imported.
+
+
+def run_eventlet_worker(db_path: str) -> Dict[str, Any]:
+    """Generate one chat response in an eventlet worker and report what the hub saw."""
+    import eventlet
+    eventlet.monkey_patch()
+
+    from flask import Flask
+    from config import TestingConfig
+    from extensions import db
+    from app import socketio
+    from blueprints.chat.routes import chat_tasks, run_chat_task
+    from models import Message, User
+
+    app = Flask(__name__, instance_path=os.path.join(os.path.dirname(db_path), 'instance'))
+    app.config.from_object(TestingConfig)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{db_path}",
+        LLM_PROVIDER='fake',
+        LLM_FAKE_LATENCY_MS=300,
+        LLM_FAKE_LATENCY_SIGMA=0,
+        LLM_FAKE_CHUNK_DELAY_MS=0,
+        CHAT_STATE_BACKEND='memory',
+        CHAT_STORE_FLUSH_INTERVAL=0.1
+    )
+    db.init_app(app)
+    socketio.init_app(app, async_mode='eventlet')
+
+    with app.app_context():
+        db.create_all()
+        user = User(username='patient', email='patient@example.com', password_hash='x')
+        db.session.add(user)
+        db.session.commit()
+        user_id = str(user.id)
+
+    ticks = []
+
+    def tick() -> None:
+        while True:
+            ticks.append(1)
+            socketio.sleep(0.01)
+
+    ticker = eventlet.spawn(tick)
+    message_id, cancel = chat_tasks.start(user_id, 'sid', 2)
+    task = eventlet.spawn(run_chat_task, app, 'hello', user_id, user_id, f"user:{user_id}", message_id, cancel)
+    task.wait()
+    ticks_during_call = len(ticks)
+
+    # The write-behind flusher must run on the hub for the exchange to reach the database
+    messages = 0
+    for _ in range(50):
+        socketio.sleep(0.1)
+        with app.app_context():
+            messages = Message.query.count()
+            db.session.remove()
+        if messages:
+            break
+    ticker.kill()
+    return {'async_mode': socketio.async_mode, 'ticks_during_call': ticks_during_call, 'messages': messages}
+
+
+def test_chat_response_in_eventlet_worker_keeps_hub_running_and_flushes_history(tmp_path: Any) -> None:
+    repo = os.path.dirname(os.path.abspath(__file__))
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), str(tmp_path / 'chat.db')],
+                               cwd=repo, capture_output=True, text=True, timeout=120)
+    assert completed.returncode == 0, completed.stderr
+    report = json.loads(completed.stdout.strip().splitlines()[-1])
+    assert report['async_mode'] == 'eventlet'
+    # The 300ms fake call ran off the hub: other green threads kept running meanwhile
+    assert report['ticks_during_call'] >= 10
+    assert report['messages'] == 2
+
+
+if __name__ == '__main__':
+    print(json.dumps(run_eventlet_worker(sys.argv[1])))
@@ -0,0 +1,122 @@
+import hashlib
+import os
+from typing import Any, Iterator, List
+
+import pytest
+from flask import Flask
+
+import llm_providers
+from config import TestingConfig
+from context_packer import (IMAGE_TOKENS, MIN_TRUNCATED_TOKENS, PAGE_TEXT_TOKENS, TRUNCATION_MARKER,
+                            estimate_document_tokens, estimate_tokens, make_part, pack_parts)
+from extensions import db
+from models import Document, Folder, FolderSummary, User
+
+IMAGE = {'mime_type': 'image/png', 'data': 'aGVsbG8='}
+
+
+def test_token_estimates() -> None:
+    assert estimate_tokens('') == 0
+    assert estimate_tokens('abcde') == 2
+    assert estimate_tokens(IMAGE) == IMAGE_TOKENS
+    assert estimate_document_tokens(3, 2) == 3 * PAGE_TEXT_TOKENS + 2 * IMAGE_TOKENS
+    # Counts that are not known yet are sized as a single page without images
+    assert estimate_document_tokens(None, None) == PAGE_TEXT_TOKENS
+
+
+def test_parts_are_packed_by_priority_and_returned_in_order() -> None:
+    parts = [
+        make_part(IMAGE, priority=2, label='pdf image'),
+        make_part('a' * 400, priority=0, label='text'),
+        make_part(IMAGE, priority=1, label='image file')
+    ]
+    packed = pack_parts(parts, budget=100 + IMAGE_TOKENS)
+    assert packed['contents'] == [parts[1]['content'], parts[2]['content']]
+    assert packed['tokens'] == 100 + IMAGE_TOKENS
+    assert packed['omitted'] == ['pdf image']
+    assert packed['truncated'] == []
+
+
+def test_text_is_truncated_only_when_enough_budget_is_left() -> None:
+    long_text = 'x' * (MIN_TRUNCATED_TOKENS * 8)
+    packed = pack_parts([make_part(long_text, label='report')], budget=MIN_TRUNCATED_TOKENS)
+    assert packed['truncated'] == ['report']
+    assert packed['contents'][0].endswith(TRUNCATION_MARKER)
+    assert packed['tokens'] <= MIN_TRUNCATED_TOKENS
+
+    packed = pack_parts([make_part(long_text, label='report')], budget=MIN_TRUNCATED_TOKENS - 1)
+    assert (packed['contents'], packed['omitted']) == ([], ['report'])
+    packed = pack_parts([make_part(long_text, label='report')], budget=MIN_TRUNCATED_TOKENS, truncate_text=False)
+    assert packed['omitted'] == ['report']
+
+
+@pytest.fixture
+def app(tmp_path: Any) -> Iterator[Flask]:
+    app = Flask(__name__, instance_path=str(tmp_path), root_path=str(tmp_path))
+    app.config.from_object(TestingConfig)
+    app.config.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'summaries.db'}",
+                      LLM_PROVIDER='fake', LLM_FAKE_LATENCY_MS=0, LLM_FAKE_RESPONSE_WORDS=40)
+    os.makedirs(tmp_path / 'static' / 'uploads')
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+
+
+@pytest.fixture
+def prompts(monkeypatch: Any) -> List[List[Any]]:
+    """Contents of every request sent to the fake model."""
+    sent: List[List[Any]] = []
+    generate_content = llm_providers.FakeModel.generate_content
+
+    def record(self: Any, contents: Any, **kwargs: Any) -> Any:
+        sent.append(list(contents))
+        return generate_content(self, contents, **kwargs)
+
+    monkeypatch.setattr(llm_providers.FakeModel, 'generate_content', record)
+    return sent
+
+
+def add_text_documents(app: Flask, count: int) -> int:
+    user = User(username='doctor', email='doctor@example.com', password_hash='x')
+    db.session.add(user)
+    db.session.commit()
+    folder = Folder(name='Labs', user_id=user.id)
+    db.session.add(folder)
+    db.session.commit()
+    for index in range(count):
+        data = f"Lab results {index}. ".encode() * 100
+        with open(os.path.join(app.root_path, 'static', 'uploads', f'lab{index}.txt'), 'wb') as f:
+            f.write(data)
+        db.session.add(Document(filename=f'lab{index}.txt', original_filename=f'lab{index}.txt', file_type='txt',
+                                file_size=len(data), file_path=f'uploads/lab{index}.txt', user_id=user.id,
+                                folder_id=folder.id, content_hash=hashlib.sha256(data).hexdigest()))
+    db.session.commit()
+    return folder.id
+
+
+def test_folder_over_budget_is_summarized_per_document_then_combined(app: Flask, prompts: List[List[Any]]) -> None:
+    app.config['FOLDER_SUMMARY_INCREMENTAL'] = False
+    app.config['FOLDER_SUMMARY_TOKEN_BUDGET'] = 1500
+    folder_id = add_text_documents(app, 3)
+
+    FolderSummary.generate_summary(folder_id, force_refresh=True)
+    # One map request per document, then the reduce request over their summaries
+    assert len(prompts) == 4
+    reduce_prompt = prompts[-1]
+    assert FolderSummary.REDUCE_PROMPT_NOTE in reduce_prompt[0]
+    assert sum(isinstance(part, str) and part.startswith('Summary of lab') for part in reduce_prompt) == 3
+
+    # Stored per-document summaries are reused
+    prompts.clear()
+    FolderSummary.generate_summary(folder_id, force_refresh=True)
+    assert len(prompts) == 1
+
+
+def test_folder_within_budget_is_sent_in_one_request(app: Flask, prompts: List[List[Any]]) -> None:
+    app.config['FOLDER_SUMMARY_INCREMENTAL'] = False
+    folder_id = add_text_documents(app, 3)
+
+    FolderSummary.generate_summary(folder_id, force_refresh=True)
+    assert len(prompts) == 1
+    assert sum(isinstance(part, str) and part.startswith('File: lab') for part in prompts[0]) == 3
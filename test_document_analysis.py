@@ -0,0 +1,79 @@
+import json
+import os
+from typing import Any, Iterator
+
+import pytest
+from flask import Flask
+
+from config import TestingConfig
+from extensions import db
+from models import DocumentAnalysis, _parse_batch_analyses
+
+
+def test_batch_response_is_parsed_by_image_number() -> None:
+    response = json.dumps([{'image': 2, 'analysis': ' Chest X-ray. '}, {'image': 1, 'analysis': 'ECG strip'}])
+    assert _parse_batch_analyses(response, 2) == {1: 'ECG strip', 2: 'Chest X-ray.'}
+
+
+def test_batch_response_may_be_wrapped_in_a_code_fence() -> None:
+    response = 'Here are the analyses:\n```json\n[{"image": "1", "analysis": "Normal findings"}]\n```'
+    assert _parse_batch_analyses(response, 1) == {1: 'Normal findings'}
+
+
+def test_malformed_and_out_of_range_entries_are_skipped() -> None:
+    response = json.dumps([
+        {'image': 1, 'analysis': 'Kept'},
+        {'image': 3, 'analysis': 'Out of range'},
+        {'image': 0, 'analysis': 'Out of range'},
+        {'image': 'two', 'analysis': 'Not a number'},
+        {'image': 2, 'analysis': '   '},
+        {'image': 2},
+        'not an object'
+    ])
+    # Image 2 is missing, so the caller analyses it on its own
+    assert _parse_batch_analyses(response, 2) == {1: 'Kept'}
+
+
+def test_unparseable_responses_yield_nothing() -> None:
+    assert _parse_batch_analyses('', 2) == {}
+    assert _parse_batch_analyses(None, 2) == {}
+    assert _parse_batch_analyses('No JSON here', 2) == {}
+    assert _parse_batch_analyses('[{"image": 1, "analysis": "cut off', 2) == {}
+    assert _parse_batch_analyses('{"image": 1, "analysis": "not a list"}', 1) == {}
+
+
+@pytest.fixture
+def app(tmp_path: Any) -> Iterator[Flask]:
+    app = Flask(__name__, instance_path=os.path.join(str(tmp_path), 'instance'))
+    app.config.from_object(TestingConfig)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'analyses.db'}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+
+
+def test_image_versions_carry_extraction_options_and_batch_mode() -> None:
+    options = {'dedupe_images': True, 'min_image_size': 48}
+    prompt = DocumentAnalysis.PROMPT_VERSIONS['pdf_image']
+    assert DocumentAnalysis.current_version('pdf_image', 'gemini', options) == f"{prompt}|gemini|d1m48"
+    assert DocumentAnalysis.current_version('pdf_image', 'gemini', options, batch_size=4) == f"{prompt}|gemini|d1m48|b4"
+    assert (DocumentAnalysis.current_version('pdf_image', 'gemini', options, batch_size=4, batch_across_pages=True)
+            == f"{prompt}|gemini|d1m48|b4x")
+    # Text analyses do not depend on which images are read or how they are batched
+    assert (DocumentAnalysis.current_version('pdf_text', 'gemini', options, batch_size=4)
+            == f"{DocumentAnalysis.PROMPT_VERSIONS['pdf_text']}|gemini")
+
+
+def test_stored_analyses_are_only_read_back_under_the_same_version(app: Flask) -> None:
+    single = {'pdf_image': DocumentAnalysis.current_version('pdf_image', 'gemini', batch_size=1)}
+    batched = {'pdf_image': DocumentAnalysis.current_version('pdf_image', 'gemini', batch_size=4)}
+    DocumentAnalysis.store('abc123', single, [('pdf_image', 1, 0, 'Chest X-ray'), ('pdf_image', 2, 1, 'ECG strip')])
+
+    assert DocumentAnalysis.load('abc123', single) == {('pdf_image', 1, 0): 'Chest X-ray', ('pdf_image', 2, 1): 'ECG strip'}
+    assert DocumentAnalysis.load('abc123', batched) == {}
+    assert DocumentAnalysis.load('other', single) == {}
+
+    # Storing the same keys again keeps the existing rows
+    DocumentAnalysis.store('abc123', single, [('pdf_image', 1, 0, 'Chest X-ray')])
+    assert DocumentAnalysis.query.count() == 2
@@ -0,0 +1,117 @@
+from typing import Any, Iterator, List
+
+import pytest
+from flask import Flask
+from google.api_core import exceptions as google_exceptions
+
+import gemini_client
+from config import TestingConfig
+from gemini_client import CircuitBreaker, GeminiUnavailableError, call_gemini
+
+
+class FakeClock:
+    """Stands in for the time module in gemini_client's breaker."""
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: Any) -> FakeClock:
+    fake = FakeClock()
+    monkeypatch.setattr(gemini_client, 'time', fake)
+    return fake
+
+
+def test_breaker_opens_once_enough_recent_calls_fail(clock: FakeClock) -> None:
+    breaker = CircuitBreaker(error_rate=0.5, min_calls=4, window=60, open_seconds=30)
+    for succeeded in (False, False, False):
+        breaker.record(succeeded)
+    # Too few calls to judge the error rate yet
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record(True)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.stats()['rejected'] == 1
+    assert breaker.stats()['opened'] == 1
+
+
+def test_failures_outside_the_window_are_forgotten(clock: FakeClock) -> None:
+    breaker = CircuitBreaker(error_rate=0.5, min_calls=4, window=60, open_seconds=30)
+    for _ in range(3):
+        breaker.record(False)
+    clock.now += 61
+    for succeeded in (False, True, True, True):
+        breaker.record(succeeded)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats()['window_error_rate'] == 0.25
+
+
+def test_half_open_breaker_lets_one_trial_through(clock: FakeClock) -> None:
+    breaker = CircuitBreaker(error_rate=0.5, min_calls=1, window=60, open_seconds=30)
+    breaker.record(False)
+    clock.now += 30
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    # A failed trial opens the breaker for another period
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_released_trial_can_be_taken_again(clock: FakeClock) -> None:
+    breaker = CircuitBreaker(error_rate=0.5, min_calls=1, window=60, open_seconds=30)
+    breaker.record(False)
+    clock.now += 30
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+    breaker.count('cancelled')
+    assert breaker.stats()['cancelled'] == 1
+
+
+@pytest.fixture
+def app(monkeypatch: Any) -> Iterator[Flask]:
+    # A fresh breaker for this test rather than the one shared by the process
+    monkeypatch.setattr(gemini_client, '_breakers', {})
+    app = Flask(__name__)
+    app.config.from_object(TestingConfig)
+    app.config.update(GEMINI_MAX_RETRIES=0, GEMINI_BREAKER_MIN_CALLS=2, GEMINI_BREAKER_OPEN_SECONDS=600)
+    with app.app_context():
+        yield app
+
+
+def test_calls_fail_fast_while_the_breaker_is_open(app: Flask) -> None:
+    calls: List[str] = []
+
+    def unavailable() -> None:
+        calls.append('unavailable')
+        raise google_exceptions.ServiceUnavailable('overloaded')
+
+    def bad_request() -> None:
+        calls.append('bad request')
+        raise google_exceptions.InvalidArgument('blocked prompt')
+
+    # Client errors are the caller's fault and do not count against the API
+    for _ in range(2):
+        with pytest.raises(google_exceptions.InvalidArgument):
+            call_gemini(bad_request)
+    assert gemini_client.get_circuit_breaker().state == CircuitBreaker.CLOSED
+
+    for _ in range(2):
+        with pytest.raises(google_exceptions.ServiceUnavailable):
+            call_gemini(unavailable)
+    assert gemini_client.get_circuit_breaker().state == CircuitBreaker.OPEN
+
+    with pytest.raises(GeminiUnavailableError):
+        call_gemini(unavailable)
+    assert calls == ['bad request'] * 2 + ['unavailable'] * 2
@@ -0,0 +1,53 @@
+import io
+import os
+import time
+from typing import Any, List
+
+from PIL import Image
+
+from image_prep import ImagePreparer
+
+
+def png(seed: int, size: int = 64) -> bytes:
+    buffer = io.BytesIO()
+    Image.effect_noise((size, size), 64 + seed).convert('RGB').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def cached_files(preparer: ImagePreparer) -> List[str]:
+    return sorted(path.name for path in preparer.cache_dir.glob('*/*') if not path.name.endswith('.tmp'))
+
+
+def test_eviction_scans_only_when_the_cache_may_be_over_its_limit(tmp_path: Any, monkeypatch: Any) -> None:
+    preparer = ImagePreparer(str(tmp_path), max_edge=64, image_format='PNG')
+    size = len(preparer.prepare(png(0))['data'])
+    preparer.max_cache_bytes = size * 5
+    scans = []
+    evict = preparer._evict
+    monkeypatch.setattr(preparer, '_evict', lambda: (scans.append(1), evict()))
+
+    for seed in range(1, 4):
+        preparer.prepare(png(seed))
+    # The first store scanned; the next ones fit under the limit
+    assert len(scans) == 0
+    for seed in range(4, 8):
+        preparer.prepare(png(seed))
+    assert scans
+    assert sum(path.stat().st_size for path in tmp_path.glob('*/*')) <= preparer.max_cache_bytes
+
+
+def test_eviction_leaves_files_being_written(tmp_path: Any) -> None:
+    preparer = ImagePreparer(str(tmp_path), max_edge=64, image_format='PNG', max_cache_bytes=1)
+    in_progress = tmp_path / 'ab' / '.0123.tmp'
+    stale = tmp_path / 'ab' / '.4567.tmp'
+    in_progress.parent.mkdir()
+    in_progress.write_bytes(b'x' * 1000)
+    stale.write_bytes(b'x' * 1000)
+    old = time.time() - preparer.STALE_TMP_SECONDS - 60
+    os.utime(stale, (old, old))
+
+    preparer.prepare(png(1))
+    assert in_progress.exists()
+    assert not stale.exists()
+    # Over the limit, so the prepared image itself was evicted
+    assert cached_files(preparer) == []
@@ -0,0 +1,93 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+from flask import Flask
+
+from config import TestingConfig
+from extensions import db
+
+
+def create_app(root: Any, lease_seconds: int) -> Flask:
+    app = Flask(__name__, instance_path=str(root / 'instance'))
+    app.config.from_object(TestingConfig)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{root / 'jobs.db'}"
+    app.config['JOB_LEASE_SECONDS'] = lease_seconds
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def claim_in_thread(app: Flask, worker_id: str) -> Any:
+    """Claim from another thread (its own app context and session), as a second worker would."""
+    from job_queue import claim_next_job
+
+    claimed: List[Any] = []
+
+    def claim() -> None:
+        with app.app_context():
+            job = claim_next_job(worker_id)
+            claimed.append(job.id if job else None)
+            db.session.remove()
+
+    thread = threading.Thread(target=claim)
+    thread.start()
+    thread.join()
+    return claimed[0]
+
+
+def test_running_job_lease_is_renewed(tmp_path: Any, monkeypatch: Any) -> None:
+    from job_queue import JOB_HANDLERS, claim_next_job, enqueue_job, run_job
+    from models import BackgroundJob
+
+    app = create_app(tmp_path, lease_seconds=3)
+    reclaimed: List[Any] = []
+
+    def slow(payload: Dict[str, Any]) -> Dict[str, Any]:
+        # Outlive the lease several times over while another worker keeps trying to claim
+        for _ in range(5):
+            time.sleep(1.5)
+            reclaimed.append(claim_in_thread(app, 'second'))
+        return {'done': True}
+
+    monkeypatch.setitem(JOB_HANDLERS, 'slow', slow)
+    with app.app_context():
+        job_id = enqueue_job('slow').id
+        run_job(claim_next_job('first'))
+        job = db.session.get(BackgroundJob, job_id)
+        assert reclaimed == [None] * 5
+        assert (job.status, job.attempts, job.result_data) == (BackgroundJob.STATUS_SUCCEEDED, 1, {'done': True})
+
+
+def test_worker_that_lost_its_claim_does_not_record_an_outcome(tmp_path: Any, monkeypatch: Any) -> None:
+    from job_queue import JOB_HANDLERS, claim_next_job, enqueue_job, run_job
+    from models import BackgroundJob
+
+    app = create_app(tmp_path, lease_seconds=900)
+    runs: List[str] = []
+
+    def stalls(payload: Dict[str, Any]) -> Dict[str, Any]:
+        runs.append('run')
+        if len(runs) == 1:
+            # Simulate a stalled first worker: its lease expires and a second worker takes over
+            with app.app_context():
+                job = BackgroundJob.query.one()
+                job.locked_at = datetime.utcnow() - timedelta(hours=1)
+                db.session.commit()
+            assert claim_in_thread(app, 'second') is not None
+        return {'run': len(runs)}
+
+    monkeypatch.setitem(JOB_HANDLERS, 'stalls', stalls)
+    with app.app_context():
+        job_id = enqueue_job('stalls').id
+        run_job(claim_next_job('first'))
+        job = db.session.get(BackgroundJob, job_id)
+        db.session.refresh(job)
+        # The first worker's late result was dropped: the job still belongs to the second claim
+        assert (job.status, job.locked_by, job.attempts, job.result) == (BackgroundJob.STATUS_RUNNING, 'second', 2, None)
+
+        run_job(job)
+        db.session.refresh(job)
+        assert (job.status, job.result_data) == (BackgroundJob.STATUS_SUCCEEDED, {'run': 2})
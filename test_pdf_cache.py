@@ -0,0 +1,52 @@
+import os
+import time
+from typing import Any, List
+
+from pdf_cache import PDFExtractionCache
+
+
+def store(cache: PDFExtractionCache, key: str, text_bytes: int = 2000) -> None:
+    writer = cache.writer(key)
+    writer.add_page({'page_num': 1, 'text': 'x' * text_bytes, 'images': [], 'width': 612, 'height': 792})
+    writer.commit()
+
+
+def keys(cache: PDFExtractionCache) -> List[str]:
+    return sorted(path.parent.name for path in cache.root.glob(f'*/*/{cache.MANIFEST}')
+                  if path.parent.parent.name != 'tmp')
+
+
+def test_stores_scan_for_eviction_only_when_the_cache_may_be_full(tmp_path: Any, monkeypatch: Any) -> None:
+    cache = PDFExtractionCache(str(tmp_path), max_bytes=10 ** 6)
+    store(cache, 'aa00')
+    cache.max_bytes = 5 * sum(f.stat().st_size for f in cache._entry_dir('aa00').iterdir())
+    scans = []
+    evict = cache.evict
+    monkeypatch.setattr(cache, 'evict', lambda: (scans.append(1), evict())[1])
+
+    for index in range(1, 4):
+        store(cache, f'aa0{index}')
+    assert scans == []
+    for index in range(4, 8):
+        store(cache, f'aa0{index}')
+    assert scans
+    # Least recently used entries went first, down to the low-water mark
+    assert keys(cache)[-1] == 'aa07' and 'aa00' not in keys(cache)
+    assert len(keys(cache)) <= 5
+
+
+def test_eviction_leaves_entries_being_written(tmp_path: Any) -> None:
+    cache = PDFExtractionCache(str(tmp_path), max_bytes=1)
+    in_progress = cache.writer('bb00')
+    in_progress.add_page({'page_num': 1, 'text': 'x' * 2000, 'images': [], 'width': 612, 'height': 792})
+    # A writer that has written its manifest but not yet moved it into place
+    (in_progress.tmp_dir / cache.MANIFEST).write_text('{}')
+    abandoned = cache.writer('bb01')
+    old = time.time() - cache.STALE_TMP_SECONDS - 60
+    os.utime(abandoned.tmp_dir, (old, old))
+
+    store(cache, 'bb02')
+    assert in_progress.tmp_dir.exists()
+    assert not abandoned.tmp_dir.exists()
+    # Over the limit, so the stored entry itself was evicted
+    assert keys(cache) == []
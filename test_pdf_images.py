@@ -0,0 +1,108 @@
+import hashlib
+import io
+from typing import Any, Dict, Tuple
+
+import fitz
+from flask import Flask
+from PIL import Image
+
+from config import TestingConfig
+from extensions import db, login_manager
+
+
+def png(size: Tuple[int, int], color: Tuple[int, int, int]) -> bytes:
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def write_pdf(path: str) -> None:
+    """
+    Three pages whose first image is filtered out on the later pages: a logo repeated on every
+    page (deduplicated after page 1) and a tiny icon (below PDF_MIN_IMAGE_SIZE) on page 3.
+    """
+    logo = png((100, 100), (200, 0, 0))
+    doc = fitz.open()
+    for extra in (None, png((120, 100), (0, 200, 0)), png((140, 100), (0, 0, 200))):
+        page = doc.new_page()
+        if extra is not None and page.number == 2:
+            page.insert_image(fitz.Rect(10, 10, 30, 30), stream=png((16, 16), (90, 90, 90)))
+        page.insert_image(fitz.Rect(10, 50, 110, 150), stream=logo)
+        if extra is not None:
+            page.insert_image(fitz.Rect(10, 200, 130, 300), stream=extra)
+    doc.save(path)
+
+
+def create_app(root: Any) -> Flask:
+    """Minimal app with the dashboard, the fake LLM provider and a private extraction cache."""
+    from blueprints.dashboard.routes import dashboard
+
+    app = Flask(__name__, root_path=str(root), instance_path=str(root / 'instance'))
+    app.config.from_object(TestingConfig)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{root / 'test.db'}",
+        SECRET_KEY='test',
+        PDF_CACHE_DIR=str(root / 'pdf_cache'),
+        PDF_DEDUPE_IMAGES=True,
+        PDF_MIN_IMAGE_SIZE=48,
+        LLM_PROVIDER='fake',
+        LLM_FAKE_LATENCY_MS=0
+    )
+    db.init_app(app)
+    login_manager.init_app(app)
+    app.register_blueprint(dashboard, url_prefix='/dashboard')
+    return app
+
+
+def test_analysis_results_reference_the_images_the_route_serves(tmp_path: Any, monkeypatch: Any) -> None:
+    from models import Document, User
+
+    (tmp_path / 'static' / 'uploads').mkdir(parents=True)
+    pdf_path = tmp_path / 'static' / 'uploads' / 'scan.pdf'
+    write_pdf(str(pdf_path))
+    data = pdf_path.read_bytes()
+
+    analysed: Dict[Tuple[int, int], bytes] = {}
+    analyse = Document._analyze_pdf_image
+
+    def record(self: Document, model: Any, page_num: int, img_idx: int, image: Dict[str, Any], page_text: Any) -> Any:
+        analysed[(page_num, img_idx)] = image['bytes']
+        return analyse(self, model, page_num, img_idx, image, page_text)
+
+    monkeypatch.setattr(Document, '_analyze_pdf_image', record)
+
+    app = create_app(tmp_path)
+    with app.app_context():
+        db.create_all()
+        user = User(username='owner', email='owner@example.com', password_hash='x')
+        other = User(username='other', email='other@example.com', password_hash='x')
+        db.session.add_all([user, other])
+        db.session.commit()
+        document = Document(filename='scan.pdf', original_filename='scan.pdf', file_type='pdf',
+                            file_size=len(data), file_path='uploads/scan.pdf', user_id=user.id,
+                            content_hash=hashlib.sha256(data).hexdigest())
+        db.session.add(document)
+        db.session.commit()
+        result = document.process_pdf_images(from_flask_login=False)
+        user_id, other_id, document_id = user.id, other.id, document.id
+
+    assert result['success'], result['message']
+    items = [(item['page_num'], item['image_idx']) for item in result['results']]
+    # The repeated logo (and on page 3 the icon) come first, so the real images keep their page positions
+    assert items == [(1, 0), (2, 1), (3, 2)]
+    assert sorted(analysed) == items
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+    for page_num, image_idx in items:
+        response = client.get(f'/dashboard/documents/{document_id}/pdf_images/{page_num}/{image_idx}')
+        assert response.status_code == 200
+        assert response.mimetype == 'image/png'
+        assert response.data == analysed[(page_num, image_idx)]
+    # Filtered positions do not resolve to a different image
+    assert client.get(f'/dashboard/documents/{document_id}/pdf_images/2/0').status_code == 404
+
+    with client.session_transaction() as session:
+        session['_user_id'] = str(other_id)
+    assert client.get(f'/dashboard/documents/{document_id}/pdf_images/1/0').status_code == 404
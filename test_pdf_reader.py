@@ -0,0 +1,129 @@
+import io
+from typing import Any, Callable, Dict, List, Optional
+
+import fitz
+from PIL import Image
+
+from pdf_reader import _ImageFilter, iter_pdf_pages
+
+
+def loader(data: bytes, page_num: int, size: int = 100, calls: Optional[List[bytes]] = None) -> Callable[[], Dict[str, Any]]:
+    """A load() callback for one image occurrence, recording that it was called."""
+    def load() -> Dict[str, Any]:
+        if calls is not None:
+            calls.append(data)
+        return {'page_num': page_num, 'image_idx': 0, 'bytes': data, 'format': 'png', 'width': size, 'height': size}
+    return load
+
+
+def test_repeats_are_collapsed_by_xref_without_loading_them_again() -> None:
+    image_filter = _ImageFilter(dedupe=True)
+    calls: List[bytes] = []
+    kind, logo = image_filter.process(7, 1, loader(b'logo', 1, calls=calls))
+    assert kind == 'image'
+
+    kind, ref = image_filter.process(7, 2, loader(b'logo', 2, calls=calls))
+    assert kind == 'duplicate'
+    assert ref == {'xref': 7, 'content_hash': logo['content_hash'], 'page_num': 2, 'first_page': 1}
+    assert calls == [b'logo']
+    assert logo['pages'] == [1, 2]
+    assert image_filter.count == 1
+
+
+def test_repeats_under_another_xref_are_collapsed_by_content_hash() -> None:
+    image_filter = _ImageFilter(dedupe=True)
+    _, logo = image_filter.process(7, 1, loader(b'logo', 1))
+    kind, ref = image_filter.process(9, 3, loader(b'logo', 3))
+    assert (kind, ref['xref'], ref['first_page']) == ('duplicate', 9, 1)
+    assert image_filter.process(11, 3, loader(b'scan', 3))[0] == 'image'
+    assert logo['pages'] == [1, 3]
+
+
+def test_without_dedupe_every_occurrence_is_kept() -> None:
+    image_filter = _ImageFilter()
+    assert image_filter.process(7, 1, loader(b'logo', 1))[0] == 'image'
+    assert image_filter.process(7, 2, loader(b'logo', 2))[0] == 'image'
+    assert image_filter.count == 2
+
+
+def test_images_below_min_size_are_dropped_along_with_their_repeats() -> None:
+    image_filter = _ImageFilter(dedupe=True, min_size=48)
+    calls: List[bytes] = []
+    assert image_filter.process(3, 1, loader(b'icon', 1, size=16, calls=calls)) == (None, None)
+    assert image_filter.process(3, 2, loader(b'icon', 2, size=16, calls=calls)) == (None, None)
+    # The xref is remembered as filtered, so the repeat is not decoded again
+    assert calls == [b'icon']
+    assert image_filter.process(4, 2, loader(b'chart', 2, size=48))[0] == 'image'
+    assert image_filter.count == 1
+
+
+def test_max_images_caps_unique_images_but_still_records_repeats() -> None:
+    image_filter = _ImageFilter(dedupe=True, max_images=1)
+    _, logo = image_filter.process(7, 1, loader(b'logo', 1))
+    assert image_filter.full
+    assert image_filter.process(8, 2, loader(b'scan', 2)) == (None, None)
+    assert image_filter.process(7, 3, loader(b'logo', 3))[0] == 'duplicate'
+    assert logo['pages'] == [1, 3]
+
+
+def test_worker_duplicates_are_matched_by_xref_then_content_hash() -> None:
+    image_filter = _ImageFilter(dedupe=True)
+    _, logo = image_filter.process(7, 1, loader(b'logo', 1))
+    # A parallel worker collapsed a repeat under an xref this filter has not seen
+    kind, ref = image_filter.process_duplicate({'xref': 12, 'content_hash': logo['content_hash'], 'page_num': 40})
+    assert (kind, ref['first_page']) == ('duplicate', 1)
+    assert image_filter.process_duplicate({'xref': 12, 'content_hash': logo['content_hash'], 'page_num': 41})[0] == 'duplicate'
+    assert logo['pages'] == [1, 40, 41]
+    # A repeat of an image the filter never kept is dropped
+    assert image_filter.process_duplicate({'xref': 13, 'content_hash': 'unknown', 'page_num': 42}) == (None, None)
+
+
+def png(color: Any) -> bytes:
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def write_pdf(path: str, pages: int) -> None:
+    """
+    Every page carries the same logo and some a scan. Pages are merged from separate documents,
+    so each copy of the logo has its own xref and can only be matched by content hash.
+    """
+    logo = png((200, 10, 10))
+    doc = fitz.open()
+    for index in range(pages):
+        single = fitz.open()
+        page = single.new_page()
+        page.insert_text((72, 300), f"Page {index + 1} results")
+        page.insert_image(fitz.Rect(0, 0, 100, 100), stream=logo)
+        if index % 3 == 0:
+            page.insert_image(fitz.Rect(100, 100, 200, 200), stream=png((10, 10 * index, 200)))
+        doc.insert_pdf(single)
+    doc.save(path)
+
+
+def extract(path: str, **options: Any) -> List[Dict[str, Any]]:
+    # Read every page first: an image's 'pages' grows as its repeats are reached
+    pages = list(iter_pdf_pages(path, dedupe_images=True, **options))
+    return [
+        {
+            'page_num': page['page_num'],
+            'text': page['text'],
+            'images': [(image['image_idx'], image['bytes'], sorted(image['pages'])) for image in page['images']],
+            'duplicates': [(ref['page_num'], ref['first_page']) for ref in page['duplicate_images']]
+        }
+        for page in pages
+    ]
+
+
+def test_parallel_extraction_matches_serial(tmp_path: Any) -> None:
+    path = str(tmp_path / 'report.pdf')
+    write_pdf(path, pages=20)
+    parallel = {'parallel': True, 'min_parallel_pages': 1, 'max_workers': 2}
+
+    serial_pages = extract(path)
+    assert len(serial_pages) == 20
+    assert serial_pages[0]['images'][0][2] == list(range(1, 21))
+    assert extract(path, **parallel) == serial_pages
+    # The cap applies across page ranges exactly as in a serial run
+    assert extract(path, max_images=2, **parallel) == extract(path, max_images=2)
@@ -0,0 +1,77 @@
+from typing import Any, List
+
+import pytest
+
+import rate_limiter
+from rate_limiter import TokenBucket
+
+
+class FakeTime:
+    """Stands in for the time module in rate_limiter: sleeping advances the clock instantly."""
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+        self.sleeps: List[float] = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch: Any) -> FakeTime:
+    fake = FakeTime()
+    monkeypatch.setattr(rate_limiter, 'time', fake)
+    return fake
+
+
+def test_bucket_allows_a_burst_then_reports_the_wait(clock: FakeTime) -> None:
+    bucket = TokenBucket(rate=2.0, capacity=3)
+    assert [bucket.try_acquire()[0] for _ in range(3)] == [True, True, True]
+    assert bucket.try_acquire() == (False, 0.5)
+    assert bucket.try_acquire(2) == (False, 1.0)
+
+
+def test_bucket_refills_at_its_rate_up_to_capacity(clock: FakeTime) -> None:
+    bucket = TokenBucket(rate=2.0, capacity=3)
+    bucket.try_acquire(3)
+    clock.now += 1.0
+    assert bucket.try_acquire(2) == (True, 0.0)
+    assert not bucket.try_acquire()[0]
+
+    clock.now += 60.0
+    assert bucket.try_acquire(3)[0]
+    assert not bucket.try_acquire()[0]
+
+
+def test_refund_returns_tokens_without_exceeding_capacity(clock: FakeTime) -> None:
+    bucket = TokenBucket(rate=1.0, capacity=2)
+    bucket.try_acquire(2)
+    bucket.refund(1)
+    assert bucket.try_acquire() == (True, 0.0)
+    bucket.refund(5)
+    assert bucket.try_acquire(2)[0]
+    assert not bucket.try_acquire()[0]
+
+
+def test_acquire_blocks_until_tokens_refill_or_the_timeout(clock: FakeTime) -> None:
+    bucket = TokenBucket(rate=4.0, capacity=1)
+    assert bucket.acquire()
+    assert bucket.acquire()
+    assert clock.sleeps == [0.25]
+
+    bucket.acquire()
+    assert not bucket.acquire(timeout=0.1)
+    # Requests larger than the bucket are capped at its capacity instead of waiting forever
+    clock.now += 1.0
+    assert bucket.acquire(tokens=10, timeout=0)
+
+
+def test_bucket_rejects_non_positive_limits() -> None:
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0, capacity=1)
+    with pytest.raises(ValueError):
+        TokenBucket(rate=1, capacity=0)
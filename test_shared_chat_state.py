@@ -0,0 +1,126 @@
+import multiprocessing
+import os
+from typing import Any, Dict, List
+
+from flask import Flask
+
+from config import TestingConfig
+from extensions import db
+
+
+def create_worker_app(db_path: str) -> Flask:
+    """Minimal app over a SQLite file shared by every worker process."""
+    app = Flask(__name__, instance_path=os.path.join(os.path.dirname(db_path), 'instance'))
+    app.config.from_object(TestingConfig)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{db_path}"
+    app.config['CHAT_STATE_BACKEND'] = 'shared'
+    app.config['CHAT_HISTORY_MESSAGES'] = 50
+    db.init_app(app)
+    return app
+
+
+def run_worker(name: str, db_path: str, commands: Any, results: Any) -> None:
+    """
+    Serve commands from the test like a worker process would serve chat messages.
+
+    Each command is (action, user_id, text): 'append' records an exchange and then reports the
+    history, 'history' only reports it. None stops the worker.
+    """
+    from conversation_store import get_conversation_store
+
+    app = create_worker_app(db_path)
+    with app.app_context():
+        store = get_conversation_store()
+        for action, user_id, text in iter(commands.get, None):
+            try:
+                if action == 'append':
+                    store.append_exchange(user_id, [text], f"{name} reply to {text}")
+                results.put([turn['parts'][0] for turn in store.get_history(user_id)])
+            except Exception as e:
+                results.put(e)
+
+
+class Worker:
+    def __init__(self, context: Any, name: str, db_path: str) -> None:
+        self.commands = context.Queue()
+        self.results = context.Queue()
+        self.process = context.Process(target=run_worker, args=(name, db_path, self.commands, self.results))
+        self.process.start()
+
+    def send(self, action: str, user_id: str, text: str = '') -> List[str]:
+        self.commands.put((action, user_id, text))
+        result = self.results.get(timeout=30)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def stop(self) -> None:
+        self.commands.put(None)
+        self.process.join(timeout=30)
+
+
+def seed_users(db_path: str, count: int) -> List[str]:
+    from models import User
+
+    app = create_worker_app(db_path)
+    with app.app_context():
+        db.create_all()
+        users = [User(username=f'user{i}', email=f'user{i}@example.com', password_hash='x') for i in range(count)]
+        db.session.add_all(users)
+        db.session.commit()
+        return [str(user.id) for user in users]
+
+
+def test_history_is_shared_between_worker_processes(tmp_path: Any) -> None:
+    db_path = str(tmp_path / 'shared.db')
+    user_id, other_user_id = seed_users(db_path, 2)
+    context = multiprocessing.get_context('spawn')
+    first = Worker(context, 'first', db_path)
+    second = Worker(context, 'second', db_path)
+    try:
+        # Both workers read (and cache) the empty history first
+        assert first.send('history', user_id) == []
+        assert second.send('history', user_id) == []
+
+        assert first.send('append', user_id, 'hello') == ['hello', 'first reply to hello']
+        # The second worker sees the first worker's write despite its cached copy
+        assert second.send('append', user_id, 'again') == [
+            'hello', 'first reply to hello', 'again', 'second reply to again']
+        assert first.send('history', user_id) == [
+            'hello', 'first reply to hello', 'again', 'second reply to again']
+
+        # Other users' histories are unaffected
+        assert second.send('history', other_user_id) == []
+    finally:
+        first.stop()
+        second.stop()
+
+
+def test_concurrent_writes_from_both_workers_are_all_kept(tmp_path: Any) -> None:
+    from models import ChatSession, Message
+
+    db_path = str(tmp_path / 'shared.db')
+    user_id, = seed_users(db_path, 1)
+    context = multiprocessing.get_context('spawn')
+    workers = [Worker(context, 'first', db_path), Worker(context, 'second', db_path)]
+    rounds = 5
+    try:
+        for index in range(rounds):
+            # Both workers write before either result is read
+            for worker in workers:
+                worker.commands.put(('append', user_id, f'{worker.process.name}-{index}'))
+            for worker in workers:
+                result = worker.results.get(timeout=30)
+                assert not isinstance(result, Exception), result
+
+        histories: Dict[int, List[str]] = {i: worker.send('history', user_id) for i, worker in enumerate(workers)}
+        assert histories[0] == histories[1]
+        assert len(histories[0]) == 4 * rounds
+    finally:
+        for worker in workers:
+            worker.stop()
+
+    app = create_worker_app(db_path)
+    with app.app_context():
+        assert ChatSession.query.filter_by(user_id=int(user_id)).one().version == 2 * rounds
+        assert Message.query.count() == 4 * rounds
@@ -0,0 +1,89 @@
+import threading
+import time
+from typing import Any, Dict, Iterator, List
+
+import pytest
+from flask import Flask
+
+from config import TestingConfig
+from single_flight import _process_lock, single_flight
+
+
+@pytest.fixture
+def app(tmp_path: Any) -> Iterator[Flask]:
+    app = Flask(__name__, instance_path=str(tmp_path))
+    app.config.from_object(TestingConfig)
+    app.config['SINGLE_FLIGHT_LOCK_DIR'] = str(tmp_path / 'locks')
+    yield app
+
+
+def run_in_threads(app: Flask, count: int, target: Any) -> List[Any]:
+    """Call target() from count threads inside app contexts, returning results or exceptions."""
+    results: List[Any] = [None] * count
+
+    def worker(index: int) -> None:
+        with app.app_context():
+            try:
+                results[index] = target()
+            except Exception as e:
+                results[index] = e
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    return results
+
+
+def test_concurrent_callers_share_one_run(app: Flask) -> None:
+    calls: List[int] = []
+
+    def summarize() -> str:
+        calls.append(1)
+        time.sleep(0.2)
+        return 'summary'
+
+    results = run_in_threads(app, 5, lambda: single_flight('folder_summary:1:abc', summarize))
+    assert results == ['summary'] * 5
+    assert calls == [1]
+
+    # Once finished, the next caller runs again rather than reading a cached result
+    with app.app_context():
+        assert single_flight('folder_summary:1:abc', summarize) == 'summary'
+    assert calls == [1, 1]
+
+
+def test_waiting_callers_receive_the_leaders_exception(app: Flask) -> None:
+    def fail() -> None:
+        time.sleep(0.2)
+        raise RuntimeError('Gemini unavailable')
+
+    results = run_in_threads(app, 3, lambda: single_flight('pdf_analysis:7', fail))
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_result_stored_by_another_process_is_reused(app: Flask) -> None:
+    stored: Dict[str, str] = {}
+    results: List[Any] = []
+    calls: List[int] = []
+
+    def summarize() -> str:
+        calls.append(1)
+        return 'fresh summary'
+
+    def wait_for_lock() -> None:
+        with app.app_context():
+            results.append(single_flight('folder_summary:2:def', summarize, reuse=lambda: stored.get('summary')))
+
+    with app.app_context():
+        # Another process holds the lock while it summarizes and stores the result
+        with _process_lock('folder_summary:2:def', timeout=1):
+            waiting = threading.Thread(target=wait_for_lock)
+            waiting.start()
+            time.sleep(0.2)
+            stored['summary'] = 'stored summary'
+        waiting.join(timeout=10)
+
+    assert results == ['stored summary']
+    assert calls == []